@@ -0,0 +1,333 @@
+# ! /usr/bin/env python2.5
+
+"""
+GENERATE_INPUTS MODULE
+======================
+A module that writes synthetic alignment files in the formats read by
+the loaders, together with a FASTA file of the aligned sequences, so the
+loaders can be benchmarked on inputs of any size. The module does not
+define any class.
+
+Functions:
+
+- `random_sequences()`: make random DNA sequences
+- `make_chain()`: make the ungapped blocks of a gapped local alignment
+  between two sequences
+- `make_aligned_rows()`: make the gapped rows of a multiple alignment
+- `write_fasta()`: write sequences to a FASTA file
+- `write_lav()`: write local alignments as a blastz lav file
+- `write_psl()`: write local alignments as a blat PSL file
+- `write_clustalw()`: write aligned rows as a clustalw .aln file
+- `write_aligned_fasta()`: write aligned rows as a (m)lagan aligned
+  FASTA file
+- `generate()`: write the alignment and sequence files of one format
+
+The inputs are tuned by:
+
+- size: the number of local alignments (lav, psl) or of alignment
+  columns (clustalw, lagan, mlagan)
+- nSeqs: the number of sequences (always 2 for lagan)
+- seqLength: the length of the sequences of the local alignments
+- blockLength: the mean length of the ungapped blocks
+- gapDensity: the fraction of the alignment columns that are gaps,
+  from 0 to below 1
+- seed: the seed of the random numbers, so the same arguments always
+  give the same files
+
+
+How To Use This Module
+======================
+
+1. Import it: ``import generate_inputs``.
+
+2. Write the files of a format to a directory, and read them back with
+   the loader of that format:
+   ``alnPath, seqPath = generate_inputs.generate('psl', 'tmp', 10000,``
+   ``                                            nSeqs=20, gapDensity=0.2)``
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+import os
+import random
+
+FORMATS = ('lav', 'psl', 'clustalw', 'lagan', 'mlagan')
+ALIGNMENT_FILES = {'lav': 'output.lav', 'psl': 'output.psl',
+                   'clustalw': 'output.aln', 'lagan': 'output.fa',
+                   'mlagan': 'output.fa'}
+SEQUENCE_FILE = 'genomes.fna'
+LINE_LENGTH = 60
+CLUSTALW_NAME_WIDTH = 16
+BLOCKS_PER_ALIGNMENT = 5
+
+def random_sequences(nSeqs, seqLength, rand):
+    """
+    Returns a list of nSeqs (name, sequence) pairs of random DNA
+    sequences of seqLength residues, drawn from the random.Random rand
+    """
+    return [ (name, ''.join([ rand.choice('ACGT')
+                              for k in range(0, seqLength) ]))
+             for name in _seq_names(nSeqs) ]
+
+def _seq_names(nSeqs):
+    """
+    Returns the names of nSeqs sequences, of equal width so that no name
+    is a prefix of another
+    """
+    width = len(str(max(0, nSeqs - 1)))
+    return [ 'seq%0*d' % (width, i) for i in range(0, nSeqs) ]
+
+def _gap_length(blockLength, gapDensity):
+    """
+    Returns the mean length of the gaps between blocks of blockLength
+    for gapDensity of the alignment columns to be gaps
+    """
+    assert 0 <= gapDensity < 1, "gapDensity must be from 0 to below 1"
+    return blockLength * gapDensity / (1. - gapDensity)
+
+def _block_length(blockLength, rand):
+    return rand.randint(max(1, blockLength // 2),
+                        max(1, blockLength * 3 // 2))
+
+def make_chain(len1, len2, nBlocks, blockLength, gapDensity, rand):
+    """
+    Returns the ungapped blocks of a gapped local alignment between two
+    sequences of len1 and len2 residues as a list of 0-based
+    (start1, start2, length) tuples. Consecutive blocks are separated
+    by a gap in one of the sequences; blocks that do not fit in the
+    sequences are dropped, and at least one block is always kept.
+    """
+    gapLength = _gap_length(blockLength, gapDensity)
+    blocks = []
+    pos1 = pos2 = 0
+    for k in range(0, nBlocks):
+        if k and gapLength:
+            gap = rand.randint(0, int(round(2 * gapLength)))
+            if rand.random() < 0.5:
+                pos1 += gap
+            else:
+                pos2 += gap
+        length = _block_length(blockLength, rand)
+        if blocks and (pos1 + length > len1 or pos2 + length > len2):
+            break
+        blocks.append((pos1, pos2, min(length, len1, len2)))
+        pos1 += length
+        pos2 += length
+
+    (a, x, length) = blocks[-1]
+    start1 = rand.randint(0, len1 - (a + length))
+    start2 = rand.randint(0, len2 - (x + length))
+    return [ (start1 + a, start2 + x, length) for (a, x, length) in blocks ]
+
+def make_aligned_rows(nSeqs, nColumns, blockLength, gapDensity, rand):
+    """
+    Returns nSeqs gapped rows of nColumns alignment columns, made of
+    runs of residues of about blockLength separated by runs of gaps,
+    with gapDensity of the columns being gaps on average
+    """
+    gapLength = _gap_length(blockLength, gapDensity)
+    rows = []
+    for i in range(0, nSeqs):
+        runs = []
+        nRow = 0
+        if gapLength and rand.random() < gapDensity:
+            gap = True                  # some rows start with a gap
+        else:
+            gap = False
+        while nRow < nColumns:
+            if gap:
+                length = rand.randint(1, max(1, int(round(2 * gapLength))))
+                runs.append('-' * length)
+            else:
+                length = _block_length(blockLength, rand)
+                runs.append(''.join([ rand.choice('ACGT')
+                                      for k in range(0, length) ]))
+            nRow += length
+            gap = bool(gapLength) and not gap
+        rows.append(''.join(runs)[:nColumns])
+    return rows
+
+def write_fasta(path, seqs):
+    """
+    Write the (name, sequence) pairs seqs to a FASTA file
+    """
+    ofile = open(path, 'w')
+    try:
+        for name, seq in seqs:
+            ofile.write('>%s\n' % name)
+            for k in range(0, len(seq), LINE_LENGTH):
+                ofile.write(seq[k:k+LINE_LENGTH] + '\n')
+    finally:
+        ofile.close()
+
+def _make_alignments(seqs, nAlignments, blockLength, gapDensity, rand,
+                     reverse=False):
+    """
+    Returns nAlignments (i, j, strand, blocks) tuples between random
+    pairs of distinct sequences i and j, blocks being as returned by
+    make_chain(); strand is '+', or '-' for about half of them if
+    reverse is True
+    """
+    assert len(seqs) >= 2, "at least two sequences are needed"
+    alignments = []
+    for k in range(0, nAlignments):
+        i, j = rand.sample(range(0, len(seqs)), 2)
+        if reverse and rand.random() < 0.5:
+            strand = '-'
+        else:
+            strand = '+'
+        blocks = make_chain(len(seqs[i][1]), len(seqs[j][1]),
+                            BLOCKS_PER_ALIGNMENT, blockLength, gapDensity,
+                            rand)
+        alignments.append((i, j, strand, blocks))
+    return alignments
+
+def write_lav(path, seqs, alignments, seqPath=SEQUENCE_FILE):
+    """
+    Write the alignments of _make_alignments() as a lav file, with one
+    lav block per pair of sequences and strand
+    """
+    groups = {}
+    for (i, j, strand, blocks) in alignments:
+        groups.setdefault((i, j, strand), []).append(blocks)
+    keys = groups.keys()
+    keys.sort()
+
+    ofile = open(path, 'w')
+    try:
+        ofile.write('#:lav\nd {\n  "generate_inputs %s %s"\n}\n'
+                    % (seqPath, seqPath))
+        for (i, j, strand) in keys:
+            if strand == '-':
+                revFlag = 1
+                suffix = '-'
+            else:
+                revFlag = 0
+                suffix = ''
+            ofile.write('#:lav\ns {\n')
+            ofile.write('  "%s" 1 %d 0 %d\n' % (seqPath, len(seqs[i][1]),
+                                                i + 1))
+            ofile.write('  "%s%s" 1 %d %d %d\n' % (seqPath, suffix,
+                                                   len(seqs[j][1]),
+                                                   revFlag, j + 1))
+            ofile.write('}\nh {\n   ">%s"\n   ">%s"\n}\n'
+                        % (seqs[i][0], seqs[j][0]))
+            for blocks in groups[(i, j, strand)]:
+                score = 50 * sum([ length for (a, x, length) in blocks ])
+                (a, x, length) = blocks[-1]
+                ofile.write('a {\n  s %d\n  b %d %d\n  e %d %d\n'
+                            % (score, blocks[0][0] + 1, blocks[0][1] + 1,
+                               a + length, x + length))
+                for (a, x, length) in blocks:
+                    ofile.write('  l %d %d %d %d 100\n'
+                                % (a + 1, x + 1, a + length, x + length))
+                ofile.write('}\n')
+        ofile.write('#:END\n')
+    finally:
+        ofile.close()
+
+_PSL_HEADER = """psLayout version 3
+
+match\tmis- \trep. \tN's\tQ gap\tQ gap\tT gap\tT gap\tstrand\tQ        \tQ   \tQ    \tQ  \tT        \tT   \tT    \tT  \tblock\tblockSizes \tqStarts\t tStarts
+     \tmatch\tmatch\t   \tcount\tbases\tcount\tbases\t      \tname     \tsize\tstart\tend\tname     \tsize\tstart\tend\tcount
+---------------------------------------------------------------------------------------------------------------------------------------------------------------
+"""
+
+def write_psl(path, seqs, alignments):
+    """
+    Write the alignments of _make_alignments() as a PSL file, the first
+    sequence of each being the query and the second the target.  As in
+    blat's own output, the block query starts of a - strand alignment are
+    on the reverse strand, while its query start and end are forward.
+    """
+    ofile = open(path, 'w')
+    try:
+        ofile.write(_PSL_HEADER)
+        for (i, j, strand, blocks) in alignments:
+            qInserts = [ blocks[k+1][0] - (blocks[k][0] + blocks[k][2])
+                         for k in range(0, len(blocks) - 1) ]
+            tInserts = [ blocks[k+1][1] - (blocks[k][1] + blocks[k][2])
+                         for k in range(0, len(blocks) - 1) ]
+            qInserts = [ n for n in qInserts if n ]
+            tInserts = [ n for n in tInserts if n ]
+            (a, x, length) = blocks[-1]
+            qStart, qEnd = blocks[0][0], a + length
+            if strand == '-':
+                qStart, qEnd = len(seqs[i][1]) - qEnd, len(seqs[i][1]) - qStart
+            fields = (sum([ n for (a, x, n) in blocks ]), 0, 0, 0,
+                      len(qInserts), sum(qInserts),
+                      len(tInserts), sum(tInserts), strand,
+                      seqs[i][0], len(seqs[i][1]), qStart, qEnd,
+                      seqs[j][0], len(seqs[j][1]), blocks[0][1], x + length,
+                      len(blocks),
+                      ''.join([ '%d,' % n for (a, x, n) in blocks ]),
+                      ''.join([ '%d,' % a for (a, x, n) in blocks ]),
+                      ''.join([ '%d,' % x for (a, x, n) in blocks ]))
+            ofile.write('\t'.join([ str(field) for field in fields ]) + '\n')
+    finally:
+        ofile.close()
+
+def write_clustalw(path, names, rows):
+    """
+    Write the aligned rows, named by names, as a clustalw .aln file
+    """
+    counts = [0] * len(rows)
+    ofile = open(path, 'w')
+    try:
+        ofile.write('CLUSTAL W (1.83) multiple sequence alignment\n\n\n')
+        for k in range(0, len(rows[0]), LINE_LENGTH):
+            if k:
+                # the conservation line, not written after the last block
+                ofile.write(' ' * (CLUSTALW_NAME_WIDTH + LINE_LENGTH)
+                            + '\n\n')
+            for i in range(0, len(rows)):
+                chunk = rows[i][k:k+LINE_LENGTH]
+                counts[i] += len(chunk) - chunk.count('-')
+                ofile.write('%s%s %d\n'
+                            % (names[i].ljust(CLUSTALW_NAME_WIDTH), chunk,
+                               counts[i]))
+    finally:
+        ofile.close()
+
+def write_aligned_fasta(path, names, rows):
+    """
+    Write the aligned rows, named by names, as a (m)lagan aligned FASTA
+    file
+    """
+    write_fasta(path, zip(names, rows))
+
+def generate(format, directory, size, nSeqs=10, seqLength=100000,
+             blockLength=50, gapDensity=0.1, seed=0):
+    """
+    Write a synthetic alignment file of format (one of FORMATS) and the
+    FASTA file of its sequences to directory, and return their paths.
+    See the module documentation for the other arguments.
+    """
+    assert format in FORMATS, "unknown format %s" % format
+    rand = random.Random(seed)
+    alnPath = os.path.join(directory, ALIGNMENT_FILES[format])
+    seqPath = os.path.join(directory, SEQUENCE_FILE)
+
+    if format in ('lav', 'psl'):
+        seqs = random_sequences(nSeqs, seqLength, rand)
+        alignments = _make_alignments(seqs, size, blockLength, gapDensity,
+                                      rand, reverse=True)
+        if format == 'lav':
+            write_lav(alnPath, seqs, alignments, SEQUENCE_FILE)
+        else:
+            write_psl(alnPath, seqs, alignments)
+    else:
+        if format == 'lagan':
+            nSeqs = 2
+        names = _seq_names(nSeqs)
+        rows = make_aligned_rows(nSeqs, size, blockLength, gapDensity, rand)
+        if format == 'clustalw':
+            write_clustalw(alnPath, names, rows)
+        else:
+            write_aligned_fasta(alnPath, names, rows)
+        seqs = [ (name, row.replace('-', '')) for name, row
+                 in zip(names, rows) ]
+
+    write_fasta(seqPath, seqs)
+    return alnPath, seqPath
@@ -0,0 +1,110 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import run_benchmark
+import generate_inputs
+import blastz_NLMSA
+import blat_NLMSA
+import Clustalw_NLMSA
+import mlagan_NLMSA
+
+class Generate_inputs_test(unittest.TestCase):
+    """
+    Test that the synthetic inputs are read back by the loaders with the
+    number of alignments, sequences and residues they were made with.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def generate(self, format, size, **kwargs):
+        alnPath, seqPath = generate_inputs.generate(format, self.directory,
+                                                    size, **kwargs)
+        seqs = {}
+        for line in open(seqPath):
+            if line.startswith('>'):
+                name = line[1:].strip()
+                seqs[name] = ''
+            else:
+                seqs[name] += line.strip()
+        return open(alnPath).read(), seqs
+
+    def test_make_chain(self):
+        rand = random.Random(1)
+        for gapDensity in (0., 0.5):
+            blocks = generate_inputs.make_chain(1000, 500, 10, 40,
+                                                gapDensity, rand)
+            self.assert_(blocks)
+            for k in range(0, len(blocks)):
+                (a, x, length) = blocks[k]
+                self.assert_(a >= 0 and a + length <= 1000)
+                self.assert_(x >= 0 and x + length <= 500)
+                if k:
+                    self.assert_(a >= blocks[k-1][0] + blocks[k-1][2])
+                    self.assert_(x >= blocks[k-1][1] + blocks[k-1][2])
+
+        rows = generate_inputs.make_aligned_rows(3, 500, 20, 0.3, rand)
+        self.assertEqual([ len(row) for row in rows ], [500] * 3)
+        gaps = ''.join(rows).count('-') / 1500.
+        self.assert_(0.1 < gaps < 0.5, gaps)
+
+    def test_local_alignments(self):
+        buf, seqs = self.generate('lav', 50, nSeqs=4, seqLength=2000)
+        self.assertEqual(len(seqs), 4)
+        alignments, names = blastz_NLMSA.parse_blastz(buf)
+        self.assertEqual(len(alignments), 50)
+        self.assertEqual(set(names), set(seqs))
+        self.assertEqual(set([ aln.orient for aln in alignments ]),
+                         set([1, -1]))
+
+        buf, seqs = self.generate('psl', 50, nSeqs=4, seqLength=2000)
+        alignments, names = blat_NLMSA.parse_blat(buf, False)
+        self.assertEqual(len(alignments), 50)
+        for aln in alignments:
+            for block in aln.blocks:
+                self.assert_(block.qEnd <= len(seqs[aln.qSeqName]))
+                self.assert_(block.tEnd <= len(seqs[aln.tSeqName]))
+        self.assertEqual(set([ aln.orient for aln in alignments ]),
+                         set(['++', '--']))
+        for line in buf.splitlines()[5:]:
+            fields = line.split('\t')
+            if fields[8] == '-':
+                # qStarts on the reverse strand, qStart and qEnd forward
+                qSize = int(fields[10])
+                sizes = [ int(n) for n in fields[18].split(',')[:-1] ]
+                qStarts = [ int(n) for n in fields[19].split(',')[:-1] ]
+                self.assertEqual(int(fields[11]),
+                                 qSize - qStarts[-1] - sizes[-1])
+                self.assertEqual(int(fields[12]), qSize - qStarts[0])
+
+    def test_aligned_rows(self):
+        buf, seqs = self.generate('clustalw', 200, nSeqs=12)
+        clustal_res_list = Clustalw_NLMSA.read_clustalw(buf.split('\n'))
+        self.assertEqual(len(clustal_res_list), 4)
+        names = clustal_res_list[0].get_names()
+        lengths = Clustalw_NLMSA.calc_total_length(clustal_res_list)
+        self.assertEqual(dict(zip(names, lengths)),
+                         dict([ (name, len(seq)) for name, seq
+                                in seqs.items() ]))
+
+        buf, seqs = self.generate('mlagan', 200, nSeqs=12)
+        rows, names = mlagan_NLMSA.read_mlagan(buf)
+        self.assertEqual([ len(row) for row in rows ], [200] * 12)
+        self.assertEqual([ row.replace('-', '') for row in rows ],
+                         [ seqs[name] for name in names ])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Generate_inputs_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,334 @@
+# ! /usr/bin/env python2.5
+
+"""
+RUN_BENCHMARK MODULE
+====================
+A module that times the loaders on synthetic inputs written by
+generate_inputs, stage by stage, and compares the timings with a saved
+baseline so regressions are caught before upgrading. The module does
+not define any class.
+
+Each format is loaded in four stages:
+
+- parse: parse the alignment file into alignment objects
+- ivals: build the ivals of the alignment file
+- add: add the ivals to an NLMSA with a loader_utils.BulkLoader
+- build: build the NLMSA
+
+For each stage the wall clock and CPU seconds, the number of records,
+ivals or intervals handled, and the peak memory are recorded. The peak
+memory is the peak of the Python allocations during the stage if the
+tracemalloc module is available, and the peak resident set size of the
+process at the end of the stage in any case; as the latter never
+decreases, benchmark one format per run to compare it.
+
+Functions:
+
+- `measure()`: call a function and return its result and its timings
+- `run_format()`: generate the input of a format and time its stages
+- `compare()`: compare results with a baseline and return the
+  regressions
+- `main()`: the command line interface
+
+
+How To Use This Module
+======================
+
+1. Time the loaders and save the results as a baseline:
+   ``python run_benchmark.py -f psl -f lav --size 20000 -o baseline.json``
+
+2. After upgrading, run the same benchmark against the baseline; the
+   stages that got slower (or bigger) by more than the tolerance are
+   listed and the exit status is 1:
+   ``python run_benchmark.py -f psl -f lav --size 20000 -o new.json``
+   ``    --baseline baseline.json --tolerance 0.2``
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from pygr import cnestedlist, seqdb
+
+# the loaders and the code they share
+thisdir = os.path.dirname(os.path.abspath(__file__))
+for d in ('common', 'blastz', 'blat', 'clustalw',
+          os.path.join('pw-m-lagan', 'lagan'),
+          os.path.join('pw-m-lagan', 'mlagan')):
+    sys.path.append(os.path.join(os.path.dirname(thisdir), d))
+
+import blastz_NLMSA
+import blat_NLMSA
+import Clustalw_NLMSA
+import lagan_NLMSA
+import mlagan_NLMSA
+import loader_utils
+import generate_inputs
+
+STAGES = ('parse', 'ivals', 'add', 'build')
+TOLERANCE = 0.2
+MIN_SECONDS = 0.05      # smaller differences are taken as noise
+
+def _parse(format, buf):
+    """
+    Parse buf and return the number of records read
+    """
+    if format == 'lav':
+        return len(blastz_NLMSA.parse_blastz(buf)[0])
+    elif format == 'psl':
+        return len(blat_NLMSA.parse_blat(buf, False)[0])
+    elif format == 'clustalw':
+        return len(Clustalw_NLMSA.read_clustalw(buf.split('\n')))
+    elif format == 'lagan':
+        return len(lagan_NLMSA.read_lagan(buf)[0])
+    else:
+        return len(mlagan_NLMSA.read_mlagan(buf)[0])
+
+def _build_ivals(format, buf, seqDb):
+    """
+    Build the ivals of buf and return them as a list of ivals lists
+    """
+    if format == 'lav':
+        return list(blastz_NLMSA.build_blastz_ivals(buf, seqDb))
+    elif format == 'psl':
+        return list(blat_NLMSA.build_blat_ivals(buf, False))
+    elif format == 'clustalw':
+        return list(Clustalw_NLMSA.build_clustalw_ivals(buf.split('\n'),
+                                                        seqDb))
+    elif format == 'lagan':
+        return list(lagan_NLMSA.build_lagan_ivals(buf, seqDb))
+    else:
+        return list(mlagan_NLMSA.build_mlagan_ivals(buf, seqDb))
+
+def _add_ivals(format, ivals_list, seqDb, al):
+    """
+    Add the ivals to al and return the number of intervals added
+    """
+    if format in ('lav', 'psl'):
+        attrs = loader_utils.ORIENTED_IVALS_ATTRS
+    else:
+        attrs = loader_utils.IVALS_ATTRS
+    loader = loader_utils.BulkLoader(al, seqDb, seqDb, attrs)
+    for ivals in ivals_list:
+        loader.add(ivals)
+    loader.close()
+    return loader.nIntervals
+
+def _get_maxrss():
+    """
+    Returns the peak resident set size of the process in kB, or None
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024                 # bytes, not kB
+    return maxrss
+
+def measure(func, *args):
+    """
+    Call func(*args) and return its result and a dictionary of the
+    wall clock and CPU seconds it took, the peak of the Python
+    allocations made meanwhile in bytes (None without tracemalloc) and
+    the peak resident set size of the process afterwards in kB
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+    times = os.times()
+    t = time.time()
+    try:
+        result = func(*args)
+    finally:
+        wall = time.time() - t
+        cpu = sum(os.times()[:2]) - sum(times[:2])
+        peak = None
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    return result, dict(wall=wall, cpu=cpu, peak_bytes=peak,
+                        maxrss_kb=_get_maxrss())
+
+def run_format(format, size, nSeqs=10, seqLength=100000, blockLength=50,
+               gapDensity=0.1, seed=0, directory=None):
+    """
+    Write a synthetic input of format with generate_inputs.generate()
+    and time its stages; returns a dictionary of the format, the input
+    parameters and the measures of each stage. The input is written to
+    directory, or to a temporary directory that is removed afterwards.
+    """
+    params = dict(size=size, nSeqs=nSeqs, seqLength=seqLength,
+                  blockLength=blockLength, gapDensity=gapDensity, seed=seed)
+    tempdir = None
+    if directory is None:
+        directory = tempdir = tempfile.mkdtemp()
+    try:
+        alnPath, seqPath = generate_inputs.generate(format, directory,
+                                                    **params)
+        params['bytes'] = os.path.getsize(alnPath)
+        buf = open(alnPath).read()
+        seqDb = seqdb.SequenceFileDB(seqPath)
+        try:
+            al = cnestedlist.NLMSA('benchmark', mode='memory',
+                                   seqDict=seqDb, use_virtual_lpo=True)
+
+            stages = {}
+            count, stages['parse'] = measure(_parse, format, buf)
+            stages['parse']['count'] = count
+            ivals_list, stages['ivals'] = measure(_build_ivals, format, buf,
+                                                  seqDb)
+            stages['ivals']['count'] = sum([ len(ivals) for ivals
+                                             in ivals_list ])
+            count, stages['add'] = measure(_add_ivals, format, ivals_list,
+                                           seqDb, al)
+            stages['add']['count'] = count
+            del ivals_list
+            result, stages['build'] = measure(al.build)
+            stages['build']['count'] = count
+        finally:
+            seqDb.close()
+    finally:
+        if tempdir is not None:
+            shutil.rmtree(tempdir)
+
+    return dict(format=format, params=params, stages=stages)
+
+def compare(results, baseline, tolerance=TOLERANCE, minSeconds=MIN_SECONDS):
+    """
+    Compare the results of run_format() with the baseline results of
+    the same formats and parameters, and return the regressions as a
+    list of (format, stage, measure, baseline value, value) tuples: the
+    wall clock seconds that grew by more than tolerance (a fraction)
+    and minSeconds, and the peak memory that grew by more than
+    tolerance. Results without a matching baseline are not compared.
+    """
+    baselines = {}
+    for base in baseline:
+        baselines[(base['format'], _params_key(base['params']))] = base
+
+    regressions = []
+    for result in results:
+        base = baselines.get((result['format'],
+                              _params_key(result['params'])))
+        if base is None:
+            continue
+        for stage in STAGES:
+            old = base['stages'][stage]
+            new = result['stages'][stage]
+            if new['wall'] > old['wall'] * (1 + tolerance) and \
+               new['wall'] - old['wall'] > minSeconds:
+                regressions.append((result['format'], stage, 'wall',
+                                    old['wall'], new['wall']))
+            for key in ('peak_bytes', 'maxrss_kb'):
+                if old.get(key) and new.get(key) and \
+                   new[key] > old[key] * (1 + tolerance):
+                    regressions.append((result['format'], stage, key,
+                                        old[key], new[key]))
+    return regressions
+
+def _params_key(params):
+    items = params.items()
+    items.sort()
+    return tuple(items)
+
+def format_results(results):
+    """
+    Returns the results as a table, one line per format and stage
+    """
+    lines = ['%-9s %-6s %10s %10s %10s %12s %10s'
+             % ('format', 'stage', 'count', 'wall (s)', 'cpu (s)',
+                'peak (kB)', 'rss (kB)')]
+    for result in results:
+        for stage in STAGES:
+            m = result['stages'][stage]
+            peak = '-'
+            if m['peak_bytes'] is not None:
+                peak = '%d' % (m['peak_bytes'] // 1024)
+            lines.append('%-9s %-6s %10d %10.3f %10.3f %12s %10s'
+                         % (result['format'], stage, m['count'], m['wall'],
+                            m['cpu'], peak, m['maxrss_kb']))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-f', '--format', action='append', dest='formats',
+                      choices=generate_inputs.FORMATS,
+                      help='the format to benchmark, one of %s; may be '
+                      'repeated (default: all)'
+                      % ', '.join(generate_inputs.FORMATS))
+    parser.add_option('--size', type='int', default=1000,
+                      help='the number of local alignments (lav, psl) or '
+                      'alignment columns (clustalw, lagan, mlagan)')
+    parser.add_option('--seqs', type='int', default=10, dest='nSeqs',
+                      help='the number of sequences')
+    parser.add_option('--seq-length', type='int', default=100000,
+                      dest='seqLength',
+                      help='the length of the sequences of lav and psl '
+                      'inputs')
+    parser.add_option('--block-length', type='int', default=50,
+                      dest='blockLength',
+                      help='the mean length of the ungapped blocks')
+    parser.add_option('--gap-density', type='float', default=0.1,
+                      dest='gapDensity',
+                      help='the fraction of alignment columns that are gaps')
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('-o', '--output',
+                      help='write the results to this JSON file')
+    parser.add_option('-b', '--baseline',
+                      help='compare the results with this JSON file')
+    parser.add_option('--tolerance', type='float', default=TOLERANCE,
+                      help='the fraction by which a measure may grow over '
+                      'the baseline (default %default)')
+    options, args = parser.parse_args(argv)
+
+    formats = options.formats or generate_inputs.FORMATS
+    results = []
+    for format in formats:
+        results.append(run_format(format, options.size, options.nSeqs,
+                                  options.seqLength, options.blockLength,
+                                  options.gapDensity, options.seed))
+    print format_results(results)
+
+    if options.output:
+        ofile = open(options.output, 'w')
+        try:
+            json.dump(dict(python=sys.version.split()[0],
+                           platform=sys.platform, results=results),
+                      ofile, indent=2, sort_keys=True)
+        finally:
+            ofile.close()
+
+    if options.baseline:
+        baseline = json.load(open(options.baseline))['results']
+        regressions = compare(results, baseline, options.tolerance)
+        for (format, stage, key, old, new) in regressions:
+            print 'REGRESSION %s %s %s: %s -> %s' % (format, stage, key, old,
+                                                     new)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
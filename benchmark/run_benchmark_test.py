@@ -0,0 +1,56 @@
+import copy
+import unittest
+import run_benchmark
+
+class Run_benchmark_test(unittest.TestCase):
+    """
+    Test that every stage of every format is measured, and that only
+    the measures that grew beyond the tolerance are regressions.
+    """
+
+    def test_run_format(self):
+        for format in run_benchmark.generate_inputs.FORMATS:
+            result = run_benchmark.run_format(format, 20, nSeqs=3,
+                                              seqLength=2000)
+            self.assertEqual(result['format'], format)
+            self.assertEqual(result['params']['size'], 20)
+            self.assertEqual(sorted(result['stages']),
+                             sorted(run_benchmark.STAGES))
+            stages = result['stages']
+            self.assert_(stages['ivals']['count'] > 0)
+            self.assertEqual(stages['add']['count'],
+                             stages['ivals']['count'])
+            for stage in run_benchmark.STAGES:
+                self.assert_(stages[stage]['wall'] >= 0)
+
+    def test_compare(self):
+        stage = dict(wall=1., cpu=1., peak_bytes=None, maxrss_kb=1000,
+                     count=10)
+        baseline = [dict(format='psl', params=dict(size=10),
+                         stages=dict([ (name, dict(stage)) for name
+                                       in run_benchmark.STAGES ]))]
+        results = copy.deepcopy(baseline)
+        self.assertEqual(run_benchmark.compare(results, baseline), [])
+
+        results[0]['stages']['add']['wall'] = 1.1
+        results[0]['stages']['build']['wall'] = 2.
+        results[0]['stages']['parse']['maxrss_kb'] = 2000
+        self.assertEqual(run_benchmark.compare(results, baseline),
+                         [('psl', 'parse', 'maxrss_kb', 1000, 2000),
+                          ('psl', 'build', 'wall', 1., 2.)])
+        self.assertEqual(run_benchmark.compare(results, baseline,
+                                               tolerance=2.), [])
+
+        results[0]['params']['size'] = 20     # not the same input
+        self.assertEqual(run_benchmark.compare(results, baseline), [])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Run_benchmark_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -12,6 +12,8 @@ builds pygr NLMSAs with it. The module defines the following classes:
 - `BlastzLocalAlignment`, a blastz gapped local alignment, consisting of
   multiple ungapped blocks
 - `BlastzUngappedBlock`, a single ungapped block in a blastz alignment.
+- `BlastzStore`, compact columnar storage for many blastz alignments,
+  giving views with the same attributes as the two classes above.
 
 Functions:
 
@@ -21,10 +23,31 @@ Functions:
   marked by #:lav markers              
 - `parse_blastz()`: takes a blastz alignment file object and returns the
   alignments and the sequence names
+- `iter_blastz()`: reads a blastz alignment file object line by line and
+  yields the alignments one at a time
+- `read_blastz_store()`: reads a blastz alignment file object into a
+  BlastzStore
+- `build_blastz_index()`: index the lav blocks of a blastz file by their
+  sequence pair
+- `get_blastz_index()`: return the index of a blastz file, from its
+  sidecar index file, building it if needed
+- `iter_blastz_names()`: read the alignments of some sequences of a
+  blastz file through its index
+- `build_blastz_record_index()`: index each "a {" record block of a
+  blastz file with the intervals it covers
+- `get_blastz_record_index()`: return the record index of a blastz
+  file, from its sidecar index file, building it if needed
+- `create_lazy_blastz()`: takes the path of a blastz file and returns a
+  read-only alignment answering slice queries from the file
 - `_parse_blastz_record_block()`: parse out the score and overall begin/end \
   coords from the alignment blocks, as well as the individual ungapped blocks
 - `_parse_record()`: parse individual lines in an "a {" record block, and
   return a BlastzLocalAlignment
+- `iter_ival_batches()`: yield the ivals of a blastz alignment file object
+  as structured NumPy arrays
+- `build_blastz_block_index()`: index the ungapped blocks of the
+  alignments returned by parse_blastz() by sequence interval, for
+  overlap queries without an NLMSA
 - `create_NLMSA_blastz()`: build an NLMSA out of the blastz alignment and
   returns the alignment object.
     
@@ -42,12 +65,79 @@ How To Use This Module
    function returns the modified/built NLMSA.
    ``nlmsa_aln = create_NLMSA_blastz(buf, seqDb, al)``
 
+   buf may also be an open file object, in which case the alignments are
+   read incrementally and memory use does not grow with the file size:
+   ``nlmsa_aln = create_NLMSA_blastz(open('output'), seqDb, al)``
+   or the path of the file, which is then memory-mapped and read the
+   same way:
+   ``nlmsa_aln = create_NLMSA_blastz('output', seqDb, al)``
+   A gzip or BGZF compressed file, path or buffer is decompressed as it
+   is read:
+   ``nlmsa_aln = create_NLMSA_blastz('output.gz', seqDb, al)``
+
+   The file may hold any number of lav blocks, e.g. from a run against a
+   multi-sequence target; each lav block's strand and sequence names are
+   read from its own "s {" and "h {" stanzas.
+
+3. To load only the alignments that pass score, block length, identity
+   or gap cutoffs, pass a record_filter.RecordFilter; the alignments
+   that fail are rejected before they are parsed:
+   ``recordFilter = record_filter.RecordFilter(minScore=3000)``
+   ``nlmsa_aln = create_NLMSA_blastz(buf, seqDb, al,``
+   ``                                recordFilter=recordFilter)``
+
+4. To load only the alignments of some sequences out of a large file,
+   pass their names with the path of the file; the first such load
+   indexes the lav blocks of the file by sequence pair, in a sidecar
+   file next to it (output.oix), and every load reads only the lav
+   blocks of these sequences, so its time grows with their alignments
+   only:
+   ``nlmsa_aln = create_NLMSA_blastz('output', seqDb, al,``
+   ``                                names=['chr21'])``
+   The file may be plain or BGZF compressed; a gzip file cannot be
+   indexed.
+
+5. For a few queries on a large file, no NLMSA needs to be built at
+   all: create_lazy_blastz() indexes each "a {" record block of the
+   file with the intervals it covers, in a sidecar file (output.rix),
+   and its slices read and parse only the record blocks overlapping
+   them:
+   ``al = create_lazy_blastz('output', seqDb)``
+   ``for s in al[seqDb['chr1'][1000:2000]]:``
+
+6. To ask which blocks of parsed alignments overlap some intervals,
+   without building an NLMSA, index their blocks in memory and query
+   the index, one interval or a batch of intervals at a time (see
+   interval_index for its build time and memory cost):
+   ``matches, names = parse_blastz(buf)``
+   ``index, firstBlocks = build_blastz_block_index(matches)``
+   ``queries, values = index.find_overlaps_batch('chr1', starts, stops)``
+   ``alignments, blocks, sides = interval_index.get_alignment_blocks(``
+   ``    firstBlocks, values)``
+
 """
 
 __docformat__ = 'restructuredtext'
 
+import itertools
+import os
+import sys
+from cStringIO import StringIO
 from pygr import cnestedlist, nlmsa_utils, seqdb
 
+# the code shared by the loaders lives in common/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'common'))
+import block_store
+import cache_utils
+import input_utils
+import interval_index
+import ival_arrays
+import lazy_alignment
+import load_stats
+import loader_utils
+import offset_index
+
 # BlastzLocalAlignment
 
 class BlastzLocalAlignment:
@@ -96,6 +186,42 @@ class BlastzUngappedBlock:
 
         return (top, bot)
 
+# BlastzStore
+
+class BlastzUngappedBlockView(block_store.BlockView):
+    """
+    A view of a single ungapped block in a BlastzStore, with the same
+    attributes and methods as a BlastzUngappedBlock.
+    """
+    __slots__ = ()
+
+    def __len__(self):
+        return self.end_top - self.start_top
+
+    def convert_to_text(self, seq1, seq2):
+        """
+        Return the ungapped alignment, as sequence.
+        """
+        top = seq1[self.start_top:self.end_top]
+        bot = seq2[self.start_bot:self.end_bot]
+
+        return (top, bot)
+
+class BlastzStore(block_store.BlockStore):
+    """
+    Compact columnar storage for blastz alignments. Indexing or
+    iterating over it gives views with the same attributes as a
+    BlastzLocalAlignment.
+    """
+    block_class = BlastzUngappedBlockView
+    aln_fields = (('score', 'l'), ('start_top', 'l'), ('end_top', 'l'),
+                  ('start_bot', 'l'), ('end_bot', 'l'),
+                  ('sequence_name1', 'i'), ('sequence_name2', 'i'),
+                  ('orient', 'b'))
+    block_fields = (('start_top', 'l'), ('end_top', 'l'), ('start_bot', 'l'),
+                    ('end_bot', 'l'), ('ident', 'b'))
+    name_fields = ('sequence_name1', 'sequence_name2')
+
 def find_lavmarkers(buf):
     """
     Find the #:lav markers and return a list of their index.
@@ -132,11 +258,17 @@ def construct_coord(lav_marker_list):
      
 def get_orient(lav_counter, total_lav):
     """
-    Orientation obtained from each lav block.
-    The first lav block has orientation 1 (forward) alignment and the 
-    next (if it exists) has orientation as -1 (reverse).
+    Orientation of a lav block from its position, for lav blocks whose
+    "s {" stanza does not give the strands: a blastz run of a single
+    pair writes at most two lav blocks, the first of orientation 1
+    (forward) alignment and the second of orientation -1 (reverse).
+    The lav blocks of a file of more lav blocks cannot be told apart by
+    position, so their "s {" stanzas must give the strands.
     """
-    assert total_lav <= 2 and total_lav > 0
+    assert lav_counter > 0 and lav_counter <= total_lav
+    assert total_lav <= 2, \
+           "lav block %d does not give its strands, and the orientation " \
+           "of lav blocks after the second cannot be guessed" % lav_counter
     if lav_counter == 1:
         orient = 1
     else:
@@ -147,8 +279,13 @@ def get_names(records):
     """
     Return the names of the sequences in a list.
     """
+    return _get_h_names(records[1])
+
+def _get_h_names(tempstr):
+    """
+    Return the names of the sequences in the text of an "h {" stanza.
+    """
     names = []
-    tempstr = records[1]
 
     pos = tempstr.find('h')
     index1 = tempstr.find('>',pos)
@@ -158,41 +295,374 @@ def get_names(records):
     index4 = tempstr.find('"',index3)
 
     if index1 != -1 or index2 != -1:
-        names.append(tempstr[index1+1:index2])
+        names.append(_get_h_name(tempstr[index1+1:index2]))
     if index3 != -1 or index4 != -1:
-        names.append(tempstr[index3+1:index4])
+        names.append(_get_h_name(tempstr[index3+1:index4]))
 
     return names
 
-def parse_blastz(buf):
+def _get_h_name(header):
+    """
+    Return the sequence name of a header of an "h {" stanza: its first
+    word, e.g. of ">chr1 (reverse complement)", or the header itself if
+    it has none.
+    """
+    words = header.split()
+    if words:
+        return words[0]
+    return header
+
+def _get_s_orient(record):
+    """
+    Return the orientation of the alignments of a lav block from the
+    lines of its "s {" stanza, or None if the strands are not given.
+    Each line is "filename[-]" start stop [rev_comp_flag seq_number];
+    a "-" after the file name or a rev_comp_flag of 1 marks a reverse
+    complemented sequence.
+    """
+    strands = []
+    for line in record[1:]:
+        line = line.strip()
+        if not line.startswith('"'):
+            continue
+        end = line.find('"', 1)
+        filename = line[1:end]
+        fields = line[end+1:].split()
+        if len(fields) >= 3:
+            strands.append(fields[2] == '1' or filename.endswith('-'))
+        elif filename.endswith('-'):
+            strands.append(True)
+        else:
+            return None
+
+    if len(strands) != 2:
+        return None
+    if strands[0] != strands[1]:
+        return -1
+    return 1
+
+def parse_blastz(buf, compact=False, recordFilter=None):
     """
     Takes a blastz alignment file buffer and returns the alignments
-    and the sequence names.
+    and the sequence names. If compact is True, the alignments are
+    returned in a BlastzStore instead of a list. If a
+    record_filter.RecordFilter is given, the alignments that fail it
+    are skipped.
     """
     assert buf[0:5] == '#:lav'," This does not look like a blastz file"
-    lav_marker_list=find_lavmarkers(buf)
 
-    if lav_marker_list:
-        lav_coords=construct_coord(lav_marker_list)
+    seqs_names = set()
+    if compact:
+        matches = read_blastz_store(StringIO(buf), seqs_names, recordFilter)
     else:
-        return [], []
+        matches = list(iter_blastz(StringIO(buf), seqs_names, recordFilter))
 
-    seqs_names = set()
-    matches = []
+    return matches, list(seqs_names)
+
+def iter_blastz(ifile, seqs_names=None, recordFilter=None):
+    """
+    Takes a blastz alignment file object and yields its alignments,
+    one BlastzLocalAlignment at a time. The file is read line by line,
+    so only the current stanza is held in memory. If a set is passed
+    as seqs_names, the sequence names are added to it as they are read.
+    If a record_filter.RecordFilter is given, the alignments that fail
+    it are skipped before they are parsed.
+    """
+    for record, orient, name1, name2 in _iter_blastz_records(ifile,
+                                                             seqs_names):
+        if recordFilter is not None and \
+           not _blastz_record_passes(record, recordFilter):
+            continue
+        yield _parse_record(record, orient, name1, name2)
+
+def read_blastz_store(ifile, seqs_names=None, recordFilter=None):
+    """
+    Takes a blastz alignment file object and returns its alignments in
+    a BlastzStore, which is filled directly without creating any
+    BlastzLocalAlignment or BlastzUngappedBlock objects.
+    """
+    store = BlastzStore()
+    for record, orient, name1, name2 in _iter_blastz_records(ifile,
+                                                             seqs_names):
+        if recordFilter is not None and \
+           not _blastz_record_passes(record, recordFilter):
+            continue
+        (score, start_top, end_top, start_bot, end_bot,
+         blocks) = _parse_record_coords(record)
+        store.append((score, start_top, end_top, start_bot, end_bot,
+                      name1, name2, orient), blocks)
+
+    return store
+
+def build_blastz_index(path):
+    """
+    Takes the path of a blastz alignment file, plain or BGZF compressed,
+    and returns an offset_index.OffsetIndex of the byte ranges of its
+    lav blocks by sequence pair, with the orientation of each
+    """
+    compression = input_utils.get_compression(path)
+    index = offset_index.OffsetIndex()
+    ifile = open(path, 'rb')
+    try:
+        blocks = []             # [offset, orient, names] of each lav block
+        record_type = None
+        for i, (offset, line) in enumerate(
+                offset_index.iter_line_offsets(ifile, compression)):
+            line = line.rstrip('\r\n')
+            if i == 0:
+                assert line[0:5] == '#:lav', \
+                       " This does not look like a blastz file"
+                continue
+            if line[0:5] == '#:lav':
+                blocks.append([offset, None, None])
+            elif record_type is None:
+                if len(line) > 2 and line[2] == '{':
+                    record_type = line[0]
+                    record = [line]
+            elif line[0:1] == '}':
+                if blocks and record_type == 's':
+                    blocks[-1][1] = _get_s_orient(record)
+                elif blocks and record_type == 'h':
+                    blocks[-1][2] = _get_h_names('\n'.join(record))
+                record_type = None
+            elif record_type in ('s', 'h') and line and line[0] != '#':
+                record.append(line)
+
+        stops = [ block[0] for block in blocks[1:] ]
+        stops.append(offset_index.get_end_offset(path, compression))
+        for k, (start, orient, names) in enumerate(blocks):
+            if names is None:
+                continue
+            if orient is None:
+                orient = get_orient(k + 1, len(blocks))
+            index.add(start, stops[k], names[0], names[1], orient)
+    finally:
+        ifile.close()
+    return index
+
+def get_blastz_index(path):
+    """
+    Returns the offset_index.OffsetIndex of the blastz alignment file at
+    path, from its sidecar index file if it is up to date, or else
+    built with build_blastz_index() and saved next to the file
+    """
+    return offset_index.load_index(path, build_blastz_index)
+
+def iter_blastz_names(path, names, seqs_names=None, recordFilter=None):
+    """
+    Takes the path of a blastz alignment file and yields the alignments
+    of the lav blocks aligning one of the sequences names, reading only
+    these lav blocks, as given by the index of the file (see
+    get_blastz_index()). seqs_names and recordFilter are as for
+    iter_blastz().
+    """
+    index = get_blastz_index(path)
+    compression = input_utils.get_compression(path)
+    ifile = open(path, 'rb')
+    try:
+        for start, stop, name1, name2, orient in index.get_entries(names):
+            lines = offset_index.iter_range_lines(ifile, start, stop,
+                                                  compression)
+            # the lav block, after a stand-in for the marker opening the
+            # file; its orientation is the one indexed
+            lines = itertools.chain(['#:lav\n'], lines)
+            records = _iter_blastz_records(lines, seqs_names)
+            for record, stanzaOrient, name1, name2 in records:
+                if recordFilter is not None and \
+                   not _blastz_record_passes(record, recordFilter):
+                    continue
+                yield _parse_record(record, orient, name1, name2)
+    finally:
+        ifile.close()
+
+def build_blastz_record_index(path):
+    """
+    Takes the path of a blastz alignment file, plain or BGZF compressed,
+    and returns an offset_index.RecordIndex of the byte range of each
+    "a {" record block and the intervals it covers on its sequences
+    """
+    compression = input_utils.get_compression(path)
+    index = offset_index.RecordIndex()
+    ifile = open(path, 'rb')
+    try:
+        lav_counter = 0
+        record_type = None
+        last = None             # the record block closed by the last line
+        for i, (offset, line) in enumerate(
+                offset_index.iter_line_offsets(ifile, compression)):
+            # a record block runs to the start of the line after it
+            if last is not None:
+                index.add(last[0], offset, last[1], last[2])
+                last = None
+            line = line.rstrip('\r\n')
+            if i == 0:
+                assert line[0:5] == '#:lav', \
+                       " This does not look like a blastz file"
+                continue
+            if line[0:5] == '#:lav':
+                lav_counter += 1
+                orient = None
+                names = None
+            elif record_type is None:
+                if len(line) > 2 and line[2] == '{':
+                    record_type = line[0]
+                    record = [line]
+                    start = offset
+            elif line[0:1] == '}':
+                if lav_counter and record_type == 's' and orient is None:
+                    orient = _get_s_orient(record)
+                elif lav_counter and record_type == 'h' and names is None:
+                    names = _get_h_names('\n'.join(record))
+                elif lav_counter and record_type == 'a':
+                    if orient is None:
+                        orient = get_orient(lav_counter, lav_counter)
+                    (score, start_top, end_top, start_bot, end_bot,
+                     blocks) = _parse_record_coords(record[1:])
+                    last = (start, (names[0], start_top, end_top, orient),
+                            (names[1], start_bot, end_bot, orient))
+                record_type = None
+            elif line and line[0] != '#':
+                record.append(line)
+        if last is not None:
+            index.add(last[0], offset_index.get_end_offset(path, compression),
+                      last[1], last[2])
+    finally:
+        ifile.close()
+    return index
+
+def get_blastz_record_index(path):
+    """
+    Returns the offset_index.RecordIndex of the blastz alignment file at
+    path, from its sidecar index file if it is up to date, or else
+    built with build_blastz_record_index() and saved next to the file
+    """
+    return offset_index.load_index(path, build_blastz_record_index,
+                                   offset_index.RecordIndex)
+
+def _read_blastz_record_ivals(lines, ival1, ival2):
+    """
+    Returns the (ival1, ival2) pairs of the ungapped blocks of the "a {"
+    record block in lines, whose sequences and orientation are those of
+    ival1 and ival2
+    """
+    record = []
+    for line in lines:
+        line = line.strip()
+        if line and line[0] not in '#}' and line[-1:] != '{':
+            record.append(line)
+    name1, name2, orient = ival1[0], ival2[0], ival1[3]
+    return [ ((name1, a, b, orient), (name2, x, y, orient))
+             for (a, b, x, y, ident) in _parse_record_coords(record)[5] ]
+
+def create_lazy_blastz(path, seqDb, cacheSize=lazy_alignment.CACHE_SIZE):
+    """
+    Takes the path of a blastz alignment file, plain or BGZF compressed,
+    and the sequence database, and returns a
+    lazy_alignment.LazyAlignment of the file: sliced by an interval of
+    either sequence, it reads and parses only the record blocks
+    overlapping it, found through the sidecar record index of the file
+    (see get_blastz_record_index()), keeping the cacheSize most recently
+    parsed record blocks
+    """
+    index = get_blastz_record_index(path)
+    return lazy_alignment.LazyAlignment(path, index,
+                                        _read_blastz_record_ivals, seqDb,
+                                        seqDb, cacheSize)
+
+def _iter_blastz_records(ifile, seqs_names):
+    """
+    Read a blastz alignment file object line by line and yield the lines
+    of each "a {" record block with the orientation and sequence names
+    of its lav block. There may be any number of lav blocks, e.g. one
+    per sequence pair and strand; each takes its orientation from its
+    "s {" stanza and its sequence names from its "h {" stanza.
+    """
     lav_counter = 0
-    for coord in lav_coords:
-        lav_counter += 1
-        start_index = int(coord[0])
-        end_index = int(coord[1])
-        lav_block = buf[start_index:end_index]
-        records = lav_block.split('\n}\n')
-        orient = get_orient(lav_counter, len(lav_coords))
-        names = get_names(records)
-        seqs_names = seqs_names.union(set(names))
-        matches.extend(_parse_blastz_record_block(records, orient, names[0],
-                                                  names[1]))
+    first_line = True
+    record_type = None
+    record = []
+    names = None
 
-    return matches, list(seqs_names)
+    for line in ifile:
+        line = line.rstrip('\r\n')
+
+        if first_line:
+            assert line[0:5] == '#:lav'," This does not look like a blastz file"
+            first_line = False
+            continue
+
+        # a new lav block; the first marker only opens the "d {" stanza
+        if line[0:5] == '#:lav':
+            lav_counter += 1
+            orient = None
+            names = None
+            continue
+
+        if record_type is None:
+            # stanza header, e.g. "a {"
+            if len(line) > 2 and line[2] == '{':
+                record_type = line[0]
+                record = [line]
+            continue
+
+        if line[0:1] == '}':
+            if lav_counter and record_type == 's' and orient is None:
+                orient = _get_s_orient(record)
+            elif lav_counter and record_type == 'h' and names is None:
+                names = _get_h_names('\n'.join(record))
+                if seqs_names is not None:
+                    seqs_names.update(names)
+            elif lav_counter and record_type == 'a':
+                if orient is None:
+                    orient = get_orient(lav_counter, lav_counter)
+                yield record[1:], orient, names[0], names[1]
+            record_type = None
+            continue
+
+        # get rid of comments and empty lines
+        if line and line[0] != '#':
+            record.append(line)
+
+def _blastz_record_passes(record, recordFilter):
+    """
+    Check the lines of an "a {" record block against a RecordFilter,
+    reading the score line first and the ungapped block lines only if
+    the filter needs them.
+    """
+    if recordFilter.minScore is not None:
+        for line in record:
+            fields = line.split()
+            if fields[0] == 's':
+                if not recordFilter.accept_score(int(fields[1])):
+                    return False
+                break
+
+    if recordFilter.minBlockLength is None and recordFilter.maxGaps is None \
+       and not recordFilter.checks_matches():
+        return True
+
+    blocks = []
+    for line in record:
+        fields = line.split()
+        if fields[0] == 'l':
+            blocks.append(map(int, fields[1:]))
+
+    if not recordFilter.accept_gaps(max(len(blocks) - 1, 0)):
+        return False
+
+    # l lines hold 1-based start_top, start_bot, end_top, end_bot, ident
+    lengths = [ c - a + 1 for (a, b, c, d, e) in blocks ]
+    if not recordFilter.accept_block_lengths(lengths):
+        return False
+
+    if recordFilter.checks_matches():
+        matches = 0
+        for i in range(0, len(blocks)):
+            matches += int(round(lengths[i] * blocks[i][4] / 100.))
+        if not recordFilter.accept_matches(matches, sum(lengths) - matches):
+            return False
+
+    return True
 
 def _parse_blastz_record_block(records, orient, sequence_name1, sequence_name2):
     """
@@ -232,6 +702,21 @@ def _parse_record(record, orient, sequence_name1, sequence_name2):
     Parse individual lines in an "a {" record block, and return a
     BlastzLocalAlignment.
     """
+    (score, start_top, end_top, start_bot, end_bot,
+     blocks) = _parse_record_coords(record)
+
+    blocks = [ BlastzUngappedBlock(a, b, c, d, e) \
+               for (a, b, c, d, e) in blocks ]
+    
+    return BlastzLocalAlignment(score, start_top, end_top, start_bot, end_bot,
+                                sequence_name1, sequence_name2, orient, blocks)
+
+def _parse_record_coords(record):
+    """
+    Parse individual lines in an "a {" record block, and return the
+    score, the 0-based begin/end coords and a list of
+    (start_top, end_top, start_bot, end_bot, ident) block tuples.
+    """
     record = [ i.strip().split() for i in record ]
 
     blocks = []
@@ -252,57 +737,153 @@ def _parse_record(record, orient, sequence_name1, sequence_name2):
     start_top, start_bot = begin_coords
     end_top, end_bot = end_coords
 
-    blocks = [ BlastzUngappedBlock(a - 1, c, b - 1, d, e) \
-               for (a, b, c, d, e) in blocks ]
-    
-    return BlastzLocalAlignment(score,
-                                start_top - 1, end_top,
-                                start_bot - 1, end_bot, sequence_name1,
-                                sequence_name2, orient, blocks)
+    blocks = [ (a - 1, c, b - 1, d, e) for (a, b, c, d, e) in blocks ]
+
+    return score, start_top - 1, end_top, start_bot - 1, end_bot, blocks
 
-def build_blastz_ivals(buf, seqDb):
+def build_blastz_ivals(buf, seqDb, recordFilter=None, instrument=None,
+                       names=None):
     """
-    Takes blastz alignment file object as input and builds the
-    ivals
+    Takes blastz alignment file object (or buffer) as input and builds the
+    ivals, skipping the alignments that fail recordFilter if it is given;
+    the reading of the alignments is reported to instrument, if given,
+    as the parse stage. If a list of sequence names is given, buf must
+    be the path or a file object of a file, and only the lav blocks of
+    these sequences are read (see iter_blastz_names()).
     """
 
-    blastzaln_list, seqs_names = parse_blastz(buf)
+    if names is not None:
+        path = buf
+        if not isinstance(buf, basestring):
+            path = cache_utils.get_input_path(buf)
+        assert path is not None, "names need the path of a blastz file"
+        alignments = iter_blastz_names(path, names, recordFilter=recordFilter)
+    else:
+        if isinstance(buf, basestring):
+            assert buf[0:5] == '#:lav', \
+                   " This does not look like a blastz file"
+            buf = StringIO(buf)
+        alignments = iter_blastz(buf, recordFilter=recordFilter)
+    for blz_al in load_stats.iter_stage(alignments, instrument, 'parse'):
+        yield _get_alignment_ivals(blz_al)
+
+def _get_alignment_ivals(blz_al):
+    """
+    Returns the ivals of a BlastzLocalAlignment, or of a view of a
+    BlastzStore, one (ival1, ival2) pair per ungapped block
+    """
+    sequence_name1 = getattr(blz_al, "sequence_name1")
+    sequence_name2= getattr(blz_al, "sequence_name2")
+    orient = getattr(blz_al,"orient")
+    block = getattr(blz_al, "blocks")        
     
-    for blz_al in blastzaln_list:
-        sequence_name1 = getattr(blz_al, "sequence_name1")
-        sequence_name2= getattr(blz_al, "sequence_name2")
-        orient = getattr(blz_al,"orient")
-        block = getattr(blz_al, "blocks")        
+    ivals = []    
+    for ungapped in block:
         
-        ivals = []    
-        for ungapped in block:
-            
-            a = getattr(ungapped, "start_top")
-            b = getattr(ungapped, "end_top")
-            
-            x = getattr(ungapped, "start_bot")
-            y = getattr(ungapped, "end_bot")
+        a = getattr(ungapped, "start_top")
+        b = getattr(ungapped, "end_top")
+        
+        x = getattr(ungapped, "start_bot")
+        y = getattr(ungapped, "end_bot")
+
+        ival1 = (sequence_name1, a, b, orient)
+        ival2 = (sequence_name2, x, y, orient)
+        ivals.append((ival1,ival2))
 
-            ival1 = (sequence_name1, a, b, orient)
-            ival2 = (sequence_name2, x, y, orient)
-            ivals.append((ival1,ival2))
+    return ivals
 
-        yield ivals
+def build_blastz_block_index(matches):
+    """
+    Takes the alignments returned by parse_blastz(), as a list or a
+    BlastzStore, and returns an interval_index.IntervalIndex of their
+    ungapped blocks by sequence name, with the number of each block
+    counted over all the alignments and its side, 0 for the top and 1
+    for the bottom sequence, as value, and the array of the numbers of
+    the first blocks of the alignments (see
+    interval_index.build_block_index()); no NLMSA is built
+    """
+    return interval_index.build_block_index(
+        [ _get_alignment_ivals(blz_al) for blz_al in matches ])
   
-def create_NLMSA_blastz(buf, seqDb,al):
+def iter_ival_batches(buf, recordFilter=None,
+                      batchSize=ival_arrays.BATCH_SIZE):
+    """
+    Takes blastz alignment file object (or buffer) as input and yields
+    its ivals as (batch, names) pairs: batch is a structured array of
+    ival_arrays.IVAL_DTYPE with one row per ungapped block, ending with
+    the alignment that fills it to batchSize rows, and names the
+    NameTable of its sequence IDs. No per-block objects are created.
+    """
+
+    if isinstance(buf, basestring):
+        assert buf[0:5] == '#:lav'," This does not look like a blastz file"
+        buf = StringIO(buf)
+
+    builder = ival_arrays.IvalBatchBuilder(batchSize)
+    for record, orient, name1, name2 in _iter_blastz_records(buf, None):
+        if recordFilter is not None and \
+           not _blastz_record_passes(record, recordFilter):
+            continue
+        id1 = builder.get_id(name1)
+        id2 = builder.get_id(name2)
+        for (a, b, x, y, ident) in _parse_record_coords(record)[5]:
+            builder.add(id1, a, b, id2, x, y, orient, orient)
+        if builder.is_full():
+            yield builder.pop(), builder.names
+
+    if len(builder):
+        yield builder.pop(), builder.names
+
+def create_NLMSA_blastz(buf, seqDb, al, cache=None, recordFilter=None,
+                        instrument=None, names=None, **kwargs):
     """
     Takes blastz output file object/buffer as input and creates and
     returns NLMSA.
+    cache - a cache_utils.IvalsCache holding the ivals of earlier loads
+    recordFilter - a record_filter.RecordFilter the alignments must pass
+    instrument - a load_stats.LoadStats, or another instrumentation
+    object, the stages of the load are reported to
+    names - a list of sequence names; if given, buf must be the path or
+    a file object of a file, and only the lav blocks aligning one of
+    them are read, through the sidecar index of the file (see
+    get_blastz_index()); the cache then keys them by the size and
+    modification time of the file and their index entries, without
+    reading the whole file
+    Other keyword arguments (batchSize, batchBytes, verbose, cacheSize,
+    seqNames) are passed on to loader_utils.BulkLoader
     """
-    for ivals in build_blastz_ivals(buf, seqDb):
-        alignedIvalsAttrs = dict(id=0, start=1, stop=2, idDest=0, startDest=1,
-                                 stopDest=2, ori=3, oriDest=3)
-        cti = nlmsa_utils.CoordsToIntervals(seqDb, seqDb,
-                                            alignedIvalsAttrs)
-        al.add_aligned_intervals(cti(ivals))
-        
-
-    # build alignment
-    al.build()
-    return al
+    ifile = input_utils.open_input(buf)
+    try:
+        loader = loader_utils.BulkLoader(al, seqDb, seqDb,
+                                         loader_utils.ORIENTED_IVALS_ATTRS,
+                                         instrument=instrument, **kwargs)
+        options = ('blastz', repr(recordFilter))
+        fingerprint = None
+        if names is not None:
+            path = cache_utils.get_input_path(ifile)
+            assert path is not None, "names need the path of a blastz file"
+            build_ivals = lambda: build_blastz_ivals(path, seqDb,
+                                                     recordFilter,
+                                                     instrument, names)
+            options += (tuple(sorted(names)),)
+            fingerprint = lambda: offset_index.get_fingerprint(
+                get_blastz_index(path), names)
+        else:
+            build_ivals = lambda: build_blastz_ivals(ifile, seqDb,
+                                                     recordFilter,
+                                                     instrument)
+        ivals_iter = cache_utils.cached_ivals(cache, ifile, options,
+                                              build_ivals, oriented=True,
+                                              fingerprint=fingerprint)
+        ivals_iter = load_stats.iter_stage(ivals_iter, instrument, 'ivals',
+                                           len)
+        for ivals in ivals_iter:
+            loader.add(ivals)
+        loader.close()
+
+        # build alignment
+        load_stats.call_stage(instrument, 'build', al.build)
+        return al
+    finally:
+        input_utils.close_input(ifile, buf)
             
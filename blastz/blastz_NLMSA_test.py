@@ -1,9 +1,18 @@
 # Author Eden Elos
+import gzip
 import os
+import shutil
+import tempfile
 import unittest
+from cStringIO import StringIO
 from pygr import cnestedlist
 from pygr import seqdb
 import blastz_NLMSA
+import cache_utils
+import interval_index
+import ival_arrays
+import load_stats
+import record_filter
 
 class Blastz_test(unittest.TestCase):
     """
@@ -71,6 +80,197 @@ class Blastz_test(unittest.TestCase):
         self.assertEqual(last_ungapped_end_bot, 1120)
         self.assertEqual(last_ungapped_ident, 84)
 
+    def test_iter_blastz(self):
+        matches, genome_names = blastz_NLMSA.parse_blastz(self.buf)
+        seqs_names = set()
+        streamed = list(blastz_NLMSA.iter_blastz(open('output'), seqs_names))
+        self.assertEqual(seqs_names, set(genome_names))
+        self.assertEqual(len(streamed), len(matches))
+
+        for aln1, aln2 in zip(streamed, matches):
+            self.assertEqual((aln1.score, aln1.start_top, aln1.end_top,
+                              aln1.start_bot, aln1.end_bot, aln1.orient),
+                             (aln2.score, aln2.start_top, aln2.end_top,
+                              aln2.start_bot, aln2.end_bot, aln2.orient))
+            self.assertEqual([(b.start_top, b.end_top, b.start_bot,
+                               b.end_bot, b.ident) for b in aln1.blocks],
+                             [(b.start_top, b.end_top, b.start_bot,
+                               b.end_bot, b.ident) for b in aln2.blocks])
+
+    def test_parse_blastz_compact(self):
+        matches, genome_names = blastz_NLMSA.parse_blastz(self.buf)
+        store, store_names = blastz_NLMSA.parse_blastz(self.buf, compact=True)
+        self.assertEqual(set(store_names), set(genome_names))
+        self.assertEqual(len(store), len(matches))
+        self.assertEqual(store.get_block_total(), 4)
+
+        for aln1, aln2 in zip(store, matches):
+            for attr in ('score', 'start_top', 'end_top', 'start_bot',
+                         'end_bot', 'sequence_name1', 'sequence_name2',
+                         'orient'):
+                self.assertEqual(getattr(aln1, attr), getattr(aln2, attr))
+            self.assertEqual([(b.start_top, b.end_top, b.start_bot,
+                               b.end_bot, b.ident, len(b))
+                              for b in aln1.blocks],
+                             [(b.start_top, b.end_top, b.start_bot,
+                               b.end_bot, b.ident, len(b))
+                              for b in aln2.blocks])
+
+        last_ungapped = store[-1].blocks[-1]
+        self.assertEqual(last_ungapped.convert_to_text('A' * 1200, 'C' * 1200),
+                         ('A' * 818, 'C' * 818))
+
+
+    def test_multiple_lav_blocks(self):
+        """
+        Each lav block takes its strand and sequence names from its own
+        s and h stanzas
+        """
+        lav = self.buf[self.buf.index('#:lav', 1):]
+        reverse = lav.replace('"test_genomes2.fna" 1 1260 0 1',
+                              '"test_genomes2.fna-" 1 1260 1 1')
+        reverse = reverse.replace('">testgenome2"',
+                                  '">testgenome2 (reverse complement)"')
+        swapped = lav.replace('testgenome1', 'testgenomeX')
+        swapped = swapped.replace('testgenome2', 'testgenome1')
+        swapped = swapped.replace('testgenomeX', 'testgenome2')
+        buf = self.buf[:self.buf.index('#:lav', 1)] + lav + reverse + \
+              swapped + lav
+
+        seqs_names = set()
+        alignments = list(blastz_NLMSA.iter_blastz(StringIO(buf),
+                                                   seqs_names))
+        self.assertEqual([ (aln.sequence_name1, aln.sequence_name2,
+                            aln.orient) for aln in alignments ],
+                         [('testgenome1', 'testgenome2', 1),
+                          ('testgenome1', 'testgenome2', -1),
+                          ('testgenome2', 'testgenome1', 1),
+                          ('testgenome1', 'testgenome2', 1)])
+        self.assertEqual(seqs_names, set(['testgenome1', 'testgenome2']))
+
+        # without strands in the s stanzas, the position decides for
+        # the two lav blocks of a single pair only
+        unstranded = buf.replace(' 0 1\n', '\n').replace(' 1 1\n', '\n')
+        unstranded = unstranded.replace('.fna-"', '.fna"')
+        pair = self.buf[:self.buf.index('#:lav', 1)] + lav + lav
+        pair = pair.replace(' 0 1\n', '\n')
+        self.assertEqual([ aln.orient for aln in blastz_NLMSA.iter_blastz(
+                           StringIO(pair)) ], [1, -1])
+        self.assertRaises(AssertionError, list,
+                          blastz_NLMSA.iter_blastz(StringIO(unstranded)))
+
+    def test_empty_header(self):
+        """
+        An empty ">" header gives an empty name instead of an error
+        """
+        self.assertEqual(blastz_NLMSA._get_h_names(
+                         'h {\n   ">"\n   ">testgenome2"\n'),
+                         ['', 'testgenome2'])
+
+    def test_names(self):
+        """
+        Only the lav blocks of the given sequences are read, through the
+        index of the file, with the orientation of their s stanzas
+        """
+        lav = self.buf[self.buf.index('#:lav', 1):]
+        other = lav.replace('testgenome2', 'testgenome3')
+        other = other.replace('"test_genomes2.fna" 1 1260 0 1',
+                              '"test_genomes2.fna-" 1 1260 1 1')
+        buf = self.buf[:self.buf.index('#:lav', 1)] + lav + other + lav
+
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, 'output')
+            open(path, 'wb').write(buf)
+            index = blastz_NLMSA.get_blastz_index(path)
+            self.assertEqual([ entry[2:] for entry
+                               in index.get_entries(['testgenome3']) ],
+                             [('testgenome1', 'testgenome3', -1)])
+            self.assertEqual(len(index.get_entries(['testgenome1'])), 3)
+            self.assert_(os.path.exists(path + '.oix'))
+
+            alignments = list(blastz_NLMSA.iter_blastz_names(path,
+                                                             ['testgenome2']))
+            self.assertEqual([ (aln.sequence_name2, aln.orient)
+                               for aln in alignments ],
+                             [('testgenome2', 1), ('testgenome2', 1)])
+
+            # the orientation of the third lav block cannot be guessed
+            open(path, 'wb').write(buf.replace(' 0 1\n', '\n'))
+            os.utime(path, (0, 0))
+            self.assertRaises(AssertionError,
+                              blastz_NLMSA.get_blastz_index, path)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_ival_batches(self):
+        if ival_arrays.numpy is None:
+            return
+
+        expected = []
+        for ivals in blastz_NLMSA.build_blastz_ivals(self.buf, None):
+            expected.extend(ivals)
+
+        result = []
+        for batch, names in blastz_NLMSA.iter_ival_batches(self.buf,
+                                                           batchSize=3):
+            result.extend(ival_arrays.iter_ivals(batch, names, True))
+        self.assertEqual(result, expected)
+        self.assertEqual(len(result), 4)
+
+    def test_build_blastz_block_index(self):
+        """
+        The blocks overlapping an interval, found in the block index of
+        the parsed alignments, list or BlastzStore, are those checked
+        one by one
+        """
+        matches, genome_names = blastz_NLMSA.parse_blastz(self.buf)
+        store, store_names = blastz_NLMSA.parse_blastz(self.buf, compact=True)
+        for alignments in (matches, store):
+            index, firstBlocks = \
+                   blastz_NLMSA.build_blastz_block_index(alignments)
+            self.assertEqual(sorted(index.keys()), sorted(genome_names))
+            starts = range(0, 1200, 20)
+            stops = [ start + 30 for start in starts ]
+            queries, blocks = index.find_overlaps_batch('testgenome2',
+                                                        starts, stops)
+            ks, js, sides = interval_index.get_alignment_blocks(firstBlocks,
+                                                                blocks)
+            self.assertEqual(set(sides), set([1]))
+            found = [ (queries[i], ks[i], js[i])
+                      for i in range(0, len(queries)) ]
+
+            expected = []
+            for i in range(0, len(starts)):
+                for k in range(0, len(matches)):
+                    for j, block in enumerate(matches[k].blocks):
+                        if block.start_bot < stops[i] and \
+                           block.end_bot > starts[i]:
+                            expected.append((i, k, j))
+            self.assertEqual(sorted(found), expected)
+            self.assert_(expected)
+
+    def test_parse_blastz_filter(self):
+        def count(recordFilter, compact=False):
+            matches, names = blastz_NLMSA.parse_blastz(self.buf, compact,
+                                                       recordFilter)
+            return len(matches)
+
+        RecordFilter = record_filter.RecordFilter
+        self.assertEqual(count(RecordFilter()), 1)
+        self.assertEqual(count(RecordFilter(minScore=74457)), 1)
+        self.assertEqual(count(RecordFilter(minScore=74458)), 0)
+        self.assertEqual(count(RecordFilter(minScore=74458), True), 0)
+        self.assertEqual(count(RecordFilter(maxGaps=3)), 1)
+        self.assertEqual(count(RecordFilter(maxGaps=2)), 0)
+        self.assertEqual(count(RecordFilter(minBlockLength=818)), 1)
+        self.assertEqual(count(RecordFilter(minBlockLength=819)), 0)
+        # 903 matches in 1078 aligned bases, 83.8% identity
+        self.assertEqual(count(RecordFilter(minMatches=903,
+                                            minIdentity=83)), 1)
+        self.assertEqual(count(RecordFilter(minMatches=904)), 0)
+        self.assertEqual(count(RecordFilter(minIdentity=84)), 0)
+
 
 class Blastz_NLMSA_test(unittest.TestCase):
 
@@ -115,6 +315,177 @@ class Blastz_NLMSA_test(unittest.TestCase):
         self.assertEqual(temp_lst,[])
 
         # can add additional manual tests
+
+    def test_align_file_object(self):
+        """
+        Building from an open file object gives the same alignments as
+        building from the file buffer
+        """
+
+        alignment = cnestedlist.NLMSA('test2', mode='memory', seqDict=self.db,
+                                      use_virtual_lpo=True)
+        nlmsa = blastz_NLMSA.create_NLMSA_blastz(open('output'), self.db,
+                                                 alignment)
+
+        s1 = self.db['testgenome1']
+        self.assertEqual([str(s2) for s2 in nlmsa[s1[40:50]]],
+                         [str(s2) for s2 in self.temp_nlmsa[s1[40:50]]])
+
+    def test_align_path(self):
+        """
+        Building from the path of the file gives the same alignments as
+        building from the file buffer
+        """
+
+        alignment = cnestedlist.NLMSA('test2', mode='memory', seqDict=self.db,
+                                      use_virtual_lpo=True)
+        nlmsa = blastz_NLMSA.create_NLMSA_blastz('output', self.db, alignment)
+
+        s1 = self.db['testgenome1']
+        self.assertEqual([str(s2) for s2 in nlmsa[s1[40:50]]],
+                         [str(s2) for s2 in self.temp_nlmsa[s1[40:50]]])
+
+    def test_align_gzip(self):
+        """
+        Building from a gzip compressed buffer gives the same alignments
+        as building from the file buffer
+        """
+
+        ofile = StringIO()
+        gzipFile = gzip.GzipFile(fileobj=ofile, mode='wb')
+        gzipFile.write(self.buf)
+        gzipFile.close()
+        alignment = cnestedlist.NLMSA('test2', mode='memory', seqDict=self.db,
+                                      use_virtual_lpo=True)
+        nlmsa = blastz_NLMSA.create_NLMSA_blastz(ofile.getvalue(), self.db,
+                                                 alignment)
+
+        s1 = self.db['testgenome1']
+        self.assertEqual([repr(s2) for s2 in nlmsa[s1]],
+                         [repr(s2) for s2 in self.temp_nlmsa[s1]])
+
+    def test_align_names(self):
+        """
+        Loading the alignments of a sequence through the index of the
+        file gives the same alignments of it
+        """
+
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, 'output')
+            open(path, 'wb').write(self.buf)
+            alignment = cnestedlist.NLMSA('test2', mode='memory',
+                                          seqDict=self.db,
+                                          use_virtual_lpo=True)
+            nlmsa = blastz_NLMSA.create_NLMSA_blastz(path, self.db,
+                                                     alignment,
+                                                     names=['testgenome2'])
+        finally:
+            shutil.rmtree(tempDir)
+
+        s1 = self.db['testgenome1']
+        self.assertEqual([repr(s2) for s2 in nlmsa[s1]],
+                         [repr(s2) for s2 in self.temp_nlmsa[s1]])
+
+    def test_align_lazy(self):
+        """
+        The slices of the lazy alignment of the file are those of the
+        NLMSA, for intervals of both sequences
+        """
+
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, 'output')
+            open(path, 'wb').write(self.buf)
+            al = blastz_NLMSA.create_lazy_blastz(path, self.db)
+            try:
+                self.assert_(os.path.exists(path + '.rix'))
+                s1 = self.db['testgenome1']
+                s2 = self.db['testgenome2']
+                self.assertEqual([str(s) for s in al[s1[40:50]]],
+                                 ['TGGTTGAAAA'])
+                self.assertEqual(len(al[s2[:10]]), 0)
+                for ival in (s1, s2, s1[100:300], -s2[40:90]):
+                    self.assertEqual(sorted([repr(s) for s in al[ival]]),
+                                     sorted([repr(s) for s
+                                             in self.temp_nlmsa[ival]]))
+            finally:
+                al.close()
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_align_cache(self):
+        """
+        Building from the cached ivals gives the same alignments as
+        building from the file
+        """
+
+        cacheDir = tempfile.mkdtemp()
+        try:
+            cache = cache_utils.IvalsCache(cacheDir)
+            s1 = self.db['testgenome1']
+            for i in range(0, 2):
+                alignment = cnestedlist.NLMSA('test%d' % i, mode='memory',
+                                              seqDict=self.db,
+                                              use_virtual_lpo=True)
+                nlmsa = blastz_NLMSA.create_NLMSA_blastz(open('output'),
+                                                         self.db, alignment,
+                                                         cache=cache)
+                self.assertEqual([str(s2) for s2 in nlmsa[s1[40:50]]],
+                                 ['TGGTTGAAAA'])
+            self.assertEqual(len(os.listdir(cacheDir)), 1)
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def test_nlmsa_cache(self):
+        """
+        The NLMSA is built once, then opened read-only from the cache
+        """
+
+        cacheDir = tempfile.mkdtemp()
+        try:
+            cache = cache_utils.NLMSACache(cacheDir)
+            builds = []
+            def create(al):
+                builds.append(al)
+                return blastz_NLMSA.create_NLMSA_blastz(open('output'),
+                                                        self.db, al)
+
+            s1 = self.db['testgenome1']
+            for i in range(0, 2):
+                nlmsa = cache.get_NLMSA([open('output')], self.db, create,
+                                        ('blastz',), use_virtual_lpo=True)
+                self.assertEqual([str(s2) for s2 in nlmsa[s1[40:50]]],
+                                 ['TGGTTGAAAA'])
+                nlmsa.close()
+            self.assertEqual(len(builds), 1)
+            self.assertEqual(len(os.listdir(cacheDir)), 1)
+
+            cache.get_NLMSA([open('output')], self.db, create,
+                            ('blastz', 'other'), use_virtual_lpo=True)
+            self.assertEqual(len(builds), 2)
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def test_instrument(self):
+        """
+        Every stage of the load is reported to the instrument
+        """
+
+        alignment = cnestedlist.NLMSA('test2', mode='memory', seqDict=self.db,
+                                      use_virtual_lpo=True)
+        stats = load_stats.LoadStats()
+        nlmsa = blastz_NLMSA.create_NLMSA_blastz(open('output'), self.db,
+                                                 alignment, instrument=stats)
+        self.assertEqual([ stage.name for stage in stats.get_stages() ],
+                         list(load_stats.STAGES))
+        self.assertEqual([ stats[name].count for name in load_stats.STAGES ],
+                         [1, 4, 4, 4, 0])
+        self.assertEqual(stats['build'].calls, 1)
+
+        s1 = self.db['testgenome1']
+        self.assertEqual([str(s2) for s2 in nlmsa[s1[40:50]]],
+                         ['TGGTTGAAAA'])
     
         
 
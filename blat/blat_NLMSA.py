@@ -11,13 +11,37 @@ builds pygr NLMSAs with it. The module defines the following class:
 
 - `BlatLocalAlignment`, a blat gapped local alignment, consisting of
   multiple ungapped blocks.
+- `BlatStore`, compact columnar storage for many blat alignments, giving
+  views with the same attributes as BlatLocalAlignment.
 
 Functions:
 
 - `parse_blat()`: takes a blat alignment buffer and returns a list of
   BlastLocalAlignments and names of the sequences
+- `iter_blat()`: reads a blat alignment file object line by line and
+  yields one BlatLocalAlignment per record
+- `build_blat_index()`: index the records of a blat file by their query
+  and target names
+- `get_blat_index()`: return the index of a blat file, from its sidecar
+  index file, building it if needed
+- `iter_blat_names()`: read the records of some sequences of a blat
+  file through its index
+- `build_blat_record_index()`: index each record of a blat file with
+  the intervals it covers
+- `get_blat_record_index()`: return the record index of a blat file,
+  from its sidecar index file, building it if needed
+- `create_lazy_blat()`: takes the path of a blat file and returns a
+  read-only alignment answering slice queries from the file
+- `read_blat_store()`: reads a blat alignment file object into a BlatStore
 - `build_blat_ivals():`: takes blat file buffer and sequence db
   as input and builds the ivals
+- `build_blat_ivals_parallel()`: takes the path of a blat file and builds
+  the same ivals, parsing parts of the file in worker processes
+- `iter_ival_batches()`: yield the ivals of a blat file as structured
+  NumPy arrays
+- `build_blat_block_index()`: index the ungapped blocks of the alignments
+  returned by parse_blat() by sequence interval, for overlap queries
+  without an NLMSA
 - `create_NLMSA_blat()`: takes blat alignment file buffer, sequence db and NLMSA
   as input and returns a modified/built NLMSA
 
@@ -38,12 +62,83 @@ How To Use This Module
    NLMSA.
    ``nlmsa_aln = create_NLMSA_blat(buf, al, srcDB, destDB, protDNAaln=True)``
 
+   buf may also be an open file object, in which case the records are
+   read one line at a time and memory use does not grow with the file size.
+   It may also be the path of the file, which is then memory-mapped and
+   read the same way. A gzip or BGZF compressed file, path or buffer is
+   decompressed as it is read; with processes > 1, a BGZF file is split
+   at its block boundaries and its parts decompressed and parsed in
+   worker processes:
+   ``nlmsa_aln = create_NLMSA_blat('output.psl.gz', al, srcDB, destDB,``
+   ``                              processes=4)``
+
+3. To load only the records that pass score, block length, matches,
+   identity or gap cutoffs, pass a record_filter.RecordFilter; the
+   records that fail are rejected from their count columns, before
+   they are parsed:
+   ``recordFilter = record_filter.RecordFilter(minIdentity=95)``
+   ``nlmsa_aln = create_NLMSA_blat(buf, al, srcDB, destDB,``
+   ``                              recordFilter=recordFilter)``
+
+4. Large files can be parsed in several worker processes: the file is
+   split into byte ranges aligned to line boundaries, each parsed by a
+   worker into a compact batch, and the batches are added to the NLMSA
+   in file order by the calling process, so the NLMSA is the same as
+   when parsing serially:
+   ``nlmsa_aln = create_NLMSA_blat(open('output.psl'), al, srcDB, destDB,``
+   ``                              processes=8)``
+
+5. To load only the records of some sequences out of a large file, pass
+   their names with the path of the file; the first such load indexes
+   the file, in a sidecar file next to it (output.psl.oix), and every
+   load reads only the ranges of the file holding the records of these
+   sequences, so its time grows with their records only:
+   ``nlmsa_aln = create_NLMSA_blat('output.psl', al, srcDB, destDB,``
+   ``                              names=['chr21'])``
+   The file may be plain or BGZF compressed; a gzip file cannot be
+   indexed.
+
+6. For a few queries on a large file, no NLMSA needs to be built at
+   all: create_lazy_blat() indexes each record of the file with the
+   intervals it covers, in a sidecar file (output.psl.rix), and its
+   slices read and parse only the records overlapping them:
+   ``al = create_lazy_blat('output.psl', srcDB, destDB, protDNAaln=False)``
+   ``for s in al[destDB['chr1'][1000:2000]]:``
+
+7. To ask which blocks of parsed alignments overlap some intervals,
+   without building an NLMSA, index their blocks in memory and query
+   the index, one interval or a batch of intervals at a time (see
+   interval_index for its build time and memory cost):
+   ``matches, names = parse_blat(buf, protDNAaln=False)``
+   ``index, firstBlocks = build_blat_block_index(matches)``
+   ``queries, values = index.find_overlaps_batch('chr1', starts, stops)``
+   ``alignments, blocks, sides = interval_index.get_alignment_blocks(``
+   ``    firstBlocks, values)``
+
 """
 
 __docformat__ = 'restructuredtext'
 
+import os
+import sys
+from array import array
+from cStringIO import StringIO
 from pygr import cnestedlist, nlmsa_utils, seqdb, translationDB
 
+# the code shared by the loaders lives in common/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'common'))
+import block_store
+import cache_utils
+import input_utils
+import interval_index
+import ival_arrays
+import lazy_alignment
+import load_stats
+import loader_utils
+import offset_index
+import parallel_utils
+
 # BlatLocalAlignment
 
 class BlatLocalAlignment:
@@ -91,6 +186,62 @@ class BlatUngappedBlock:
 
         return (q, t)
 
+# BlatStore
+
+class BlatLocalAlignmentView(block_store.AlignmentView):
+    """
+    A view of a single alignment in a BlatStore, with the same
+    attributes as a BlatLocalAlignment.
+    """
+    __slots__ = ()
+
+    def get_orient(self):
+        """
+        Returns the orientation string, e.g. '+-'
+        """
+        return _orient_char[self.qOri] + _orient_char[self.tOri]
+
+    orient = property(get_orient)
+
+class BlatUngappedBlockView(block_store.BlockView):
+    """
+    A view of a single ungapped block in a BlatStore, with the same
+    attributes and methods as a BlatUngappedBlock.
+    """
+    __slots__ = ()
+
+    orient = property(lambda self: self.alignment.orient)
+
+    def __len__(self):
+        return self.tEnd - self.tStart
+
+    def convert_to_text(self, seq1, seq2):
+        """
+        Return the ungapped alignment query and target as sequence.
+        """
+        q = seq1[self.qStart:self.qEnd]
+        t = seq2[self.tStart:self.tEnd]
+
+        return (q, t)
+
+class BlatStore(block_store.BlockStore):
+    """
+    Compact columnar storage for blat alignments. Indexing or
+    iterating over it gives views with the same attributes as a
+    BlatLocalAlignment.
+    """
+    alignment_class = BlatLocalAlignmentView
+    block_class = BlatUngappedBlockView
+    aln_fields = (('qStart', 'l'), ('qEnd', 'l'), ('tStart', 'l'),
+                  ('tEnd', 'l'), ('qSeqName', 'i'), ('tSeqName', 'i'),
+                  ('qOri', 'b'), ('tOri', 'b'))
+    block_fields = (('qStart', 'l'), ('qEnd', 'l'), ('tStart', 'l'),
+                    ('tEnd', 'l'))
+    name_fields = ('qSeqName', 'tSeqName')
+
+_orient_char = {1: '+', -1: '-'}
+_orient_value = {'+': 1, '-': -1}
+
 def calculate_end(Starts, blockSize, protDNAaln):
     """
     Calculate the end coordinates of ungapped blocks
@@ -105,123 +256,607 @@ def calculate_end(Starts, blockSize, protDNAaln):
 
     return Ends
        
-def parse_blat(buf, protDNAaln):
+def parse_blat(buf, protDNAaln, compact=False, recordFilter=None):
     """
     Takes a blat alignment buffer and alignment type and returns a list 
-    of BlastLocalAlignments and names of the sequences.
+    of BlastLocalAlignments and names of the sequences. If compact is
+    True, the alignments are returned in a BlatStore instead of a list.
+    If a record_filter.RecordFilter is given, the records that fail it
+    are skipped.
     """
 
     assert buf[0:8] == 'psLayout', " This is not a blat alignment file"
-    
-    records = buf.strip().split('\n')
-    records = records[5:]
-    
+
     seqs_names = set()
-    matches = []
+    if compact:
+        matches = read_blat_store(StringIO(buf), protDNAaln, seqs_names,
+                                  recordFilter)
+    else:
+        matches = list(iter_blat(StringIO(buf), protDNAaln, seqs_names,
+                                 recordFilter))
 
-    # Each line/record in a blat alignment file contains a single
-    # alignment to be represented by a BlatLocalAlignment object.
-    # The elements/fields in a record are tab-separated
-    # and the particular indices used is according to the specification
-    # of the default blat alignment output.
-    
-    records = [ i.strip().split('\t') for i in records ]
-    
-    for record in records:
-       # Extracting orientation information 
-       if len(record[8]) == 1:
-           orient = record[8] + record[8]
-       else:
-           orient = record[8]
-           
-       qName = record[9]
-       tName = record[13]
-       qStart = int(record[11])
-       tStart = int(record[15])
-       qEnd = int(record[12])
-       tEnd = int(record[16])
-       blockCount = int(record[17])
-       blockSize = map(int, record[18].strip(',').split(','))
-       qStarts = map(int, record[19].strip(',').split(','))       
-       tStarts = map(int, record[20].strip(',').split(','))
-       qEnds = map(int, calculate_end(qStarts, blockSize, False))
-       tEnds = map(int, calculate_end(tStarts, blockSize, protDNAaln))
-       seqs_names = seqs_names.union(set([qName, tName]))
-
-       # construct a list of tuples with each tuple containing
-       # the i^th ungapped blocks's coords
-       # i.e. qStarts[i], tStarts[i], qEnds[i], tEnds[i]
-       
-       blocks = []  
-       for i in range(0, len(qStarts)):
-           blocks.append((qStarts[i], tStarts[i], qEnds[i], tEnds[i], orient))
+    return matches, list(seqs_names)
 
-       blocks = [ BlatUngappedBlock(a, c, b, d, ori) \
-               for (a, b, c, d, ori) in blocks ]
+def iter_blat(ifile, protDNAaln, seqs_names=None, recordFilter=None):
+    """
+    Takes a blat alignment file object and alignment type and yields
+    one BlatLocalAlignment per record, reading the file line by line.
+    If a set is passed as seqs_names, the query and target names are
+    added to it as they are read. If a record_filter.RecordFilter is
+    given, the records that fail it are skipped before they are parsed.
+    """
 
-       blatLocalAln = BlatLocalAlignment(qStart, qEnd, tStart, tEnd,
-                                       qName, tName, orient, blocks)
-       
-       matches.append(blatLocalAln)       
+    for record in _iter_blat_records(ifile, protDNAaln, recordFilter):
+        blatLocalAln = _parse_blat_record(record, protDNAaln)
+        if seqs_names is not None:
+            seqs_names.add(blatLocalAln.qSeqName)
+            seqs_names.add(blatLocalAln.tSeqName)
 
-    return matches, list(seqs_names)
+        yield blatLocalAln
 
-def build_blat_ivals(buf, protDNAaln):
+def build_blat_index(path):
     """
-    Takes a blat file buffer and alignment type as input and builds the ivals
+    Takes the path of a blat alignment file, plain or BGZF compressed,
+    and returns an offset_index.OffsetIndex of the byte ranges of its
+    records by query and target name
     """
-    blataln_list, seqs_names = parse_blat(buf, protDNAaln)
-    
-    for blt_al in blataln_list:
-        seqs_name1 = getattr(blt_al, "qSeqName")
-        seqs_name2 = getattr(blt_al, "tSeqName")
-        ivals = []   
-        block = getattr(blt_al, "blocks")
-        
-        for ungapped in block:
-            a = getattr(ungapped, "qStart")
-            b = getattr(ungapped, "qEnd")
-            
-            x = getattr(ungapped, "tStart")
-            y = getattr(ungapped, "tEnd")
-
-            orient = getattr(ungapped, "orient")
-            
-            if orient[0] == '+':
-                orient1 = 1
-            else:
-                orient1 = -1
-            
-            if orient[1] == '+':
-                orient2 = 1
-            else:
-                orient2 = -1
-            
-            ival1 = (seqs_name1, a, b, orient1)
-            ival2 = (seqs_name2, x, y, orient2)
-            
-            ivals.append((ival1, ival2))
-
-        yield ivals
-
-def create_NLMSA_blat(buf, al, srcDB, destDB, protDNAaln=True):
-    """
-    Takes a blat alignment file buffer (buf), NLMSA (al), alignment type (protDNAaln),
-    srcDB and destDB as input and returns a built NLMSA
-    protDNAaln - arg with True denoting protein-dna alignment and 
-    False denoting protein-protein or dna-dna alignments 
+    compression = input_utils.get_compression(path)
+    index = offset_index.OffsetIndex()
+    ifile = open(path, 'rb')
+    try:
+        last = None             # the offset and names of the last record
+        for i, (offset, line) in enumerate(
+                offset_index.iter_line_offsets(ifile, compression)):
+            if i < 5:
+                if i == 0:
+                    assert line[0:8] == 'psLayout', \
+                           " This is not a blat alignment file"
+                continue
+            fields = line.split('\t', 14)
+            if len(fields) < 15:
+                continue
+            # a record runs to the start of the next one
+            if last is not None:
+                index.add(last[0], offset, last[1], last[2])
+            last = (offset, fields[9], fields[13])
+        if last is not None:
+            index.add(last[0], offset_index.get_end_offset(path, compression),
+                      last[1], last[2])
+    finally:
+        ifile.close()
+    return index
+
+def get_blat_index(path):
+    """
+    Returns the offset_index.OffsetIndex of the blat alignment file at
+    path, from its sidecar index file if it is up to date, or else
+    built with build_blat_index() and saved next to the file
+    """
+    return offset_index.load_index(path, build_blat_index)
+
+def iter_blat_names(path, protDNAaln, names, seqs_names=None,
+                    recordFilter=None):
+    """
+    Takes the path of a blat alignment file and alignment type and
+    yields a BlatLocalAlignment for each record whose query or target
+    is one of names, reading only the ranges of the file holding them,
+    as given by its index (see get_blat_index()). seqs_names and
+    recordFilter are as for iter_blat().
+    """
+    index = get_blat_index(path)
+    compression = input_utils.get_compression(path)
+    ifile = open(path, 'rb')
+    try:
+        for start, stop, name1, name2, orient in index.get_entries(names):
+            lines = offset_index.iter_range_lines(ifile, start, stop,
+                                                  compression)
+            for record in _iter_blat_records(lines, protDNAaln,
+                                             recordFilter, header=False):
+                blatLocalAln = _parse_blat_record(record, protDNAaln)
+                if seqs_names is not None:
+                    seqs_names.add(blatLocalAln.qSeqName)
+                    seqs_names.add(blatLocalAln.tSeqName)
+                yield blatLocalAln
+    finally:
+        ifile.close()
+
+def _get_blat_extents(record):
+    """
+    Returns the (name, start, stop, ori) intervals covered by a blat
+    record on its query and target, in the coordinates of its blocks:
+    the qStarts of a - query strand are on the reverse strand, but the
+    tStarts are so only for a - target strand given as a second strand
+    character (a translated alignment); the start and end fields are
+    always on the forward strand
+    """
+    strand = record[8]
+    if len(strand) == 1:
+        orient = strand + strand
+    else:
+        orient = strand
+
+    extents = []
+    for k, (name, size, start, end) in enumerate(
+            ((record[9], record[10], record[11], record[12]),
+             (record[13], record[14], record[15], record[16]))):
+        start, end = int(start), int(end)
+        ori = _orient_value[orient[k]]
+        if ori < 0 and (k == 0 or len(strand) == 2):
+            start, end = int(size) - end, int(size) - start
+        extents.append((name, start, end, ori))
+    return extents
+
+def build_blat_record_index(path):
+    """
+    Takes the path of a blat alignment file, plain or BGZF compressed,
+    and returns an offset_index.RecordIndex of the byte range of each
+    record and the intervals it covers on its query and target
+    """
+    compression = input_utils.get_compression(path)
+    index = offset_index.RecordIndex()
+    ifile = open(path, 'rb')
+    try:
+        last = None             # the offset and intervals of the last record
+        for i, (offset, line) in enumerate(
+                offset_index.iter_line_offsets(ifile, compression)):
+            if i < 5:
+                if i == 0:
+                    assert line[0:8] == 'psLayout', \
+                           " This is not a blat alignment file"
+                continue
+            fields = line.split('\t', 17)
+            if len(fields) < 18:
+                continue
+            # a record runs to the start of the next one
+            if last is not None:
+                index.add(last[0], offset, last[1], last[2])
+            last = [offset] + _get_blat_extents(fields)
+        if last is not None:
+            index.add(last[0], offset_index.get_end_offset(path, compression),
+                      last[1], last[2])
+    finally:
+        ifile.close()
+    return index
+
+def get_blat_record_index(path):
+    """
+    Returns the offset_index.RecordIndex of the blat alignment file at
+    path, from its sidecar index file if it is up to date, or else
+    built with build_blat_record_index() and saved next to the file
+    """
+    return offset_index.load_index(path, build_blat_record_index,
+                                   offset_index.RecordIndex)
+
+def _read_blat_record_ivals(lines, protDNAaln):
+    """
+    Returns the (ival1, ival2) pairs of the ungapped blocks of the blat
+    records in lines
+    """
+    ivals = []
+    for record in _iter_blat_records(lines, protDNAaln, header=False):
+        (qStart, qEnd, tStart, tEnd, qName, tName, orient,
+         blocks) = _parse_blat_coords(record, protDNAaln)
+        qOri = _orient_value[orient[0]]
+        tOri = _orient_value[orient[1]]
+        for (a, b, x, y) in blocks:
+            ivals.append(((qName, a, b, qOri), (tName, x, y, tOri)))
+    return ivals
+
+def create_lazy_blat(path, srcDB, destDB, protDNAaln=True,
+                     cacheSize=lazy_alignment.CACHE_SIZE):
+    """
+    Takes the path of a blat alignment file, plain or BGZF compressed,
+    the query and target databases and the alignment type, and returns
+    a lazy_alignment.LazyAlignment of the file: sliced by a query or
+    target interval, it reads and parses only the records overlapping
+    it, found through the sidecar record index of the file (see
+    get_blat_record_index()), keeping the cacheSize most recently
+    parsed records
+    """
+    index = get_blat_record_index(path)
+    read_ivals = lambda lines, ival1, ival2: \
+                 _read_blat_record_ivals(lines, protDNAaln)
+    return lazy_alignment.LazyAlignment(path, index, read_ivals, srcDB,
+                                        destDB, cacheSize)
+
+def read_blat_store(ifile, protDNAaln, seqs_names=None, recordFilter=None):
+    """
+    Takes a blat alignment file object and alignment type and returns
+    its alignments in a BlatStore, which is filled directly without
+    creating any BlatLocalAlignment or BlatUngappedBlock objects.
+    """
+
+    store = BlatStore()
+    for record in _iter_blat_records(ifile, protDNAaln, recordFilter):
+        (qStart, qEnd, tStart, tEnd, qName, tName, orient,
+         blocks) = _parse_blat_coords(record, protDNAaln)
+        if seqs_names is not None:
+            seqs_names.add(qName)
+            seqs_names.add(tName)
+
+        store.append((qStart, qEnd, tStart, tEnd, qName, tName,
+                      _orient_value[orient[0]], _orient_value[orient[1]]),
+                     blocks)
+
+    return store
+
+def _iter_blat_records(ifile, protDNAaln=False, recordFilter=None,
+                       header=True):
+    """
+    Read a blat alignment file object (or an iterator over its lines)
+    line by line, skipping the header unless header is False, and yield
+    the tab-separated fields of each record that passes recordFilter,
+    if it is given.
+    """
+
+    if header:
+        header_lines = 5
+    else:
+        header_lines = 0
+    for line in ifile:
+        if header_lines:
+            if header_lines == 5:
+                assert line[0:8] == 'psLayout', \
+                       " This is not a blat alignment file"
+            header_lines -= 1
+            continue
+
+        line = line.strip()
+        if not line:
+            continue
+
+        # The elements/fields in a record are tab-separated
+        record = line.split('\t')
+        if recordFilter is not None and \
+           not _blat_record_passes(record, protDNAaln, recordFilter):
+            continue
+        yield record
+
+def _blat_record_passes(record, protDNAaln, recordFilter):
+    """
+    Check the fields of a blat record against a RecordFilter, using the
+    match, mismatch and insert count columns and reading the block
+    sizes only if the filter needs them. The score is the UCSC pslScore.
+    """
+    matches, misMatches, repMatches = map(int, record[0:3])
+    qNumInsert = int(record[4])
+    tNumInsert = int(record[6])
+
+    if recordFilter.minScore is not None:
+        if protDNAaln:
+            sizeMul = 3
+        else:
+            sizeMul = 1
+        score = sizeMul * (matches + (repMatches >> 1)) \
+                - sizeMul * misMatches - qNumInsert - tNumInsert
+        if not recordFilter.accept_score(score):
+            return False
+
+    if not recordFilter.accept_gaps(qNumInsert + tNumInsert):
+        return False
+
+    if not recordFilter.accept_matches(matches + repMatches, misMatches):
+        return False
+
+    if recordFilter.minBlockLength is not None:
+        blockSize = map(int, record[18].strip(',').split(','))
+        if not recordFilter.accept_block_lengths(blockSize):
+            return False
+
+    return True
+
+def _parse_blat_record(record, protDNAaln):
+    """
+    Parse the fields of a single blat record and return a
+    BlatLocalAlignment.
     """
-    ivals_list = build_blat_ivals(buf, protDNAaln)
 
-    alignedIvalsAttrs = dict(id=0, start=1, stop=2, idDest=0, startDest=1,
-                             stopDest=2, ori=3, oriDest=3)        
+    (qStart, qEnd, tStart, tEnd, qName, tName, orient,
+     blocks) = _parse_blat_coords(record, protDNAaln)
 
-    cti = nlmsa_utils.CoordsToIntervals(srcDB, destDB,
-                                        alignedIvalsAttrs)
+    blocks = [ BlatUngappedBlock(a, b, c, d, orient) \
+               for (a, b, c, d) in blocks ]
+
+    return BlatLocalAlignment(qStart, qEnd, tStart, tEnd,
+                              qName, tName, orient, blocks)
+
+def _parse_blat_coords(record, protDNAaln):
+    """
+    Parse the fields of a single blat record and return its coords,
+    names, orientation and a list of (qStart, qEnd, tStart, tEnd)
+    block tuples.
+    """
+
+    # Each line/record in a blat alignment file contains a single
+    # alignment. The particular indices used is according to the
+    # specification of the default blat alignment output.
+
+    # Extracting orientation information 
+    if len(record[8]) == 1:
+        orient = record[8] + record[8]
+    else:
+        orient = record[8]
+
+    qName = record[9]
+    tName = record[13]
+    qStart = int(record[11])
+    tStart = int(record[15])
+    qEnd = int(record[12])
+    tEnd = int(record[16])
+    blockSize = map(int, record[18].strip(',').split(','))
+    qStarts = map(int, record[19].strip(',').split(','))
+    tStarts = map(int, record[20].strip(',').split(','))
+    qEnds = calculate_end(qStarts, blockSize, False)
+    tEnds = calculate_end(tStarts, blockSize, protDNAaln)
+
+    # construct a list of tuples with each tuple containing
+    # the i^th ungapped blocks's coords
+    # i.e. qStarts[i], qEnds[i], tStarts[i], tEnds[i]
+
+    blocks = zip(qStarts, qEnds, tStarts, tEnds)
+
+    return qStart, qEnd, tStart, tEnd, qName, tName, orient, blocks
+
+def _get_blat_header_size(path):
+    """
+    Returns the number of bytes of the header of a blat alignment file,
+    or for a BGZF compressed file the virtual offset of its first record
+    (see parallel_utils.iter_bgzf_lines())
+    """
+    ifile = open(path, 'rb')
+    try:
+        if input_utils.get_compression(path) == 'bgzf':
+            lines = parallel_utils.iter_bgzf_lines(ifile, offsets=True)
+            for i, (offset, line) in enumerate(lines):
+                if i == 0:
+                    assert line[0:8] == 'psLayout', \
+                           " This is not a blat alignment file"
+                elif i == 5:
+                    return offset
+            return (os.path.getsize(path), 0)
+        assert ifile.readline()[0:8] == 'psLayout', \
+               " This is not a blat alignment file"
+        for i in range(0, 4):
+            ifile.readline()
+        return ifile.tell()
+    finally:
+        ifile.close()
+
+def _parse_blat_shard(args):
+    """
+    Parse the records of a byte range of a blat alignment file, in a
+    worker process, and return them as a compact batch: the list of
+    sequence names, an array of eight values per ungapped block,
+    (qName ID, qStart, qEnd, qOri, tName ID, tStart, tEnd, tOri), and
+    the number of records.
+    """
+    path, start, stop, protDNAaln, recordFilter = args
+
+    names = block_store.NameTable()
+    values = array('l')
+    nRecords = 0
+    ifile = open(path, 'rb')
+    try:
+        if isinstance(start, tuple):        # virtual offsets of a BGZF file
+            lines = parallel_utils.iter_bgzf_lines(ifile, start, stop)
+        else:
+            lines = parallel_utils.iter_lines(ifile, start, stop)
+        for record in _iter_blat_records(lines, protDNAaln, recordFilter,
+                                         header=False):
+            (qStart, qEnd, tStart, tEnd, qName, tName, orient,
+             blocks) = _parse_blat_coords(record, protDNAaln)
+            qId = names.get_id(qName)
+            tId = names.get_id(tName)
+            qOri = _orient_value[orient[0]]
+            tOri = _orient_value[orient[1]]
+            for (a, b, x, y) in blocks:
+                values.extend((qId, a, b, qOri, tId, x, y, tOri))
+            nRecords += 1
+    finally:
+        ifile.close()
+
+    return names.names, values, nRecords
+
+def build_blat_ivals_parallel(path, protDNAaln, recordFilter=None,
+                              processes=None, instrument=None,
+                              chunkSize=10000):
+    """
+    Takes the path of a blat alignment file and alignment type as input
+    and builds the ivals, parsing byte ranges of the file (or ranges of
+    the blocks of a BGZF compressed file) in processes worker processes.
+    The ivals come in lists of up to chunkSize, in the same order as from
+    build_blat_ivals(). The wait for the parsed byte ranges is reported
+    to instrument, if given, as the parse stage, with their numbers of
+    records.
+    """
+    header_size = _get_blat_header_size(path)
+    if processes is None:
+        nShards = 1
+    else:
+        nShards = processes * parallel_utils.SHARDS_PER_PROCESS
+    if input_utils.get_compression(path) == 'bgzf':
+        shards = parallel_utils.split_bgzf_lines(path, nShards, header_size)
+    else:
+        shards = parallel_utils.split_lines(path, nShards, header_size)
+    args = [ (path, start, stop, protDNAaln, recordFilter) for (start, stop)
+             in shards ]
+
+    batches = load_stats.iter_stage(
+        parallel_utils.imap(_parse_blat_shard, args, processes), instrument,
+        'parse', lambda batch: batch[2])
+    for names, values, nRecords in batches:
+        for i in range(0, len(values), 8 * chunkSize):
+            chunk = values[i:i + 8 * chunkSize]
+            yield [ ((names[chunk[j]], chunk[j+1], chunk[j+2], chunk[j+3]),
+                     (names[chunk[j+4]], chunk[j+5], chunk[j+6],
+                      chunk[j+7])) for j in range(0, len(chunk), 8) ]
+
+def build_blat_ivals(buf, protDNAaln, recordFilter=None, instrument=None,
+                     names=None):
+    """
+    Takes a blat file object (or buffer) and alignment type as input and
+    builds the ivals, one list per blat record, skipping the records
+    that fail recordFilter if it is given; the reading of the records
+    is reported to instrument, if given, as the parse stage. If a list
+    of sequence names is given, buf must be the path or a file object
+    of a file, and only the records of these sequences are read (see
+    iter_blat_names()).
+    """
+    if names is not None:
+        path = buf
+        if not isinstance(buf, basestring):
+            path = cache_utils.get_input_path(buf)
+        assert path is not None, "names need the path of a blat file"
+        alignments = iter_blat_names(path, protDNAaln, names,
+                                     recordFilter=recordFilter)
+    else:
+        if isinstance(buf, basestring):
+            assert buf[0:8] == 'psLayout', \
+                   " This is not a blat alignment file"
+            buf = StringIO(buf)
+        alignments = iter_blat(buf, protDNAaln, recordFilter=recordFilter)
+    for blt_al in load_stats.iter_stage(alignments, instrument, 'parse'):
+        yield _get_alignment_ivals(blt_al)
+
+def _get_alignment_ivals(blt_al):
+    """
+    Returns the ivals of a BlatLocalAlignment, or of a view of a
+    BlatStore, one (ival1, ival2) pair per ungapped block
+    """
+    seqs_name1 = getattr(blt_al, "qSeqName")
+    seqs_name2 = getattr(blt_al, "tSeqName")
+    ivals = []   
+    block = getattr(blt_al, "blocks")
+    
+    for ungapped in block:
+        a = getattr(ungapped, "qStart")
+        b = getattr(ungapped, "qEnd")
         
-    for ivals in ivals_list:
-        al.add_aligned_intervals(cti(ivals))
+        x = getattr(ungapped, "tStart")
+        y = getattr(ungapped, "tEnd")
+
+        orient = getattr(ungapped, "orient")
         
-    #build alignment
-    al.build()
-    return al
+        if orient[0] == '+':
+            orient1 = 1
+        else:
+            orient1 = -1
+        
+        if orient[1] == '+':
+            orient2 = 1
+        else:
+            orient2 = -1
+        
+        ival1 = (seqs_name1, a, b, orient1)
+        ival2 = (seqs_name2, x, y, orient2)
+        
+        ivals.append((ival1, ival2))
+
+    return ivals
+
+def build_blat_block_index(matches):
+    """
+    Takes the alignments returned by parse_blat(), as a list or a
+    BlatStore, and returns an interval_index.IntervalIndex of their
+    ungapped blocks by query and target name, with the number of each
+    block counted over all the alignments and its side, 0 for the query
+    and 1 for the target, as value, and the array of the numbers of the
+    first blocks of the alignments (see
+    interval_index.build_block_index()); no NLMSA is built
+    """
+    return interval_index.build_block_index(
+        [ _get_alignment_ivals(blt_al) for blt_al in matches ])
+
+def iter_ival_batches(buf, protDNAaln, recordFilter=None,
+                      batchSize=ival_arrays.BATCH_SIZE):
+    """
+    Takes a blat file object (or buffer) and alignment type as input and
+    yields its ivals as (batch, names) pairs: batch is a structured
+    array of ival_arrays.IVAL_DTYPE with one row per ungapped block,
+    ending with the record that fills it to batchSize rows, and names
+    the NameTable of its sequence IDs. No per-block objects are created.
+    """
+    if isinstance(buf, basestring):
+        assert buf[0:8] == 'psLayout', " This is not a blat alignment file"
+        buf = StringIO(buf)
+
+    builder = ival_arrays.IvalBatchBuilder(batchSize)
+    for record in _iter_blat_records(buf, protDNAaln, recordFilter):
+        (qStart, qEnd, tStart, tEnd, qName, tName, orient,
+         blocks) = _parse_blat_coords(record, protDNAaln)
+        qId = builder.get_id(qName)
+        tId = builder.get_id(tName)
+        qOri = _orient_value[orient[0]]
+        tOri = _orient_value[orient[1]]
+        for (a, b, x, y) in blocks:
+            builder.add(qId, a, b, tId, x, y, qOri, tOri)
+        if builder.is_full():
+            yield builder.pop(), builder.names
+
+    if len(builder):
+        yield builder.pop(), builder.names
+
+def create_NLMSA_blat(buf, al, srcDB, destDB, protDNAaln=True, cache=None,
+                      recordFilter=None, processes=None, instrument=None,
+                      names=None, **kwargs):
+    """
+    Takes a blat alignment file object or buffer (buf), NLMSA (al),
+    alignment type (protDNAaln), srcDB and destDB as input and returns
+    a built NLMSA
+    protDNAaln - arg with True denoting protein-dna alignment and 
+    False denoting protein-protein or dna-dna alignments 
+    cache - a cache_utils.IvalsCache holding the ivals of earlier loads
+    recordFilter - a record_filter.RecordFilter the records must pass
+    processes - if buf is the path or a file object of a file, plain or
+    BGZF compressed, the number of worker processes parsing it (see
+    build_blat_ivals_parallel())
+    instrument - a load_stats.LoadStats, or another instrumentation
+    object, the stages of the load are reported to
+    names - a list of sequence names; if given, buf must be the path or
+    a file object of a file, and only the records whose query or target
+    is one of them are read, through the sidecar index of the file (see
+    get_blat_index()); the cache then keys them by the size and
+    modification time of the file and their index entries, without
+    reading the whole file
+    Other keyword arguments (batchSize, batchBytes, verbose, cacheSize,
+    seqNames) are passed on to loader_utils.BulkLoader
+    """
+    ifile = input_utils.open_input(buf)
+    try:
+        loader = loader_utils.BulkLoader(al, srcDB, destDB,
+                                         loader_utils.ORIENTED_IVALS_ATTRS,
+                                         instrument=instrument, **kwargs)
+        path = cache_utils.get_input_path(ifile)
+        options = ('blat', protDNAaln, repr(recordFilter))
+        fingerprint = None
+        if names is not None:
+            assert path is not None, "names need the path of a blat file"
+            build_ivals = lambda: build_blat_ivals(path, protDNAaln,
+                                                   recordFilter, instrument,
+                                                   names)
+            options += (tuple(sorted(names)),)
+            fingerprint = lambda: offset_index.get_fingerprint(
+                get_blat_index(path), names)
+        elif processes is not None and processes > 1 and path is not None \
+                 and input_utils.get_compression(path) != 'gzip':
+            build_ivals = lambda: build_blat_ivals_parallel(path, protDNAaln,
+                                                            recordFilter,
+                                                            processes,
+                                                            instrument)
+        else:
+            build_ivals = lambda: build_blat_ivals(ifile, protDNAaln,
+                                                   recordFilter, instrument)
+        ivals_iter = cache_utils.cached_ivals(cache, ifile, options,
+                                              build_ivals, oriented=True,
+                                              fingerprint=fingerprint)
+        ivals_iter = load_stats.iter_stage(ivals_iter, instrument, 'ivals',
+                                           len)
+        for ivals in ivals_iter:
+            loader.add(ivals)
+        loader.close()
+
+        #build alignment
+        load_stats.call_stage(instrument, 'build', al.build)
+        return al
+    finally:
+        input_utils.close_input(ifile, buf)
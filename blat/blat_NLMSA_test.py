@@ -1,9 +1,18 @@
 # Author Eden Elos
 
+import gzip
 import os
+import shutil
+import tempfile
 import unittest
 from pygr import cnestedlist, seqdb
 import blat_NLMSA
+import cache_utils
+import input_utils
+import interval_index
+import load_stats
+import ival_arrays
+import record_filter
 
 class Blat_test(unittest.TestCase):
     """
@@ -55,6 +64,148 @@ class Blat_test(unittest.TestCase):
         self.assertEqual(last_ungapped_qEnd, 351+69)
         self.assertEqual(last_ungapped_tEnd, 281+69)
 
+    def test_iter_blat(self):
+        matches, genome_names = blat_NLMSA.parse_blat(self.buf, self.protDNAaln)
+        seqs_names = set()
+        streamed = list(blat_NLMSA.iter_blat(open('data/output.psl'),
+                                             self.protDNAaln, seqs_names))
+        self.assertEqual(seqs_names, set(genome_names))
+        self.assertEqual(len(streamed), 4)
+
+        for aln1, aln2 in zip(streamed, matches):
+            self.assertEqual((aln1.qSeqName, aln1.tSeqName, aln1.qStart,
+                              aln1.qEnd, aln1.tStart, aln1.tEnd, aln1.orient),
+                             (aln2.qSeqName, aln2.tSeqName, aln2.qStart,
+                              aln2.qEnd, aln2.tStart, aln2.tEnd, aln2.orient))
+            self.assertEqual([(b.qStart, b.qEnd, b.tStart, b.tEnd)
+                              for b in aln1.blocks],
+                             [(b.qStart, b.qEnd, b.tStart, b.tEnd)
+                              for b in aln2.blocks])
+
+    def test_parse_blat_compact(self):
+        matches, genome_names = blat_NLMSA.parse_blat(self.buf, self.protDNAaln)
+        store, store_names = blat_NLMSA.parse_blat(self.buf, self.protDNAaln,
+                                                   compact=True)
+        self.assertEqual(set(store_names), set(genome_names))
+        self.assertEqual(len(store), 4)
+        self.assertEqual(len(store.names), 4)
+
+        for aln1, aln2 in zip(store, matches):
+            for attr in ('qStart', 'qEnd', 'tStart', 'tEnd', 'qSeqName',
+                         'tSeqName', 'orient'):
+                self.assertEqual(getattr(aln1, attr), getattr(aln2, attr))
+            self.assertEqual([(b.qStart, b.qEnd, b.tStart, b.tEnd, b.orient,
+                               len(b)) for b in aln1.blocks],
+                             [(b.qStart, b.qEnd, b.tStart, b.tEnd, b.orient,
+                               len(b)) for b in aln2.blocks])
+
+    def test_parse_blat_filter(self):
+        def qStarts(recordFilter, compact=False):
+            matches, names = blat_NLMSA.parse_blat(self.buf, self.protDNAaln,
+                                                   compact, recordFilter)
+            return [ aln.qStart for aln in matches ]
+
+        all = qStarts(None)
+        RecordFilter = record_filter.RecordFilter
+        self.assertEqual(qStarts(RecordFilter()), all)
+        self.assertEqual(qStarts(RecordFilter(minScore=279)),
+                         [all[0], all[3]])
+        self.assertEqual(qStarts(RecordFilter(minScore=279), True),
+                         [all[0], all[3]])
+        self.assertEqual(qStarts(RecordFilter(maxGaps=0)), [all[1]])
+        self.assertEqual(qStarts(RecordFilter(minBlockLength=141)), [all[3]])
+        self.assertEqual(qStarts(RecordFilter(minMatches=281)), [all[3]])
+        self.assertEqual(qStarts(RecordFilter(minIdentity=100)), all)
+
+        ivals = list(blat_NLMSA.build_blat_ivals(open('data/output.psl'),
+                                                 self.protDNAaln,
+                                                 RecordFilter(minScore=285)))
+        self.assertEqual(len(ivals), 1)
+        self.assertEqual(ivals[0][0], (('testgenome4', 64, 281, 1),
+                                       ('testgenome1', 64, 281, 1)))
+
+    def test_build_blat_ivals_parallel(self):
+        serial = []
+        for ivals in blat_NLMSA.build_blat_ivals(open('data/output.psl'),
+                                                 self.protDNAaln):
+            serial.extend(ivals)
+
+        for processes in (None, 2, 3):
+            parallel = []
+            for ivals in blat_NLMSA.build_blat_ivals_parallel(
+                    'data/output.psl', self.protDNAaln, processes=processes,
+                    chunkSize=2):
+                self.assertTrue(len(ivals) <= 2)
+                parallel.extend(ivals)
+            self.assertEqual(parallel, serial)
+
+        recordFilter = record_filter.RecordFilter(minScore=285)
+        parallel = list(blat_NLMSA.build_blat_ivals_parallel(
+            'data/output.psl', self.protDNAaln, recordFilter, processes=2))
+        self.assertEqual(parallel, list(blat_NLMSA.build_blat_ivals(
+            open('data/output.psl'), self.protDNAaln, recordFilter)))
+
+    def test_ival_batches(self):
+        if ival_arrays.numpy is None:
+            return
+
+        expected = []
+        for ivals in blat_NLMSA.build_blat_ivals(self.buf, self.protDNAaln):
+            expected.extend(ivals)
+
+        result = []
+        for batch, names in blat_NLMSA.iter_ival_batches(
+                open('data/output.psl'), self.protDNAaln, batchSize=3):
+            result.extend(ival_arrays.iter_ivals(batch, names, True))
+        self.assertEqual(result, expected)
+
+        batches = list(blat_NLMSA.iter_ival_batches(self.buf, self.protDNAaln))
+        self.assertEqual(len(batches), 1)
+        batch, names = batches[0]
+        self.assertEqual(len(batch), len(expected))
+        self.assertEqual(list(batch['src_stop'] - batch['src_start']),
+                         [ ival1[2] - ival1[1] for ival1, ival2 in expected ])
+
+    def test_build_blat_block_index(self):
+        """
+        The blocks overlapping an interval, found in the block index of
+        the parsed alignments, list or BlatStore, are those checked one
+        by one
+        """
+        matches, genome_names = blat_NLMSA.parse_blat(self.buf, False)
+        store, store_names = blat_NLMSA.parse_blat(self.buf, False,
+                                                   compact=True)
+        for alignments in (matches, store):
+            index, firstBlocks = blat_NLMSA.build_blat_block_index(alignments)
+            self.assertEqual(sorted(index.keys()), sorted(genome_names))
+            starts = range(0, 420, 10)
+            stops = [ start + 25 for start in starts ]
+            queries, blocks = index.find_overlaps_batch('testgenome1',
+                                                        starts, stops)
+            ks, js, sides = interval_index.get_alignment_blocks(firstBlocks,
+                                                                blocks)
+            self.assertEqual(set(sides), set([1]))
+            found = [ (queries[i], ks[i], js[i])
+                      for i in range(0, len(queries)) ]
+
+            expected = []
+            for i in range(0, len(starts)):
+                for k in range(0, len(matches)):
+                    for j, block in enumerate(matches[k].blocks):
+                        if block.tStart < stops[i] and \
+                           block.tEnd > starts[i]:
+                            expected.append((i, k, j))
+            self.assertEqual(sorted(found), expected)
+
+    def test_build_blat_ivals_file_object(self):
+        ivals = list(blat_NLMSA.build_blat_ivals(open('data/output.psl'),
+                                                 self.protDNAaln))
+        self.assertEqual(len(ivals), 4)
+        self.assertEqual(ivals[-1], [(('testgenome4', 64, 281, 1),
+                                      ('testgenome1', 64, 281, 1)),
+                                     (('testgenome4', 351, 420, 1),
+                                      ('testgenome1', 281, 350, 1))])
+
 
 class Blat_NLMSA_test(unittest.TestCase):
 
@@ -108,6 +259,215 @@ class Blat_NLMSA_test(unittest.TestCase):
             temp_lst.append(str(s))
         self.assertEqual(temp_lst,[])
 
+    def test_align_parallel(self):
+        """
+        Parsing in worker processes gives the same alignments as parsing
+        serially
+        """
+        alignment = cnestedlist.NLMSA('test2', mode='memory',
+                                      seqDict=self.srcDB,
+                                      use_virtual_lpo=True)
+        nlmsa = blat_NLMSA.create_NLMSA_blat(open('data/output.psl'),
+                                             alignment, self.srcDB,
+                                             self.destDB, self.protDNAaln,
+                                             processes=2)
+        for name in ('testgenome1', 'testgenome4'):
+            s1 = self.srcDB[name]
+            self.assertEqual([repr(s2) for s2 in nlmsa[s1]],
+                             [repr(s2) for s2 in self.temp_nlmsa[s1]])
+
+    def test_align_path(self):
+        """
+        Building from the path of the file gives the same alignments,
+        serially and in worker processes, which report the parse stage
+        with the same number of records
+        """
+        nParsed = []
+        for processes in (None, 2):
+            alignment = cnestedlist.NLMSA('test2', mode='memory',
+                                          seqDict=self.srcDB,
+                                          use_virtual_lpo=True)
+            stats = load_stats.LoadStats()
+            nlmsa = blat_NLMSA.create_NLMSA_blat('data/output.psl',
+                                                 alignment, self.srcDB,
+                                                 self.destDB, self.protDNAaln,
+                                                 processes=processes,
+                                                 instrument=stats)
+            nParsed.append(stats['parse'].count)
+            for name in ('testgenome1', 'testgenome4'):
+                s1 = self.srcDB[name]
+                self.assertEqual([repr(s2) for s2 in nlmsa[s1]],
+                                 [repr(s2) for s2 in self.temp_nlmsa[s1]])
+        self.assert_(nParsed[0] > 0)
+        self.assertEqual(nParsed[1], nParsed[0])
+
+    def test_align_compressed(self):
+        """
+        Building from a gzip or BGZF compressed file gives the same
+        alignments, serially and in worker processes
+        """
+        tempDir = tempfile.mkdtemp()
+        try:
+            gzipPath = os.path.join(tempDir, 'output.psl.gz')
+            ofile = gzip.open(gzipPath, 'wb')
+            ofile.write(self.buf)
+            ofile.close()
+            bgzfPath = os.path.join(tempDir, 'output.psl.bgz')
+            input_utils.write_bgzf(bgzfPath, self.buf, 300)
+
+            for path in (gzipPath, bgzfPath):
+                for processes in (None, 2):
+                    alignment = cnestedlist.NLMSA('test2', mode='memory',
+                                                  seqDict=self.srcDB,
+                                                  use_virtual_lpo=True)
+                    nlmsa = blat_NLMSA.create_NLMSA_blat(path, alignment,
+                                                         self.srcDB,
+                                                         self.destDB,
+                                                         self.protDNAaln,
+                                                         processes=processes)
+                    for name in ('testgenome1', 'testgenome4'):
+                        s1 = self.srcDB[name]
+                        self.assertEqual([repr(s2) for s2 in nlmsa[s1]],
+                                         [repr(s2) for s2
+                                          in self.temp_nlmsa[s1]])
+
+            # the same ivals as from the uncompressed file, in other lists
+            ivals = [ ival for ivals in blat_NLMSA.build_blat_ivals_parallel(
+                bgzfPath, False, processes=2) for ival in ivals ]
+            self.assertEqual(ivals, [ ival for ivals
+                                      in blat_NLMSA.build_blat_ivals(
+                                          self.buf, False)
+                                      for ival in ivals ])
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_align_names(self):
+        """
+        Loading the records of some sequences through the index of the
+        file, plain or BGZF compressed, gives their alignments only
+        """
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, 'output.psl')
+            open(path, 'wb').write(self.buf)
+            bgzfPath = os.path.join(tempDir, 'output.psl.bgz')
+            input_utils.write_bgzf(bgzfPath, self.buf, 300)
+
+            for p in (path, path, bgzfPath):
+                alignment = cnestedlist.NLMSA('test2', mode='memory',
+                                              seqDict=self.srcDB,
+                                              use_virtual_lpo=True)
+                nlmsa = blat_NLMSA.create_NLMSA_blat(p, alignment,
+                                                     self.srcDB, self.destDB,
+                                                     self.protDNAaln,
+                                                     names=['testgenome3'])
+                s3 = self.srcDB['testgenome3']
+                self.assertEqual([repr(s2) for s2 in nlmsa[s3]],
+                                 [repr(s2) for s2 in self.temp_nlmsa[s3]])
+                s4 = self.srcDB['testgenome4']
+                self.assertRaises(KeyError, nlmsa.__getitem__, s4)
+                self.assert_(os.path.exists(p + '.oix'))
+
+            # cached by the index entries of the names, without hashing
+            # the whole file
+            cache = cache_utils.IvalsCache(os.path.join(tempDir, 'cache'))
+            hash_file = cache_utils._hash_file
+            cache_utils._hash_file = None
+            try:
+                for i in range(0, 2):
+                    alignment = cnestedlist.NLMSA('test2', mode='memory',
+                                                  seqDict=self.srcDB,
+                                                  use_virtual_lpo=True)
+                    nlmsa = blat_NLMSA.create_NLMSA_blat(
+                        path, alignment, self.srcDB, self.destDB,
+                        self.protDNAaln, cache=cache, names=['testgenome3'])
+                    self.assertEqual([repr(s2) for s2 in nlmsa[s3]],
+                                     [repr(s2) for s2
+                                      in self.temp_nlmsa[s3]])
+            finally:
+                cache_utils._hash_file = hash_file
+            self.assertEqual(len(os.listdir(cache.cacheDir)), 1)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_align_lazy(self):
+        """
+        The slices of the lazy alignment of the file, plain or BGZF
+        compressed, are those of the NLMSA, for query and target
+        intervals, and only the records they overlap are parsed
+        """
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, 'output.psl')
+            open(path, 'wb').write(self.buf)
+            bgzfPath = os.path.join(tempDir, 'output.psl.bgz')
+            input_utils.write_bgzf(bgzfPath, self.buf, 300)
+
+            for p in (path, path, bgzfPath):
+                al = blat_NLMSA.create_lazy_blat(p, self.srcDB, self.destDB,
+                                                 self.protDNAaln)
+                try:
+                    self.assert_(os.path.exists(p + '.rix'))
+                    s1 = self.srcDB['testgenome1']
+                    s2 = self.srcDB['testgenome2']
+                    self.assertEqual([str(s) for s in al[s1[281:300]]],
+                                     [str(s) for s
+                                      in self.temp_nlmsa[s1[281:300]]])
+                    self.assertEqual(al.nParsed, 3)
+                    self.assertEqual(len(al[s1[:10]]), 0)
+                    for ival in (s1, s2, s2[100:300], -s2[40:90]):
+                        self.assertEqual(sorted([repr(s) for s in al[ival]]),
+                                         sorted([repr(s) for s
+                                                 in self.temp_nlmsa[ival]]))
+                finally:
+                    al.close()
+
+            # a DNA-DNA record on the - strand: its qStarts are on the
+            # reverse strand, its tStarts on the forward strand
+            buf = self.buf + '50\t0\t0\t0\t1\t5\t1\t5\t-\t' \
+                  'testgenome1\t416\t5\t65\ttestgenome2\t408\t100\t155\t' \
+                  '2\t20,30,\t351,381,\t100,125,\n'
+            open(path, 'wb').write(buf)
+            os.utime(path, (0, 0))
+            alignment = cnestedlist.NLMSA('test3', mode='memory',
+                                          seqDict=self.srcDB,
+                                          use_virtual_lpo=True)
+            nlmsa = blat_NLMSA.create_NLMSA_blat(buf, alignment, self.srcDB,
+                                                 self.destDB, self.protDNAaln)
+            al = blat_NLMSA.create_lazy_blat(path, self.srcDB, self.destDB,
+                                             self.protDNAaln)
+            try:
+                s1 = self.srcDB['testgenome1']
+                s2 = self.srcDB['testgenome2']
+                self.assert_('testgenome1[351:371]' in
+                             [ repr(s) for s in al[s2[100:120]] ])
+                for ival in (s2[100:120], -s2[110:140], s2[90:160], s1[0:70],
+                             -s1[40:60], s1, s2):
+                    self.assertEqual(sorted([repr(s) for s in al[ival]]),
+                                     sorted([repr(s) for s in nlmsa[ival]]))
+            finally:
+                al.close()
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_align_seq_names(self):
+        """
+        Pre-resolving the sequence names gives the same alignment
+        """
+
+        matches, genome_names = blat_NLMSA.parse_blat(self.buf, self.protDNAaln)
+        alignment = cnestedlist.NLMSA('test2', mode='memory',
+                                      seqDict=self.srcDB, use_virtual_lpo=True)
+        nlmsa = blat_NLMSA.create_NLMSA_blat(open('data/output.psl'),
+                                             alignment, self.srcDB,
+                                             self.destDB, self.protDNAaln,
+                                             batchSize=2,
+                                             seqNames=genome_names)
+
+        s1 = self.srcDB['testgenome1']
+        self.assertEqual([str(s) for s in nlmsa[s1[281:300]]],
+                         [str(s) for s in self.temp_nlmsa[s1[281:300]]])
+
   
 def suite():
     suite = unittest.TestSuite()
@@ -11,15 +11,23 @@ builds pygr NLMSAs with it. The module defines the following class:
 
 - `ClustalwResidues`, a single clustalw 'residue'/alignment block containing
   upto 60 residues from each sequence
+- `ClustalwRowIndex`, the residue offsets and the runs of residues of
+  every row of a whole clustalw alignment, built once by read_clustalw()
+  and shared by its alignment blocks
 
 Functions:
 
 - `read_clustalw()`: read aligned sequences from a CLUSTALW alignment file
   buffer 
 - `build_interval_list`, extract all ungapped aligned subintervals from a
-  pair of aligned sequences
+  pair of aligned sequences (imported from common/interval_utils.py)
 - `build_clustalw_ivals`, takes lines of a clustalw alignment file and
   sequence db as input and builds the ivals
+- `build_clustalw_lpo_ivals`, takes lines of a clustalw alignment file and
+  sequence db as input and builds the ivals of each sequence against the
+  alignment columns
+- `iter_ival_batches`, takes lines of a clustalw alignment file and
+  yields the ivals as structured NumPy arrays
 - `create_NLMSA_clustalw`, takes buffer of a clustalw alignment file,
   sequence db and NLMSA  as input and returns NLMSA
 
@@ -37,13 +45,50 @@ How To Use This Module
    function returns the modified/built NLMSA.
    ``nlmsa_aln = create_NLMSA_clustalw(buf, seqDb, al)``
 
+   buf may also be an open file object, read line by line, or the path
+   of the file, which is then memory-mapped and read the same way:
+   ``nlmsa_aln = create_NLMSA_clustalw('output', seqDb, al)``
+   A gzip or BGZF compressed file, path or buffer is decompressed as it
+   is read.
+
+   By default the alignment is stored as pairwise alignments between
+   every pair of sequences. Passing lpoMode=True instead maps each
+   sequence once onto the alignment columns, which become the LPO
+   coordinate system of a pygr multiple alignment; al must then be an
+   NLMSA created without pairwiseMode or use_virtual_lpo.
+   ``al = cnestedlist.NLMSA('msa', mode='memory', seqDict=seqDb)``
+   ``nlmsa_aln = create_NLMSA_clustalw(buf, seqDb, al, lpoMode=True)``
+
+3. By default the intervals are extracted one alignment block (one
+   60-column line of the file) at a time, so an ungapped stretch
+   crossing a line break is split into one interval per block. Passing
+   wholeRows=True extracts them from the whole rows instead, giving the
+   fewest intervals for the same alignment; every aligned residue is
+   then kept, including those of rows with a single residue in a block,
+   which the block by block extraction skips.
+   ``nlmsa_aln = create_NLMSA_clustalw(buf, seqDb, al, wholeRows=True)``
+
 """
 
 __docformat__ = 'restructuredtext'
 
 
+import os
+import sys
 from pygr import cnestedlist, nlmsa_utils, seqdb
 
+# the code shared by the loaders lives in common/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'common'))
+from array import array
+from interval_utils import build_interval_list, build_run_list, \
+     intersect_run_lists, iter_run_intersections
+import cache_utils
+import input_utils
+import ival_arrays
+import load_stats
+import loader_utils
+
 class ClustalwResidues(object):
     
     """
@@ -51,11 +96,16 @@ class ClustalwResidues(object):
     upto 60 residues from each sequence
     """
     
-    def __init__(self, no_seq, seq_names, seqs, start_indices):
+    def __init__(self, no_seq, seq_names, seqs, start_indices, index=None,
+                 block=None):
 
         self.no_seq = no_seq
         self.seq_names = seq_names
         self.seqs = seqs
+        # the ClustalwRowIndex of the alignment, and the number of the
+        # block in it, if any
+        self.index = index
+        self.block = block
         self.start_indices =  []
         # self.start_indices=start_indices
         for i in range(0, len(start_indices)):
@@ -122,6 +172,11 @@ class ClustalwResidues(object):
         Returns the number of gaps in each sequence
         """
 
+        if self.index is not None:
+            ungapped_len = self.ungapped_count()
+            return [ len(self.seqs[i]) - ungapped_len[i]
+                     for i in range(0, len(self.seqs)) ]
+
         gaps = []
         for s in self.seqs:
             gaps.append(s.count("-"))
@@ -133,6 +188,9 @@ class ClustalwResidues(object):
         Returns the ungapped length
         """
 
+        if self.index is not None:
+            return self.index.get_ungapped_counts(self.block)
+
         ungapped_len = []
         gaps = self.gap_count()
         
@@ -140,33 +198,110 @@ class ClustalwResidues(object):
             ungapped_len.append(len(self.seqs[i])-gaps[i])
 
         return ungapped_len
-         
+
+class ClustalwRowIndex(object):
+    """
+    The rows of a whole clustalw alignment, encoded once: for each row,
+    its number of residues before each alignment block (the offsets)
+    and the runs of residues between its gaps (see
+    interval_utils.build_run_list()), in alignment column coordinates.
+    The start indices and residue counts of the blocks are then array
+    lookups, and the intervals of a pair of rows in a block are found
+    by intersecting their run lists.
+    """
+
+    def __init__(self, blocks):
+        """
+        blocks - the list of the rows (strings) of each alignment block
+        """
+        # the first column of each block, and the number of columns
+        self.columns = array('l', [0])
+        for seqs in blocks:
+            self.columns.append(self.columns[-1] + len(seqs[0]))
+
+        self.offsets = []
+        self.runs = []
+        if not blocks:
+            return
+        for i in range(0, len(blocks[0])):
+            offsets = array('l', [0])
+            for seqs in blocks:
+                offsets.append(offsets[-1] + len(seqs[i]) -
+                               seqs[i].count('-'))
+            self.offsets.append(offsets)
+            self.runs.append(build_run_list(''.join([ seqs[i] for seqs
+                                                      in blocks ])))
+
+    def get_start_indices(self, block):
+        """
+        Returns the number of residues of each row before block
+        """
+        return [ offsets[block] for offsets in self.offsets ]
+
+    def get_ungapped_counts(self, block):
+        """
+        Returns the number of residues of each row in block
+        """
+        return [ offsets[block + 1] - offsets[block]
+                 for offsets in self.offsets ]
+
+    def get_total_lengths(self):
+        """
+        Returns the number of residues of each row
+        """
+        return [ offsets[-1] for offsets in self.offsets ]
+
+    def get_columns(self, block):
+        """
+        Returns the first column of block and the first column after it
+        """
+        return self.columns[block], self.columns[block + 1]
+
 def read_clustalw(lines):
     """
-    Read aligned sequences from a CLUSTALW alignment file buffer
+    Read aligned sequences from the lines of a CLUSTALW alignment file:
+    a list of lines, or any iterable over them such as a file object,
+    which is then read line by line
     """
     
-    assert lines[0].startswith('CLUSTAL '), lines[0]
-    lines = lines[3:]
-    seq_counter = 0
-
-    # identify the number of sequences
-    while True:
-        if lines[seq_counter][:16].strip():
-            seq_counter += 1
-        else:
+    lines = iter(lines)
+    header = lines.next()
+    assert header.startswith('CLUSTAL '), header
+    for i in range(0, 2):
+        lines.next()
+
+    # identify the number of sequences, from the first block, which is
+    # followed by a line with no name
+    first_block = []
+    for line in lines:
+        if not line[:16].strip():
             break
-    clustal_res_list = [] # holds alignment blocks as a list of clustalResidues
-    start_indices = [] # holds the start_indices of sequences in the aln block
+        first_block.append(line)
+    seq_counter = len(first_block)
+
+    # the rows of each block, skipping the two lines after each
+    block_lines = [first_block]
+    rows = []
+    skip = 1
+    for line in lines:
+        if skip:
+            skip -= 1
+            continue
+        rows.append(line)
+        if len(rows) == seq_counter:
+            block_lines.append(rows)
+            rows = []
+            skip = 2
+    assert not ''.join(rows).strip(), "incomplete alignment block"
 
-    for i in range(0, seq_counter):
-        start_indices.append(0)
+    clustal_res_list = [] # holds alignment blocks as a list of clustalResidues
+    blocks = []
 
-    for i in range(0, len(lines), seq_counter+2):
+    for rows in block_lines:
         seq_names = []
         seqs = []
-        for j in range(0, seq_counter):
-            line = lines[i+j].strip()
+        for line in rows:
+            line = line.strip()
             ls = line.split()
             # sometimes, especially at the last block,
             # the length value might not be there
@@ -180,12 +315,15 @@ def read_clustalw(lines):
                 
             seq_names.append(name)
             seqs.append(seq)
-        cl = ClustalwResidues(seq_counter, seq_names, seqs, start_indices)
-        ungapped_len = cl.ungapped_count()
+        blocks.append((seq_names, seqs))
+
+    # the residue offsets and runs of every row, computed only once
+    index = ClustalwRowIndex([ seqs for (seq_names, seqs) in blocks ])
 
-        for j in range(0, len(start_indices)):
-            start_indices[j] += ungapped_len[j]
-                     
+    for k in range(0, len(blocks)):
+        seq_names, seqs = blocks[k]
+        cl = ClustalwResidues(seq_counter, seq_names, seqs,
+                              index.get_start_indices(k), index, k)
         # check the current cl to reset the start_indices cl...
         # in case a sequence in the current cl is completely a gap,
         # the start_index has to be decreased by one
@@ -196,6 +334,10 @@ def read_clustalw(lines):
 
 def calc_total_length(clustal_res_list):
     
+    index = clustal_res_list[0].index
+    if index is not None:
+        return index.get_total_lengths()
+
     total_lengths = clustal_res_list[0].ungapped_count()
     
     for cl_res in clustal_res_list[1:]:
@@ -204,95 +346,234 @@ def calc_total_length(clustal_res_list):
 
     return total_lengths
 
-def build_interval_list(a, b):
+def _iter_block_intervals(clustal_res_list, processes=None, arrays=False):
     """
-    Hacky code to extract all ungapped aligned subintervals from a
-    pair of aligned sequences.
+    Yield, for each alignment block, a list of (i, j, interval_list)
+    tuples: the interval list of each pair of rows i and j of the block,
+    with the residues counted from the start of each row, or its four
+    coordinate arrays if arrays is True (see
+    interval_utils.intersect_run_arrays()). The intervals are found by
+    intersecting the run lists of the rows' ClustalwRowIndex over the
+    columns of the block.
     """
-    interval_list = []
-
-    a_start = None
-    b_start = None
 
-    a_count = b_count = 0
-    for i in range(0, len(a)):
-        if a[i] == '-' or b[i] == '-':
-            if a_start is not None:           # want to end at i-1
-                interval_list.append((a_start, a_count, b_start, b_count))
+    index = clustal_res_list[0].index
+    tasks = []
+    blocks = []
+    for k in range(0, len(clustal_res_list)):
+        clu_res = clustal_res_list[k]
+        start_indices = clu_res.get_start_indices()
+        end_indices = clu_res.get_end_indices()
 
-                a_start = b_start = None
-        else:
-            if a_start is None:
-                a_start = a_count
-                b_start = b_count
+        used = [ i for i in range(0, len(start_indices))
+                 if start_indices[i] != end_indices[i] ]
+        pairs = []
+        for m in range(0, len(used)):
+            for j in used[m+1:]:
+                pairs.append((used[m], j))
 
-        if a[i] != '-':
-            a_count += 1
-        if b[i] != '-':
-            b_count += 1
+        start, stop = index.get_columns(k)
+        tasks.append([ (i, j, start, stop) for (i, j) in pairs ])
+        blocks.append(pairs)
 
-    if a_start is not None:
-        interval_list.append((a_start, a_count, b_start, b_count))
+    results = iter_run_intersections(index.runs, tasks, processes,
+                                     arrays=arrays)
+    for pairs in blocks:
+        yield [ (i, j, interval_list) for (i, j), interval_list
+                in zip(pairs, results.next()) ]
 
-    assert a_count == len(a.replace('-', ''))
-    assert b_count == len(b.replace('-', ''))
-        
-    return interval_list
+def _iter_row_intervals(clustal_res_list, processes=None, arrays=False):
+    """
+    Yield, for each row i, a list of (i, j, interval_list) tuples: the
+    interval list of row i with each following row j over the whole
+    alignment, so that no interval is split at a block boundary, or its
+    four coordinate arrays if arrays is True.
+    """
 
-def build_clustalw_ivals(lines, seqDb):
+    index = clustal_res_list[0].index
+    stop = index.columns[-1]
+    row_pairs = [ [ (i, j) for j in range(i+1, len(index.runs)) ]
+                  for i in range(0, len(index.runs)) ]
+
+    # one task per pair, so the workers stay busy even with few rows
+    tasks = [ [(i, j, 0, stop)] for pairs in row_pairs for (i, j) in pairs ]
+    results = iter_run_intersections(index.runs, tasks, processes,
+                                     arrays=arrays)
+    for pairs in row_pairs:
+        yield [ (i, j, results.next()[0]) for (i, j) in pairs ]
+
+def _iter_intervals(clustal_res_list, processes=None, wholeRows=False,
+                    arrays=False):
+    if wholeRows:
+        return _iter_row_intervals(clustal_res_list, processes, arrays)
+    return _iter_block_intervals(clustal_res_list, processes, arrays)
+
+def build_clustalw_ivals(lines, seqDb, processes=None, instrument=None,
+                         wholeRows=False):
     """
     Takes lines of a clustalw alignment file  as input and builds the
-    ivals
+    ivals, one list per alignment block, or per row if wholeRows is
+    True, in which case the intervals are not split at the block
+    boundaries (see the module documentation). With processes > 1 the pairs
+    of rows are aligned in a pool of worker processes, each receiving
+    the rows once; the ivals are the same and come in the same order.
+    The reading of the alignment blocks is reported to instrument, if
+    given, as the parse stage.
     """
 
-    clustal_res_list = read_clustalw(lines)
+    clustal_res_list = load_stats.call_stage(instrument, 'parse',
+                                             read_clustalw, lines)
     sequence_names = clustal_res_list[0].get_names() 
-    
-    for clu_res in clustal_res_list:    
-        # build list of aligned sub-intervals
 
-        seq = clu_res.get_seqs()
-        start_indices = clu_res.get_start_indices()
-        end_indices = clu_res.get_end_indices()
+    for block in _iter_intervals(clustal_res_list, processes, wholeRows):
+        # build list of aligned sub-intervals
         ivals = []
-          
-        for i in range(0, len(seq)):
-            
-            start1 = start_indices[i]
-            stop1 = end_indices[i]
-            
-            if start1 != stop1:
-                seq1_ival_str = seq[i]
-        
-                for j in range(i+1, len(seq)):
-                    start2 = start_indices[j]
-                    stop2 = end_indices[j]
-                    if start2 != stop2:
-                        seq2_ival_str = seq[j]
-                
-                        interval_list = build_interval_list(seq1_ival_str,
-                                                            seq2_ival_str)
-                           
-                        for (a, b, x, y) in interval_list:
-                            ival1 = (sequence_names[i], start1+a, start1+b)
-                            ival2 = (sequence_names[j], start2+x, start2+y)
-                            ivals.append((ival1, ival2))
+        for (i, j, interval_list) in block:
+            for (a, b, x, y) in interval_list:
+                ival1 = (sequence_names[i], a, b)
+                ival2 = (sequence_names[j], x, y)
+                ivals.append((ival1, ival2))
         
         yield ivals
-                            
-def create_NLMSA_clustalw(buf, seqDb,al):
+
+def iter_ival_batches(lines, processes=None,
+                      batchSize=ival_arrays.BATCH_SIZE, wholeRows=False):
+    """
+    Takes lines of a clustalw alignment file as input and yields its
+    ivals as (batch, names) pairs: batch is a structured array of
+    ival_arrays.IVAL_DTYPE holding the same intervals as
+    build_clustalw_ivals(), ending with the alignment block (or row, if
+    wholeRows is True) that fills it to batchSize rows, and names the
+    NameTable of its sequence IDs.
+    """
+
+    clustal_res_list = read_clustalw(lines)
+    builder = ival_arrays.IvalBatchBuilder(batchSize)
+    ids = [ builder.get_id(name) for name
+            in clustal_res_list[0].get_names() ]
+
+    for block in _iter_intervals(clustal_res_list, processes, wholeRows,
+                                 arrays=True):
+        for (i, j, interval_arrays) in block:
+            builder.add_interval_arrays(ids[i], 0, ids[j], 0,
+                                        interval_arrays)
+        if builder.is_full():
+            yield builder.pop(), builder.names
+
+    if len(builder):
+        yield builder.pop(), builder.names
+
+def build_clustalw_lpo_ivals(lines, seqDb, instrument=None, wholeRows=False):
+    """
+    Takes lines of a clustalw alignment file as input and builds the
+    ivals of each sequence against the alignment columns, i.e.
+    ((column_start, column_stop), (name, start, stop)). Every row is
+    mapped only once, so the number of ivals grows linearly with the
+    number of sequences instead of with the number of pairs. The ivals
+    come in one list per alignment block, or per row if wholeRows is
+    True, in which case they are not split at the block boundaries. The
+    reading of the alignment blocks is reported to instrument, if
+    given, as the parse stage.
+    """
+
+    clustal_res_list = load_stats.call_stage(instrument, 'parse',
+                                             read_clustalw, lines)
+    sequence_names = clustal_res_list[0].get_names()
+    index = clustal_res_list[0].index
+    # the run list of a row without gaps, giving the column coordinates
+    columns = (array('l', [0]), index.columns[-1:], array('l', [0]))
+
+    if wholeRows:
+        groups = [ ([i], 0, None) for i in range(0, len(sequence_names)) ]
+    else:
+        rows = range(0, len(sequence_names))
+        groups = [ (rows,) + index.get_columns(k)
+                   for k in range(0, len(clustal_res_list)) ]
+
+    for rows, start, stop in groups:
+        ivals = []
+
+        for i in rows:
+            for (a, b, x, y) in intersect_run_lists(index.runs[i], columns,
+                                                    start, stop):
+                ival1 = (x, y)
+                ival2 = (sequence_names[i], a, b)
+                ivals.append((ival1, ival2))
+
+        yield ivals
+
+def _add_lpo_ivals(al, resolver, ivals):
+    """
+    Add the ivals of build_clustalw_lpo_ivals() to the LPO NLMSA al
+    """
+    for (column_start, column_stop), (name, start, stop) in ivals:
+        al[column_start:column_stop] += resolver[name][start:stop]
+
+def create_NLMSA_clustalw(buf, seqDb, al, lpoMode=False, cache=None,
+                          processes=None, instrument=None, wholeRows=False,
+                          **kwargs):
     """
     Takes buffer of a clustalw alignment file, sequence db and NLMSA (al)
     as input and returns NLMSA
+    lpoMode - if True, align each sequence to the alignment columns (LPO)
+    of a multiple alignment NLMSA instead of adding all pairwise alignments
+    cache - a cache_utils.IvalsCache holding the ivals of earlier pairwise
+    loads
+    processes - the number of worker processes aligning the pairs of rows
+    instrument - a load_stats.LoadStats, or another instrumentation
+    object, the stages of the load are reported to
+    wholeRows - if True, extract the intervals from the whole rows
+    instead of block by block, so they are not split at line breaks
+    Other keyword arguments (batchSize, batchBytes, verbose, cacheSize,
+    seqNames) are passed on to loader_utils.BulkLoader. In lpoMode, only
+    cacheSize and seqNames are accepted, and passed on to the
+    loader_utils.SeqNameResolver of the sequences; cache and processes
+    cannot be given either.
     """
-    
-    lines = buf.split("\n")
-    for ivals in build_clustalw_ivals(lines, seqDb):
-        alignedIvalsAttrs = dict(id=0, start=1, stop=2, idDest=0, 
-                                 startDest=1, stopDest=2)
-        cti = nlmsa_utils.CoordsToIntervals(seqDb, seqDb,
-                                            alignedIvalsAttrs)
-        al.add_aligned_intervals(cti(ivals))
-        
-    al.build()
-    return al
+    ifile = input_utils.open_input(buf)
+    try:
+        if isinstance(ifile, basestring):
+            lines = ifile.split("\n")
+        else:
+            lines = ifile       # read line by line
+        if lpoMode:
+            assert cache is None and processes is None, \
+                   "cache and processes are not supported in lpoMode"
+            unsupported = [ key for key in kwargs
+                            if key not in ('cacheSize', 'seqNames') ]
+            assert not unsupported, \
+                   "unsupported in lpoMode: %s" % ', '.join(unsupported)
+            resolver = loader_utils.SeqNameResolver(
+                seqDb, kwargs.get('cacheSize', loader_utils.CACHE_SIZE),
+                kwargs.get('seqNames') or ())
+            ivals_iter = build_clustalw_lpo_ivals(lines, seqDb, instrument,
+                                                  wholeRows)
+            ivals_iter = load_stats.iter_stage(ivals_iter, instrument,
+                                               'ivals', len)
+            for ivals in ivals_iter:
+                load_stats.call_stage(instrument, 'add', _add_lpo_ivals, al,
+                                      resolver, ivals)
+
+            load_stats.call_stage(instrument, 'build', al.build)
+            return al
+
+        loader = loader_utils.BulkLoader(al, seqDb, seqDb,
+                                         loader_utils.IVALS_ATTRS,
+                                         instrument=instrument, **kwargs)
+        build_ivals = lambda: build_clustalw_ivals(lines, seqDb, processes,
+                                                   instrument, wholeRows)
+        options = ('clustalw',)
+        if wholeRows:
+            options += ('wholeRows',)
+        ivals_iter = cache_utils.cached_ivals(cache, ifile, options,
+                                              build_ivals)
+        ivals_iter = load_stats.iter_stage(ivals_iter, instrument, 'ivals',
+                                           len)
+        for ivals in ivals_iter:
+            loader.add(ivals)
+        loader.close()
+
+        load_stats.call_stage(instrument, 'build', al.build)
+        return al
+    finally:
+        input_utils.close_input(ifile, buf)
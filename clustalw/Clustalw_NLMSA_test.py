@@ -1,9 +1,12 @@
 # Author Eden Elos
 import os
+import shutil
+import tempfile
 import unittest
 from pygr import cnestedlist
 from pygr import seqdb
 import Clustalw_NLMSA
+import ival_arrays
 
 # Test for the clustalwresidues class
 class ClustalwResidues_test(unittest.TestCase):
@@ -79,6 +82,26 @@ class ClustalwResidues_test(unittest.TestCase):
         ungapped_count_last = [0,0,0,31]
         self.assertEqual(self.clustalw_resds[5].ungapped_count(),
                          ungapped_count_last)
+
+    def test_row_index(self):
+        """
+        The intervals found from the row index are those of each block's
+        pairs of rows, shifted by the residues before the block
+        """
+
+        blocks = Clustalw_NLMSA._iter_block_intervals(self.clustalw_resds)
+        for clu_res, block in zip(self.clustalw_resds, blocks):
+            seqs = clu_res.get_seqs()
+            starts = clu_res.get_start_indices()
+            for (i, j, interval_list) in block:
+                expected = Clustalw_NLMSA.build_interval_list(seqs[i],
+                                                              seqs[j])
+                self.assertEqual(interval_list,
+                                 [ (starts[i] + a, starts[i] + b,
+                                    starts[j] + x, starts[j] + y)
+                                   for (a, b, x, y) in expected ])
+        self.assertEqual(Clustalw_NLMSA.calc_total_length(
+            self.clustalw_resds), [142, 112, 202, 280])
     
 # Test for the clustalwresidues class
 class Clustalw_NLMSA_test(unittest.TestCase):
@@ -99,6 +122,7 @@ class Clustalw_NLMSA_test(unittest.TestCase):
         self.db = seqdb.SequenceFileDB(thisfile('test_genomes_file'))
         
         buf = open(thisfile('test_clustalw_alignment.aln'), "r").read()
+        self.buf = buf
         
         clustal_res_list = Clustalw_NLMSA.read_clustalw(buf.split("\n"))
         
@@ -133,12 +157,226 @@ class Clustalw_NLMSA_test(unittest.TestCase):
         self.assertEqual(temp_lst, [])
 
         # can add additional manual tests
-        
+
+    def test_align_path(self):
+        """
+        Building from the path of a copy of the file with CRLF line
+        endings gives the same alignments as building from the buffer
+        """
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, 'crlf.aln')
+            ofile = open(path, 'wb')
+            ofile.write(self.buf.replace('\n', '\r\n'))
+            ofile.close()
+            alignment = cnestedlist.NLMSA('test2', mode='memory',
+                                          seqDict=self.db,
+                                          use_virtual_lpo=True)
+            nlmsa = Clustalw_NLMSA.create_NLMSA_clustalw(path, self.db,
+                                                         alignment)
+        finally:
+            shutil.rmtree(tempdir)
+
+        for name in ('query', 'NP009141'):
+            s1 = self.db[name]
+            self.assertEqual([repr(s2) for s2 in nlmsa[s1]],
+                             [repr(s2) for s2 in self.temp_nlmsa[s1]])
+
+    def test_parallel_ivals(self):
+        """
+        Aligning the pairs of rows in worker processes gives the same
+        ivals in the same order
+        """
+        lines = self.buf.split("\n")
+        serial = list(Clustalw_NLMSA.build_clustalw_ivals(lines, self.db))
+        parallel = list(Clustalw_NLMSA.build_clustalw_ivals(lines, self.db,
+                                                            processes=3))
+        self.assertEqual(parallel, serial)
+
+    def test_whole_rows(self):
+        """
+        The ivals of the whole rows are those of the joined rows, fewer
+        than those extracted block by block
+        """
+        lines = self.buf.split("\n")
+        rows = {}
+        for clu_res in Clustalw_NLMSA.read_clustalw(lines):
+            for name, seq in zip(clu_res.get_names(), clu_res.get_seqs()):
+                rows[name] = rows.get(name, '') + seq
+
+        whole = []
+        for ivals in Clustalw_NLMSA.build_clustalw_ivals(lines, self.db,
+                                                         wholeRows=True):
+            whole.extend(ivals)
+        expected = []
+        names = Clustalw_NLMSA.read_clustalw(lines)[0].get_names()
+        for i in range(0, len(names)):
+            for j in range(i+1, len(names)):
+                for (a, b, x, y) in Clustalw_NLMSA.build_interval_list(
+                    rows[names[i]], rows[names[j]]):
+                    expected.append(((names[i], a, b), (names[j], x, y)))
+        self.assertEqual(whole, expected)
+
+        blocks = []
+        for ivals in Clustalw_NLMSA.build_clustalw_ivals(lines, self.db):
+            blocks.extend(ivals)
+        self.assert_(len(whole) < len(blocks))
+
+        parallel = []
+        for ivals in Clustalw_NLMSA.build_clustalw_ivals(lines, self.db,
+                                                         processes=3,
+                                                         wholeRows=True):
+            parallel.extend(ivals)
+        self.assertEqual(parallel, whole)
+
+        alignment = cnestedlist.NLMSA('test_whole', mode='memory',
+                                      seqDict=self.db, use_virtual_lpo=True)
+        nlmsa = Clustalw_NLMSA.create_NLMSA_clustalw(self.buf, self.db,
+                                                     alignment,
+                                                     wholeRows=True)
+        s1 = self.db['query']
+        self.assertEqual([str(s2) for s2 in nlmsa[s1[:10]]],
+                         ['GSFRVLKSRT','RRRHMPLRLA'])
+
+    def test_ival_batches(self):
+        """
+        The ival batches hold the same intervals as the ivals lists
+        """
+        if ival_arrays.numpy is None:
+            return
+
+        lines = self.buf.split("\n")
+        for wholeRows in (False, True):
+            expected = []
+            for ivals in Clustalw_NLMSA.build_clustalw_ivals(
+                    lines, self.db, wholeRows=wholeRows):
+                expected.extend(ivals)
+
+            result = []
+            for batch, names in Clustalw_NLMSA.iter_ival_batches(
+                    lines, batchSize=5, wholeRows=wholeRows):
+                self.assertEqual(batch.dtype, ival_arrays.IVAL_DTYPE)
+                result.extend(ival_arrays.iter_ivals(batch, names))
+            self.assertEqual(result, expected)
+
+class Clustalw_LPO_NLMSA_test(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Create a pairwise NLMSA and a column-anchored (LPO) NLMSA from
+        the same .aln alignment file
+        """
+
+        thisdir = os.path.abspath(os.path.dirname(__file__))
+
+        def thisfile(name):
+            return os.path.join(thisdir, name)
+
+        self.db = seqdb.SequenceFileDB(thisfile('test_genomes_file'))
+
+        buf = open(thisfile('test_clustalw_alignment.aln'), "r").read()
+
+        alignment = cnestedlist.NLMSA('test', mode='memory', seqDict=self.db,
+                                      use_virtual_lpo=True)
+        self.pairwise_nlmsa = Clustalw_NLMSA.create_NLMSA_clustalw(buf,
+                                                                   self.db,
+                                                                   alignment)
+
+        alignment = cnestedlist.NLMSA('test_lpo', mode='memory',
+                                      seqDict=self.db)
+        self.lpo_nlmsa = Clustalw_NLMSA.create_NLMSA_clustalw(buf, self.db,
+                                                              alignment,
+                                                              lpoMode=True)
+
+    def test_lpo_ivals(self):
+        """
+        Each row contributes its own ungapped runs only
+        """
+
+        lines = open(os.path.join(os.path.dirname(__file__),
+                                  'test_clustalw_alignment.aln')).readlines()
+        lpo_ivals = []
+        for ivals in Clustalw_NLMSA.build_clustalw_lpo_ivals(lines, self.db):
+            lpo_ivals.extend(ivals)
+        self.assertEqual(lpo_ivals[0], ((8, 49), ('query', 0, 41)))
+        self.assertEqual(lpo_ivals[-1], ((300, 331), ('NP009141', 249, 280)))
+
+    def test_lpo_whole_rows(self):
+        """
+        The whole rows map the same residues to the same columns with
+        one ival per ungapped run
+        """
+
+        lines = open(os.path.join(os.path.dirname(__file__),
+                                  'test_clustalw_alignment.aln')).readlines()
+        def residues(wholeRows):
+            mapped = []
+            nIvals = 0
+            for ivals in Clustalw_NLMSA.build_clustalw_lpo_ivals(
+                lines, self.db, wholeRows=wholeRows):
+                for ((x, y), (name, a, b)) in ivals:
+                    mapped.extend([ (name, a + k, x + k)
+                                    for k in range(0, b - a) ])
+                    nIvals += 1
+            mapped.sort()
+            return mapped, nIvals
+
+        whole, nWhole = residues(True)
+        blocks, nBlocks = residues(False)
+        self.assertEqual(whole, blocks)
+        self.assert_(nWhole < nBlocks)
+
+    def test_align_manual1(self):
+        s1 = self.db['query']
+        temp_lst = []
+        for s2 in self.lpo_nlmsa[s1[:10]]:
+            temp_lst.append(str(s2))
+        self.assertEqual(sorted(temp_lst), ['GSFRVLKSRT','RRRHMPLRLA'])
+
+    def test_same_as_pairwise(self):
+        """
+        The column-anchored alignment aligns the same residues as the
+        pairwise one
+        """
+
+        for name in ['query', 'P15522', 'AAB85326.1', 'NP009141']:
+            s1 = self.db[name]
+            for i in range(0, len(s1), 10):
+                ival = s1[i:i+10]
+                self.assertEqual(sorted([repr(s2) for s2 in
+                                         self.lpo_nlmsa[ival]]),
+                                 sorted([repr(s2) for s2 in
+                                         self.pairwise_nlmsa[ival]]))
+
+    def test_lpo_options(self):
+        """
+        The resolver options are accepted in lpoMode, the pairwise ones
+        are rejected
+        """
+
+        buf = open(os.path.join(os.path.dirname(__file__),
+                                'test_clustalw_alignment.aln')).read()
+        def create(**kwargs):
+            alignment = cnestedlist.NLMSA('test_lpo2', mode='memory',
+                                          seqDict=self.db)
+            return Clustalw_NLMSA.create_NLMSA_clustalw(buf, self.db,
+                                                        alignment,
+                                                        lpoMode=True,
+                                                        **kwargs)
+
+        nlmsa = create(cacheSize=1, seqNames=['query', 'P15522'])
+        s1 = self.db['query']
+        self.assertEqual(sorted([ str(s2) for s2 in nlmsa[s1[:10]] ]),
+                         ['GSFRVLKSRT','RRRHMPLRLA'])
+        self.assertRaises(AssertionError, create, processes=2)
+        self.assertRaises(AssertionError, create, batchSize=10)
+
             
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ClustalwResidues_test))
     suite.addTest(unittest.makeSuite(Clustalw_NLMSA_test))
+    suite.addTest(unittest.makeSuite(Clustalw_LPO_NLMSA_test))
     # suite.addTest(unittest.makeSuite(Clustalw_MAF_NLMSA_test))
     return suite
 
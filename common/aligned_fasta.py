@@ -0,0 +1,108 @@
+# ! /usr/bin/env python2.5
+
+"""
+ALIGNED_FASTA MODULE
+====================
+A module shared by the lagan and mlagan loaders that reads the aligned
+rows of an aligned FASTA file in a single pass. The module does not
+define any class.
+
+Functions:
+
+- `iter_aligned_fasta()`: read an aligned FASTA file object line by line
+  and yield the name and the aligned row of each sequence
+- `read_aligned_fasta()`: read all the rows and names of an aligned FASTA
+  file object or buffer
+
+The names are read from the header lines only, as the first word after
+the '>', and the rows from the other lines, so no header text can end up
+in a row. Each row is gathered into a bytearray allocated once with the
+length of the first row, as all the rows of an alignment have the same
+length; the memory used is thus about the size of the rows, and the
+time linear in the size of the file.
+
+
+How To Use This Module
+======================
+
+1. Make the ``common`` directory importable and import it:
+   ``import aligned_fasta``.
+
+2. Read the rows and names of a file, or of a buffer:
+   ``rows, names = aligned_fasta.read_aligned_fasta(open('output'))``
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+from cStringIO import StringIO
+
+try:
+    bytearray
+except NameError:           # Python 2.5; the lines of a row are joined
+    bytearray = None
+
+def _header_name(line):
+    words = line[1:].split()
+    assert words, "missing sequence name in FASTA header %r" % line
+    return words[0]
+
+def iter_aligned_fasta(ifile):
+    """
+    Read an aligned FASTA file object line by line and yield a
+    (name, row) pair for each of its sequences, row being a string
+    """
+    name = None
+    rowLength = 0               # the length of the first row
+    for line in ifile:
+        if line[0:1] == '>':
+            if name is not None:
+                rowLength = rowLength or n
+                yield name, _end_row(row, n)
+            name = _header_name(line)
+            if bytearray is not None:
+                row = bytearray(rowLength)
+            else:
+                row = []
+            n = 0
+            continue
+
+        line = line.strip()
+        if not line:
+            continue
+        assert name is not None, "This doesn't look like fasta file"
+        if bytearray is None:
+            row.append(line)
+        else:
+            # past the allocated length, the row grows
+            row[n:n + len(line)] = line
+        n += len(line)
+
+    if name is not None:
+        yield name, _end_row(row, n)
+
+def _end_row(row, n):
+    """
+    Returns the n characters gathered into row as a string
+    """
+    if bytearray is None:
+        return ''.join(row)
+    del row[n:]
+    return str(row)
+
+def read_aligned_fasta(buf):
+    """
+    Read an aligned FASTA file object, or buffer, and return the list of
+    its rows and the list of their names
+    """
+    if isinstance(buf, basestring):
+        assert buf[0:1] == '>', "This doesn't look like fasta file"
+        buf = StringIO(buf)
+
+    rows = []
+    names = []
+    for name, row in iter_aligned_fasta(buf):
+        names.append(name)
+        rows.append(row)
+
+    return rows, names
@@ -0,0 +1,39 @@
+import unittest
+from cStringIO import StringIO
+import aligned_fasta
+
+class Aligned_fasta_test(unittest.TestCase):
+    """
+    Test that the rows and names are read from their own lines only,
+    whatever the line endings and lengths.
+    """
+
+    def test_read(self):
+        buf = '>AC first\nAC--\nGT\n>GT\n--ACGT\n\n>T x AC\nACGTAC\n'
+        rows, names = aligned_fasta.read_aligned_fasta(buf)
+        self.assertEqual(names, ['AC', 'GT', 'T'])
+        self.assertEqual(rows, ['AC--GT', '--ACGT', 'ACGTAC'])
+
+        crlf = StringIO(buf.replace('\n', '\r\n'))
+        self.assertEqual(aligned_fasta.read_aligned_fasta(crlf),
+                         (rows, names))
+        self.assertRaises(AssertionError, aligned_fasta.read_aligned_fasta,
+                          'AC--GT\n')
+
+    def test_row_lengths(self):
+        # rows shorter or longer than the first one are read as they are
+        buf = StringIO('>a\nACG\n>b\nA\n>c\nACGTA\nC\n>d\n')
+        self.assertEqual(list(aligned_fasta.iter_aligned_fasta(buf)),
+                         [('a', 'ACG'), ('b', 'A'), ('c', 'ACGTAC'),
+                          ('d', '')])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Aligned_fasta_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
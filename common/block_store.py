@@ -0,0 +1,205 @@
+# ! /usr/bin/env python2.5
+
+"""
+BLOCK_STORE MODULE
+==================
+A module shared by the blastz and blat loaders that stores parsed
+alignments in a compact, columnar form instead of one Python object per
+alignment and per ungapped block. The module defines the following
+classes:
+
+- `NameTable`, interns sequence names as small integer IDs
+- `BlockStore`, one array per alignment attribute and one array per
+  ungapped block attribute, plus the offset of each alignment's blocks
+- `AlignmentView`, a lightweight view of one alignment of a BlockStore
+- `BlockView`, a lightweight view of one ungapped block of a BlockStore
+
+The format modules subclass BlockStore to declare their columns (see
+`blastz_NLMSA.BlastzStore` and `blat_NLMSA.BlatStore`) and fill it
+directly from the parser, so no per-block objects are created. The
+views are only created on access and offer the same attributes as the
+per-object classes, so code written against those keeps working.
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+from array import array
+
+class NameTable(object):
+    """
+    Interns sequence names as small integer IDs.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def get_id(self, name):
+        """
+        Return the ID of name, adding it to the table if needed.
+        """
+        try:
+            return self.ids[name]
+        except KeyError:
+            id = self.ids[name] = len(self.names)
+            self.names.append(name)
+            return id
+
+    def __getitem__(self, id):
+        return self.names[id]
+
+    def __len__(self):
+        return len(self.names)
+
+class AlignmentView(object):
+    """
+    A view of a single alignment of a BlockStore. Its attributes are
+    read from the store's alignment columns.
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getattr__(self, attr):
+        return self.store.get_value(self.index, attr)
+
+    def get_blocks(self):
+        """
+        Returns the list of ungapped blocks of this alignment
+        """
+        start, stop = self.store.get_block_range(self.index)
+        block_class = self.store.block_class
+        return [ block_class(self, j) for j in range(start, stop) ]
+
+    blocks = property(get_blocks)
+
+class BlockView(object):
+    """
+    A view of a single ungapped block of a BlockStore. Its attributes
+    are read from the store's block columns.
+    """
+    __slots__ = ('alignment', 'index')
+
+    def __init__(self, alignment, index):
+        self.alignment = alignment
+        self.index = index
+
+    def __getattr__(self, attr):
+        return self.alignment.store.get_block_value(self.index, attr)
+
+class BlockStore(object):
+    """
+    Columnar storage for the alignments of a parsed file. Subclasses
+    declare the alignment and block columns as (name, typecode) pairs
+    of the array module; columns listed in name_fields hold IDs in the
+    store's NameTable.
+    """
+    alignment_class = AlignmentView
+    block_class = BlockView
+    aln_fields = ()
+    block_fields = ()
+    name_fields = ()
+
+    def __init__(self):
+        self.names = NameTable()
+        self.aln_columns = [ array(typecode) for (field, typecode)
+                             in self.aln_fields ]
+        self.block_columns = [ array(typecode) for (field, typecode)
+                               in self.block_fields ]
+        self.block_offsets = array('l', [0])
+
+        self._aln_index = dict([ (self.aln_fields[i][0], i) for i
+                                 in range(0, len(self.aln_fields)) ])
+        self._block_index = dict([ (self.block_fields[i][0], i) for i
+                                   in range(0, len(self.block_fields)) ])
+        self._name_columns = [ self._aln_index[field] for field
+                               in self.name_fields ]
+
+    def append(self, aln_values, blocks):
+        """
+        Add an alignment: aln_values holds its attributes in aln_fields
+        order (names as strings) and blocks a list of tuples holding
+        each block's attributes in block_fields order.
+        """
+        if self._name_columns:
+            aln_values = list(aln_values)
+            for i in self._name_columns:
+                aln_values[i] = self.names.get_id(aln_values[i])
+
+        for i in range(0, len(aln_values)):
+            self.aln_columns[i].append(aln_values[i])
+
+        columns = self.block_columns
+        for block in blocks:
+            for i in range(0, len(block)):
+                columns[i].append(block[i])
+
+        self.block_offsets.append(len(columns[0]))
+
+    def __len__(self):
+        return len(self.block_offsets) - 1
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('alignment index out of range')
+        return self.alignment_class(self, i)
+
+    def __iter__(self):
+        for i in range(0, len(self)):
+            yield self.alignment_class(self, i)
+
+    def get_value(self, i, field):
+        """
+        Returns the value of an alignment attribute
+        """
+        try:
+            column = self._aln_index[field]
+        except KeyError:
+            raise AttributeError(field)
+        value = self.aln_columns[column][i]
+        if column in self._name_columns:
+            return self.names[value]
+        return value
+
+    def get_block_value(self, j, field):
+        """
+        Returns the value of an ungapped block attribute
+        """
+        try:
+            column = self._block_index[field]
+        except KeyError:
+            raise AttributeError(field)
+        return self.block_columns[column][j]
+
+    def get_block_range(self, i):
+        """
+        Returns the (start, stop) indices of the blocks of alignment i
+        """
+        return self.block_offsets[i], self.block_offsets[i+1]
+
+    def get_block_count(self, i):
+        """
+        Returns the number of blocks of alignment i
+        """
+        return self.block_offsets[i+1] - self.block_offsets[i]
+
+    def get_block_total(self):
+        """
+        Returns the number of blocks of all alignments
+        """
+        return self.block_offsets[-1]
+
+    def nbytes(self):
+        """
+        Returns the number of bytes used by the columns
+        """
+        total = self.block_offsets.itemsize * len(self.block_offsets)
+        for column in self.aln_columns + self.block_columns:
+            total += column.itemsize * len(column)
+        return total
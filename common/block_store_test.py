@@ -0,0 +1,54 @@
+import unittest
+import block_store
+
+class TestStore(block_store.BlockStore):
+    aln_fields = (('score', 'l'), ('name', 'i'))
+    block_fields = (('start', 'l'), ('stop', 'l'))
+    name_fields = ('name',)
+
+class Block_store_test(unittest.TestCase):
+    """
+    Test the columnar storage and its views
+    """
+
+    def setUp(self):
+        self.store = TestStore()
+        self.store.append((10, 'chr1'), [(0, 5), (8, 12)])
+        self.store.append((20, 'chr2'), [])
+        self.store.append((30, 'chr1'), [(100, 200)])
+
+    def test_name_table(self):
+        names = block_store.NameTable()
+        self.assertEqual(names.get_id('a'), 0)
+        self.assertEqual(names.get_id('b'), 1)
+        self.assertEqual(names.get_id('a'), 0)
+        self.assertEqual(names[1], 'b')
+        self.assertEqual(len(names), 2)
+
+    def test_alignments(self):
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual([(a.score, a.name) for a in self.store],
+                         [(10, 'chr1'), (20, 'chr2'), (30, 'chr1')])
+        self.assertEqual(self.store[-1].score, 30)
+        self.assertRaises(IndexError, self.store.__getitem__, 3)
+        self.assertRaises(AttributeError, getattr, self.store[0], 'stop')
+        self.assertEqual(len(self.store.names), 2)
+
+    def test_blocks(self):
+        self.assertEqual([(b.start, b.stop) for b in self.store[0].blocks],
+                         [(0, 5), (8, 12)])
+        self.assertEqual(self.store[1].blocks, [])
+        self.assertEqual(self.store.get_block_range(2), (2, 3))
+        self.assertEqual(self.store.get_block_count(0), 2)
+        self.assertEqual(self.store.get_block_total(), 3)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Block_store_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
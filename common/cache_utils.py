@@ -0,0 +1,495 @@
+# ! /usr/bin/env python2.5
+
+"""
+CACHE_UTILS MODULE
+==================
+A module shared by the create_NLMSA_* functions of the loaders that
+caches the ivals parsed from an alignment file in a binary, columnar
+file, so that loading the same input again needs no text parsing.
+The module defines the following classes:
+
+- `IvalsCache`, a directory of cached ivals files, keyed by the size,
+  modification time and content hash of the input (or, for the records
+  of some sequences, their entries in the file's index), with an
+  eviction policy limited by the total size of the cached files
+- `CachedIvals`, a memory-mapped cached ivals file
+- `NLMSACache`, a directory of built on-disk NLMSAs, keyed by the
+  alignment inputs, the sequence databases and the build options
+
+Functions:
+
+- `cached_ivals()`: return the ivals lists of an input, from the cache
+  if it holds them, as loader_utils.IvalColumns batches read straight
+  from its columns, or else from the parser while saving them to the
+  cache
+- `get_fingerprint()`: identify an input by its size, modification time
+  and content hash
+- `get_seqdb_identity()`: identify a sequence database
+
+The cached files hold a header, the table of sequence names and eight
+int64 columns in native byte order: src_id, src_start, src_stop,
+src_ori, dest_id, dest_start, dest_stop and dest_ori.
+
+
+How To Use This Module
+======================
+
+1. Make the ``common`` directory importable and import it:
+   ``import cache_utils``.
+
+2. Create a cache and pass it to the create_NLMSA_* functions. The first
+   load of an input parses it and writes the cache file; later loads of
+   the same input read the memory-mapped cache file instead, passing
+   its columns to the loader in batches, with no ivals tuples made.
+   ``cache = cache_utils.IvalsCache('/var/cache/pygr-align')``
+   ``nlmsa_aln = create_NLMSA_blastz(open('output'), seqDb, al,``
+   ``                                cache=cache)``
+
+   The cache keeps its total size under maxBytes by deleting the least
+   recently used files; pass enabled=False (or no cache at all) to turn
+   it off.
+
+3. To skip building the NLMSA altogether, let an NLMSACache build it on
+   disk once and open the built NLMSA read-only on later runs. The
+   create function is only called if the NLMSA is not cached yet:
+   ``nlmsa_cache = cache_utils.NLMSACache('/var/cache/pygr-align')``
+   ``create = lambda al: create_NLMSA_blastz(open('output'), seqDb, al)``
+   ``nlmsa_aln = nlmsa_cache.get_NLMSA([open('output')], seqDb, create,``
+   ``                                  ('blastz',), use_virtual_lpo=True)``
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+
+try:
+    import hashlib
+    _new_hash = hashlib.sha1
+except ImportError:
+    import sha
+    _new_hash = sha.new
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pygr import cnestedlist
+
+import block_store
+import loader_utils
+
+MAGIC = 'PYGRIVC1'
+HEADER = '8sqqqq'       # magic, oriented, n_ivals, n_names, names_len
+HEADER_SIZE = struct.calcsize(HEADER)
+N_COLUMNS = 8
+MAX_BYTES = 4 * 1024 ** 3
+CHUNK_SIZE = 10000
+SUFFIX = '.ivc'
+
+if array('l').itemsize == 8:
+    _INT64 = 'l'
+else:
+    _INT64 = 'q'
+
+def _pad(n):
+    """
+    Return n rounded up to a multiple of 8 bytes
+    """
+    return (n + 7) & ~7
+
+def _hash_file(path, blockSize=1024*1024):
+    """
+    Return the hex digest of the content of a file
+    """
+    h = _new_hash()
+    ifile = open(path, 'rb')
+    try:
+        while True:
+            block = ifile.read(blockSize)
+            if not block:
+                break
+            h.update(block)
+    finally:
+        ifile.close()
+    return h.hexdigest()
+
+def get_input_path(buf):
+    """
+    Return the path of the file behind buf (a file object), or None if
+    buf is a buffer or has no file behind it.
+    """
+    name = getattr(buf, 'name', None)
+    if isinstance(name, basestring) and os.path.isfile(name):
+        return name
+    return None
+
+def get_fingerprint(buf):
+    """
+    Return a string identifying the content of buf (a buffer, or a file
+    object of a file) by its size, modification time and content hash,
+    or None if the input cannot be identified.
+    """
+    path = get_input_path(buf)
+    if path is not None:
+        st = os.stat(path)
+        size, mtime = st.st_size, int(st.st_mtime)
+        content = _hash_file(path)
+    elif isinstance(buf, basestring):
+        size, mtime = len(buf), 0
+        content = _new_hash(buf).hexdigest()
+    else:
+        return None
+    return '%d:%d:%s' % (size, mtime, content)
+
+def get_seqdb_identity(seqDb):
+    """
+    Return a string identifying a sequence database: its worldbase ID,
+    or the path, size and modification time of its sequence file, or
+    else the names and lengths of its sequences.
+    """
+    persistent_id = getattr(seqDb, '_persistent_id', None)
+    if persistent_id is not None:
+        return 'worldbase:%s' % persistent_id
+
+    filepath = getattr(seqDb, 'filepath', None)
+    if filepath is not None and os.path.isfile(filepath):
+        st = os.stat(filepath)
+        return 'file:%s:%d:%d' % (os.path.abspath(filepath), st.st_size,
+                                  int(st.st_mtime))
+
+    h = _new_hash()
+    for name in sorted(seqDb.keys()):
+        h.update('%s:%d\n' % (name, len(seqDb[name])))
+    return 'seqs:%s' % h.hexdigest()
+
+class CachedIvals(object):
+    """
+    A memory-mapped cached ivals file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        ifile = open(path, 'rb')
+        try:
+            self.mmap = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            ifile.close()
+
+        (magic, self.oriented, self.n_ivals, n_names,
+         names_len) = struct.unpack(HEADER, self.mmap[:HEADER_SIZE])
+        assert magic == MAGIC, "%s is not a cached ivals file" % path
+
+        if n_names:
+            self.names = self.mmap[HEADER_SIZE:HEADER_SIZE+names_len] \
+                         .split('\n')
+        else:
+            self.names = []
+        self.columns_offset = _pad(HEADER_SIZE + names_len)
+
+    def get_column(self, k, start=0, stop=None):
+        """
+        Returns rows start to stop of column k, as an array
+        """
+        if stop is None:
+            stop = self.n_ivals
+        offset = self.columns_offset + 8 * (k * self.n_ivals + start)
+        if numpy is not None:
+            return numpy.frombuffer(self.mmap, dtype=numpy.int64,
+                                    count=stop - start, offset=offset)
+        column = array(_INT64)
+        column.fromstring(self.mmap[offset:offset + 8 * (stop - start)])
+        return column
+
+    def iter_ivals(self, chunkSize=CHUNK_SIZE):
+        """
+        Yield the cached ivals, in lists of up to chunkSize ivals
+        """
+        names = self.names
+        for start in range(0, self.n_ivals, chunkSize):
+            stop = min(start + chunkSize, self.n_ivals)
+            columns = [ list(self.get_column(k, start, stop))
+                        for k in range(0, N_COLUMNS) ]
+            (src_id, src_start, src_stop, src_ori,
+             dest_id, dest_start, dest_stop, dest_ori) = columns
+            if self.oriented:
+                yield [ ((names[src_id[i]], src_start[i], src_stop[i],
+                          src_ori[i]),
+                         (names[dest_id[i]], dest_start[i], dest_stop[i],
+                          dest_ori[i])) for i in range(0, stop - start) ]
+            else:
+                yield [ ((names[src_id[i]], src_start[i], src_stop[i]),
+                         (names[dest_id[i]], dest_start[i], dest_stop[i]))
+                        for i in range(0, stop - start) ]
+
+    def iter_batches(self, chunkSize=loader_utils.BATCH_SIZE):
+        """
+        Yield the cached ivals as loader_utils.IvalColumns batches of up
+        to chunkSize ivals, copied out of the mapping, and close the file
+        once they are all read
+        """
+        try:
+            for start in range(0, self.n_ivals, chunkSize):
+                stop = min(start + chunkSize, self.n_ivals)
+                columns = [ self.get_column(k, start, stop)
+                            for k in range(0, N_COLUMNS) ]
+                if numpy is not None:   # not views of the mapping
+                    columns = [ column.copy() for column in columns ]
+                yield loader_utils.IvalColumns(columns, self.names,
+                                               self.oriented)
+        finally:
+            self.close()
+
+    def close(self):
+        self.mmap.close()
+
+class IvalsCache(object):
+    """
+    A directory of cached ivals files. Files are named by a key computed
+    from the input's size, modification time and content hash, and the
+    options that change the ivals built from it; the least recently
+    used files are deleted once the directory holds more than maxBytes.
+    """
+
+    def __init__(self, cacheDir, maxBytes=MAX_BYTES, enabled=True):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.enabled = enabled
+        if enabled and not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+    def get_key(self, buf, options=(), fingerprint=None):
+        """
+        Returns the cache key of buf (a buffer, or a file object of a
+        file) built with the given options, or None if the input cannot
+        be identified.
+        fingerprint - a string identifying the input, used instead of
+        get_fingerprint(buf)
+        """
+        if fingerprint is None:
+            fingerprint = get_fingerprint(buf)
+        if fingerprint is None:
+            return None
+        return _new_hash('%s:%r' % (fingerprint,
+                                    tuple(options))).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cacheDir, key + SUFFIX)
+
+    def load(self, key):
+        """
+        Returns the CachedIvals of key, or None if it is not cached
+        """
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path, None)            # mark as recently used
+        return CachedIvals(path)
+
+    def save(self, key, ivals_iter, oriented):
+        """
+        Pass the ivals lists of ivals_iter through, writing them to the
+        cache file of key; the file is published once all ivals are read.
+        """
+        names = block_store.NameTable()
+        fd, columns_path = tempfile.mkstemp(dir=self.cacheDir,
+                                            suffix='.tmp')
+        os.close(fd)
+        columns = [ open('%s.%d' % (columns_path, k), 'wb')
+                    for k in range(0, N_COLUMNS) ]
+        n_ivals = 0
+        try:
+            for ivals in ivals_iter:
+                chunk = [ array(_INT64) for k in range(0, N_COLUMNS) ]
+                for ival1, ival2 in ivals:
+                    for k, ival in ((0, ival1), (4, ival2)):
+                        chunk[k].append(names.get_id(ival[0]))
+                        chunk[k+1].append(ival[1])
+                        chunk[k+2].append(ival[2])
+                        if len(ival) > 3:
+                            chunk[k+3].append(ival[3])
+                        else:
+                            chunk[k+3].append(1)
+                for k in range(0, N_COLUMNS):
+                    chunk[k].tofile(columns[k])
+                n_ivals += len(ivals)
+                yield ivals
+
+            for column in columns:
+                column.close()
+            self._write(key, columns_path, oriented, n_ivals, names)
+        finally:
+            for k in range(0, N_COLUMNS):
+                columns[k].close()
+                os.remove('%s.%d' % (columns_path, k))
+            os.remove(columns_path)
+
+        self.evict()
+
+    def _write(self, key, columns_path, oriented, n_ivals, names):
+        """
+        Write the header, name table and columns to a temp file and
+        rename it into place
+        """
+        names_blob = '\n'.join(names.names)
+        header = struct.pack(HEADER, MAGIC, int(oriented), n_ivals,
+                             len(names), len(names_blob))
+        fd, tmp_path = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+        ofile = os.fdopen(fd, 'wb')
+        try:
+            ofile.write(header)
+            ofile.write(names_blob)
+            ofile.write('\0' * (_pad(HEADER_SIZE + len(names_blob))
+                                - HEADER_SIZE - len(names_blob)))
+            for k in range(0, N_COLUMNS):
+                ifile = open('%s.%d' % (columns_path, k), 'rb')
+                try:
+                    while True:
+                        block = ifile.read(1024*1024)
+                        if not block:
+                            break
+                        ofile.write(block)
+                finally:
+                    ifile.close()
+        finally:
+            ofile.close()
+        os.rename(tmp_path, self.get_path(key))
+
+    def get_total_bytes(self):
+        """
+        Returns the total size of the cached files
+        """
+        total = 0
+        for name in os.listdir(self.cacheDir):
+            if name.endswith(SUFFIX):
+                total += os.path.getsize(os.path.join(self.cacheDir, name))
+        return total
+
+    def evict(self):
+        """
+        Delete the least recently used files until the cache holds no
+        more than maxBytes
+        """
+        files = []
+        total = 0
+        for name in os.listdir(self.cacheDir):
+            if name.endswith(SUFFIX):
+                path = os.path.join(self.cacheDir, name)
+                st = os.stat(path)
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.maxBytes:
+                break
+            os.remove(path)
+            total -= size
+
+def cached_ivals(cache, buf, options, build_ivals, oriented=False,
+                 fingerprint=None):
+    """
+    Return an iterator over the ivals lists of buf: from the cache if it
+    holds them, as loader_utils.IvalColumns batches, which a
+    loader_utils.BulkLoader adds straight from their columns, or else
+    from build_ivals() while saving them to the cache.
+    options - the format name and the options that change the ivals
+    oriented - True if the ivals are (name, start, stop, ori) tuples
+    fingerprint - a function returning a string identifying the input,
+    called instead of hashing it with get_fingerprint(), e.g. when only
+    the records of some sequences are read (see
+    offset_index.get_fingerprint())
+    """
+    if cache is None or not cache.enabled:
+        return build_ivals()
+
+    if fingerprint is not None:
+        fingerprint = fingerprint()
+    key = cache.get_key(buf, options, fingerprint)
+    if key is None:
+        return build_ivals()
+
+    cached = cache.load(key)
+    if cached is not None:
+        return cached.iter_batches()
+
+    return cache.save(key, build_ivals(), oriented)
+
+class NLMSACache(object):
+    """
+    A directory of on-disk NLMSAs, each in a subdirectory named by a key
+    computed from the alignment inputs, the identities of the sequence
+    databases and the build options. An NLMSA is built in a temporary
+    directory which is renamed into place once the build is complete,
+    so a cached NLMSA is never seen half-built.
+    """
+    NLMSA_NAME = 'nlmsa'
+
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+    def get_key(self, inputs, seqDbs, options=()):
+        """
+        Returns the key of an NLMSA built from inputs (buffers or file
+        objects of files) and seqDbs with the given options
+        """
+        h = _new_hash()
+        for buf in inputs:
+            fingerprint = get_fingerprint(buf)
+            assert fingerprint is not None, \
+                   "cannot identify the input %r" % (buf,)
+            h.update('input:%s\n' % fingerprint)
+        for seqDb in seqDbs:
+            h.update('seqdb:%s\n' % get_seqdb_identity(seqDb))
+        h.update('options:%r\n' % (options,))
+        return h.hexdigest()
+
+    def get_pathstem(self, key):
+        return os.path.join(self.cacheDir, key, self.NLMSA_NAME)
+
+    def get_NLMSA(self, inputs, seqDict, create, options=(), seqDbs=None,
+                  **kwargs):
+        """
+        Returns the NLMSA built from inputs, opened read-only. If it is
+        not cached yet, it is built by create(al), on an NLMSA opened in
+        write mode with seqDict and the other keyword arguments.
+        seqDbs - the sequence databases to identify, by default seqDict
+        """
+        if seqDbs is None:
+            seqDbs = [seqDict]
+        items = kwargs.items()
+        items.sort()
+        key = self.get_key(inputs, seqDbs, (tuple(options), items))
+
+        if not os.path.isdir(os.path.join(self.cacheDir, key)):
+            self._build(key, seqDict, create, kwargs)
+        return cnestedlist.NLMSA(self.get_pathstem(key), 'r',
+                                 seqDict=seqDict)
+
+    def _build(self, key, seqDict, create, kwargs):
+        """
+        Build the NLMSA of key in a temporary directory and rename it
+        into place
+        """
+        tmp_dir = tempfile.mkdtemp(dir=self.cacheDir, prefix='.tmp')
+        try:
+            al = cnestedlist.NLMSA(os.path.join(tmp_dir, self.NLMSA_NAME),
+                                   'w', seqDict=seqDict, **kwargs)
+            create(al)
+            al.close()
+            try:
+                os.rename(tmp_dir, os.path.join(self.cacheDir, key))
+            except OSError:
+                # another process published the same NLMSA first
+                if not os.path.isdir(os.path.join(self.cacheDir, key)):
+                    raise
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir)
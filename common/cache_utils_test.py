@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+import cache_utils
+
+class Cache_utils_test(unittest.TestCase):
+    """
+    Test that the cached ivals read back the same as the parsed ones,
+    and that the cache is keyed, evicted and turned off as expected.
+    """
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        self.ivals = [[(('seq1', 0, 10, 1), ('seq2', 5, 15, -1)),
+                       (('seq1', 20, 30, 1), ('seq3', 0, 10, 1))],
+                      [],
+                      [(('seq2', 1, 2, -1), ('seq1', 3, 4, 1))]]
+        self.nBuilds = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def build_ivals(self):
+        self.nBuilds += 1
+        for ivals in self.ivals:
+            yield ivals
+
+    def load(self, cache, buf, options=('test',), oriented=True):
+        result = []
+        for ivals in cache_utils.cached_ivals(cache, buf, options,
+                                              self.build_ivals, oriented):
+            result.extend(ivals)
+        return result
+
+    def test_round_trip(self):
+        cache = cache_utils.IvalsCache(self.cacheDir)
+        expected = self.ivals[0] + self.ivals[2]
+        self.assertEqual(self.load(cache, 'buffer'), expected)
+        self.assertEqual(self.load(cache, 'buffer'), expected)
+        self.assertEqual(self.nBuilds, 1)
+
+        key = cache.get_key('buffer', ('test',))
+        cached = cache.load(key)
+        self.assertEqual(cached.names, ['seq1', 'seq2', 'seq3'])
+        self.assertEqual(list(cached.get_column(3)), [1, 1, -1])
+        self.assertEqual([ len(ivals) for ivals
+                           in cached.iter_ivals(chunkSize=2) ], [2, 1])
+
+        # the batches of columns close the mapping once read
+        batches = list(cached.iter_batches(chunkSize=2))
+        self.assertEqual([ len(batch) for batch in batches ], [2, 1])
+        self.assertEqual(list(batches[1]), self.ivals[2])
+        self.assertRaises(ValueError, cached.mmap.read, 1)
+
+    def test_unoriented(self):
+        self.ivals = [[(('seq1', 0, 10), ('seq2', 5, 15))]]
+        cache = cache_utils.IvalsCache(self.cacheDir)
+        self.load(cache, 'buffer', oriented=False)
+        self.assertEqual(self.load(cache, 'buffer', oriented=False),
+                         self.ivals[0])
+        self.assertEqual(self.nBuilds, 1)
+
+    def test_key(self):
+        cache = cache_utils.IvalsCache(self.cacheDir)
+        self.load(cache, 'buffer')
+        self.load(cache, 'other buffer')
+        self.load(cache, 'buffer', options=('test', False))
+        self.assertEqual(self.nBuilds, 3)
+
+        path = os.path.join(self.cacheDir, 'input')
+        ofile = open(path, 'w')
+        ofile.write('buffer')
+        ofile.close()
+        key = cache.get_key(open(path), ('test',))
+        self.assertNotEqual(key, None)
+        self.assertEqual(key, cache.get_key(open(path), ('test',)))
+        os.utime(path, (0, 0))
+        self.assertNotEqual(key, cache.get_key(open(path), ('test',)))
+
+    def test_seqdb_identity(self):
+        seqs1 = {'seq1': 'ACGT', 'seq2': 'AC'}
+        seqs2 = {'seq1': 'ACGT', 'seq2': 'ACG'}
+        self.assertEqual(cache_utils.get_seqdb_identity(seqs1),
+                         cache_utils.get_seqdb_identity(dict(seqs1)))
+        self.assertNotEqual(cache_utils.get_seqdb_identity(seqs1),
+                            cache_utils.get_seqdb_identity(seqs2))
+
+        cache = cache_utils.NLMSACache(self.cacheDir)
+        self.assertNotEqual(cache.get_key(['buffer'], [seqs1]),
+                            cache.get_key(['buffer'], [seqs2]))
+        self.assertNotEqual(cache.get_key(['buffer'], [seqs1]),
+                            cache.get_key(['buffer'], [seqs1], ('option',)))
+
+    def test_evict(self):
+        cache = cache_utils.IvalsCache(self.cacheDir)
+        self.load(cache, 'buffer1')
+        size = cache.get_total_bytes()
+        cache.maxBytes = size
+        os.utime(cache.get_path(cache.get_key('buffer1', ('test',))),
+                 (0, 0))
+        self.load(cache, 'buffer2')     # evicts buffer1
+        self.assertEqual(cache.get_total_bytes(), size)
+        self.assertEqual(cache.load(cache.get_key('buffer1', ('test',))),
+                         None)
+
+    def test_disabled(self):
+        cache = cache_utils.IvalsCache(self.cacheDir, enabled=False)
+        self.load(cache, 'buffer')
+        self.load(cache, 'buffer')
+        self.load(None, 'buffer')
+        self.assertEqual(self.nBuilds, 3)
+        self.assertEqual(os.listdir(self.cacheDir), [])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Cache_utils_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
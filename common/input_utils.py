@@ -0,0 +1,284 @@
+# ! /usr/bin/env python2.5
+
+"""
+INPUT_UTILS MODULE
+==================
+A module shared by the create_NLMSA_* functions of the loaders that lets
+them take the path of an alignment file as well as a buffer or a file
+object, compressed or not. The file of a path is memory-mapped and its
+lines are read straight from the mapping, so no copy of the whole file
+is made before parsing; gzip and BGZF (blocked gzip, as written by
+bgzip) inputs are recognized by their magic bytes and decompressed on
+the fly as they are read. The module defines the following class:
+
+- `MappedFile`, a read-only file object over a memory-mapped file
+
+Functions:
+
+- `is_path()`: tell a path from an alignment file buffer
+- `get_compression()`: tell whether a file is gzip or BGZF compressed
+- `open_input()`: open the input of a loader, mapping it if it is a path
+  and decompressing it if it is compressed
+- `close_input()`: close an input opened by open_input()
+- `read_bgzf_block()`: read and decompress one block of a BGZF file
+- `iter_bgzf_blocks()`: read and decompress the blocks of a BGZF file
+- `get_bgzf_offsets()`: find the offsets of the blocks of a BGZF file
+  from their headers, without decompressing them
+- `write_bgzf()`: write data as a BGZF file
+
+The parsers read the lines one at a time and strip the line endings as
+they go, so files with CRLF line endings need no conversion.
+
+A BGZF file is a series of gzip members, the blocks, each holding at
+most 64 kB of data and recording its compressed size in its header, so
+it is read by any gzip reader, and a block can also be found and
+decompressed on its own. parallel_utils uses this to split BGZF files
+between worker processes.
+
+
+How To Use This Module
+======================
+
+1. Make the ``common`` directory importable and import it:
+   ``import input_utils``.
+
+2. Open the input, whatever it is, parse it as a file object or buffer,
+   and close it when done:
+   ``ifile = input_utils.open_input(buf)``
+   ``try:``
+   ``    ...``
+   ``finally:``
+   ``    input_utils.close_input(ifile, buf)``
+
+3. Compress a file as BGZF so the loaders that parse in worker
+   processes can split it:
+   ``input_utils.write_bgzf('output.psl.gz', open('output.psl').read())``
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+import gzip
+import mmap
+import os
+import struct
+import zlib
+from cStringIO import StringIO
+
+GZIP_MAGIC = '\x1f\x8b'
+BGZF_BLOCK_SIZE = 0xff00        # the data size of the blocks bgzip writes
+# the empty block closing a BGZF file
+BGZF_EOF = '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC' \
+           '\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+def is_path(buf):
+    """
+    Returns True if buf is the path of a file rather than the content of
+    an alignment file, which has more than one line
+    """
+    return isinstance(buf, basestring) and '\n' not in buf and \
+           '\0' not in buf and os.path.isfile(buf)
+
+def _read_bgzf_header(ifile):
+    """
+    Read the gzip header of a block, up to the end of its extra field,
+    from the file object ifile; returns the header and the size of the
+    BGZF block it starts, or None if it does not start one
+    """
+    header = ifile.read(12)
+    if len(header) < 12 or header[0:4] != GZIP_MAGIC + '\x08\x04':
+        return header, None
+    extra = ifile.read(struct.unpack('<H', header[10:12])[0])
+    header += extra
+    i = 0
+    while i + 4 <= len(extra):
+        size = struct.unpack('<H', extra[i+2:i+4])[0]
+        if extra[i:i+2] == 'BC' and size == 2:
+            return header, struct.unpack('<H', extra[i+4:i+6])[0] + 1
+        i += 4 + size
+    return header, None
+
+def _get_compression(ifile):
+    """
+    Returns 'bgzf' or 'gzip' if the data of the file object ifile, from
+    its current position, is compressed that way, else None
+    """
+    header, size = _read_bgzf_header(ifile)
+    if size is not None:
+        return 'bgzf'
+    elif header[0:2] == GZIP_MAGIC:
+        return 'gzip'
+    return None
+
+def get_compression(path):
+    """
+    Returns 'bgzf' or 'gzip' if the file at path is compressed that way,
+    according to its first bytes, else None
+    """
+    ifile = open(path, 'rb')
+    try:
+        return _get_compression(ifile)
+    finally:
+        ifile.close()
+
+class MappedFile(object):
+    """
+    A read-only file object over a memory-mapped file, iterating over
+    its lines. name is the path of the file, as for built-in files.
+    """
+
+    def __init__(self, path):
+        self.name = path
+        ifile = open(path, 'rb')
+        try:
+            if os.fstat(ifile.fileno()).st_size:
+                self.map = mmap.mmap(ifile.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+            else:
+                self.map = StringIO('')     # empty files cannot be mapped
+        finally:
+            ifile.close()
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.map.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def readline(self):
+        return self.map.readline()
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self) - self.map.tell()
+        return self.map.read(size)
+
+    def seek(self, offset, whence=0):
+        self.map.seek(offset, whence)
+
+    def tell(self):
+        return self.map.tell()
+
+    def __len__(self):
+        """
+        Returns the size of the file
+        """
+        if isinstance(self.map, mmap.mmap):
+            return self.map.size()
+        return 0
+
+    def close(self):
+        if not self.closed:
+            self.map.close()
+            self.closed = True
+
+def _is_compressed(ifile):
+    """
+    Returns True if the data of the file object ifile, from its current
+    position, is gzip or BGZF compressed; the position is left as is. A
+    file object that cannot seek is taken as not compressed.
+    """
+    try:
+        pos = ifile.tell()
+        magic = ifile.read(2)
+        ifile.seek(pos)
+    except (AttributeError, IOError):
+        return False
+    return magic == GZIP_MAGIC
+
+def open_input(buf):
+    """
+    Returns a file object reading the input buf of a loader: a
+    MappedFile of buf if it is a path (see is_path()), and buf itself
+    if it is a buffer or file object, except that a gzip or BGZF
+    compressed path, buffer or file object is read through a
+    gzip.GzipFile decompressing it
+    """
+    if isinstance(buf, basestring) and buf[0:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=StringIO(buf), mode='rb')
+    elif is_path(buf):
+        if get_compression(buf) is not None:
+            return gzip.GzipFile(buf, 'rb')
+        return MappedFile(buf)
+    elif not isinstance(buf, basestring) and _is_compressed(buf):
+        return gzip.GzipFile(fileobj=buf, mode='rb')
+    return buf
+
+def close_input(ifile, buf):
+    """
+    Close ifile, as returned by open_input(buf), if it was opened there
+    """
+    if ifile is not buf:
+        ifile.close()
+
+def read_bgzf_block(ifile, offset):
+    """
+    Read the BGZF block at byte offset of the file object ifile; returns
+    its decompressed data and the offset of the next block, or None and
+    offset at the end of the file
+    """
+    ifile.seek(offset)
+    header, size = _read_bgzf_header(ifile)
+    if not header:
+        return None, offset
+    assert size is not None, "no BGZF block at offset %d" % offset
+    block = header + ifile.read(size - len(header))
+    assert len(block) == size, "truncated BGZF block at offset %d" % offset
+    return zlib.decompress(block, 16 + zlib.MAX_WBITS), offset + size
+
+def iter_bgzf_blocks(ifile, offset=0):
+    """
+    Yield the byte offset and the decompressed data of each block of the
+    BGZF file object ifile, from the block at offset to the end
+    """
+    while True:
+        data, nextOffset = read_bgzf_block(ifile, offset)
+        if data is None:
+            return
+        yield offset, data
+        offset = nextOffset
+
+def get_bgzf_offsets(ifile, offset=0):
+    """
+    Returns the byte offsets of the blocks of the BGZF file object
+    ifile, from the block at offset to the end, read from the block
+    headers only
+    """
+    offsets = []
+    while True:
+        ifile.seek(offset)
+        header, size = _read_bgzf_header(ifile)
+        if not header:
+            return offsets
+        assert size is not None, "no BGZF block at offset %d" % offset
+        offsets.append(offset)
+        offset += size
+
+def _write_bgzf_block(ofile, data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  -zlib.MAX_WBITS)
+    cdata = compressor.compress(data) + compressor.flush()
+    # 18 bytes of header with the BC extra field, and 8 of trailer
+    ofile.write(GZIP_MAGIC + '\x08\x04\x00\x00\x00\x00\x00\xff' +
+                struct.pack('<H', 6) + 'BC' + struct.pack('<H', 2) +
+                struct.pack('<H', len(cdata) + 25))
+    ofile.write(cdata)
+    ofile.write(struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                            len(data)))
+
+def write_bgzf(path, data, blockSize=BGZF_BLOCK_SIZE):
+    """
+    Write the string data to path as a BGZF file of blocks of blockSize
+    bytes of data, closed by the empty end of file block
+    """
+    ofile = open(path, 'wb')
+    try:
+        for i in range(0, len(data), blockSize):
+            _write_bgzf_block(ofile, data[i:i + blockSize])
+        ofile.write(BGZF_EOF)
+    finally:
+        ofile.close()
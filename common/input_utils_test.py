@@ -0,0 +1,125 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import input_utils
+
+class Input_utils_test(unittest.TestCase):
+    """
+    Test that a path is mapped and read like the file itself, that
+    buffers and file objects are passed through, and that compressed
+    inputs are decompressed.
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'output')
+        ofile = open(self.path, 'wb')
+        ofile.write('first\r\nsecond\nthird')
+        ofile.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_is_path(self):
+        self.assert_(input_utils.is_path(self.path))
+        self.failIf(input_utils.is_path(self.tempdir))
+        self.failIf(input_utils.is_path('first\nsecond\n'))
+        self.failIf(input_utils.is_path(open(self.path)))
+
+    def test_mapped_file(self):
+        ifile = input_utils.MappedFile(self.path)
+        try:
+            self.assertEqual(ifile.name, self.path)
+            self.assertEqual(len(ifile), 19)
+            self.assertEqual(list(ifile), ['first\r\n', 'second\n', 'third'])
+            self.assertEqual(ifile.readline(), '')
+            ifile.seek(7)
+            self.assertEqual(ifile.tell(), 7)
+            self.assertEqual(ifile.readline(), 'second\n')
+            self.assertEqual(ifile.read(), 'third')
+            ifile.seek(0)
+            self.assertEqual(ifile.read(5), 'first')
+        finally:
+            ifile.close()
+        self.assert_(ifile.closed)
+        ifile.close()
+
+    def test_empty_file(self):
+        path = os.path.join(self.tempdir, 'empty')
+        open(path, 'wb').close()
+        ifile = input_utils.MappedFile(path)
+        self.assertEqual(len(ifile), 0)
+        self.assertEqual(list(ifile), [])
+        self.assertEqual(ifile.read(), '')
+        ifile.close()
+
+    def test_open_input(self):
+        ifile = input_utils.open_input(self.path)
+        self.assert_(isinstance(ifile, input_utils.MappedFile))
+        input_utils.close_input(ifile, self.path)
+        self.assert_(ifile.closed)
+
+        buf = 'first\nsecond\n'
+        self.assert_(input_utils.open_input(buf) is buf)
+        fileObj = open(self.path)
+        self.assert_(input_utils.open_input(fileObj) is fileObj)
+        input_utils.close_input(fileObj, fileObj)
+        self.failIf(fileObj.closed)
+        fileObj.close()
+
+    def test_compression(self):
+        data = open(self.path, 'rb').read()
+        gzipPath = os.path.join(self.tempdir, 'output.gz')
+        ofile = gzip.open(gzipPath, 'wb')
+        ofile.write(data)
+        ofile.close()
+        bgzfPath = os.path.join(self.tempdir, 'output.bgz')
+        input_utils.write_bgzf(bgzfPath, data, 4)
+
+        self.assertEqual(input_utils.get_compression(self.path), None)
+        self.assertEqual(input_utils.get_compression(gzipPath), 'gzip')
+        self.assertEqual(input_utils.get_compression(bgzfPath), 'bgzf')
+
+        for path in (gzipPath, bgzfPath):
+            for buf in (path, open(path, 'rb'), open(path, 'rb').read()):
+                ifile = input_utils.open_input(buf)
+                self.assertEqual(list(ifile),
+                                 ['first\r\n', 'second\n', 'third'])
+                input_utils.close_input(ifile, buf)
+
+    def test_bgzf_blocks(self):
+        data = open(self.path, 'rb').read()
+        bgzfPath = os.path.join(self.tempdir, 'output.bgz')
+        input_utils.write_bgzf(bgzfPath, data, 4)
+
+        ifile = open(bgzfPath, 'rb')
+        try:
+            offsets = input_utils.get_bgzf_offsets(ifile)
+            self.assertEqual(len(offsets), 6)   # with the end of file block
+            blocks = list(input_utils.iter_bgzf_blocks(ifile, offsets[2]))
+            self.assertEqual([ offset for (offset, block) in blocks ],
+                             offsets[2:])
+            self.assertEqual([ block for (offset, block) in blocks ],
+                             ['econ', 'd\nth', 'ird', ''])
+            self.assertEqual(input_utils.read_bgzf_block(ifile, offsets[1]),
+                             ('t\r\ns', offsets[2]))
+            size = os.path.getsize(bgzfPath)
+            self.assertEqual(input_utils.read_bgzf_block(ifile, size),
+                             (None, size))
+            self.assertRaises(AssertionError, input_utils.get_bgzf_offsets,
+                              ifile, 1)
+        finally:
+            ifile.close()
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Input_utils_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,174 @@
+import unittest
+import interval_index
+
+class Interval_index_test(unittest.TestCase):
+    """
+    Test the overlap queries of an IntervalIndex against checking every
+    interval.
+    """
+
+    def setUp(self):
+        self.intervals = [ ('chr1', 0, 10), ('chr1', 5, 500), ('chr1', 20, 30),
+                           ('chr1', 30, 40), ('chr2', 0, 100),
+                           ('chr1', 600, 610) ]
+        self.index = interval_index.IntervalIndex()
+        for value, (key, start, stop) in enumerate(self.intervals):
+            self.index.add(key, start, stop, value)
+        self.index.build()
+
+    def find(self, key, start, stop):
+        found = [ (self.intervals[i][1], i)
+                  for i in range(0, len(self.intervals))
+                  if self.intervals[i][0] == key and
+                  self.intervals[i][1] < stop and self.intervals[i][2] > start ]
+        found.sort()
+        return [ i for (s, i) in found ]
+
+    def test_find_overlaps(self):
+        self.assertEqual(len(self.index), 6)
+        self.assertEqual(sorted(self.index.keys()), ['chr1', 'chr2'])
+        for key in ('chr1', 'chr2', 'chr3'):
+            for start in range(0, 620, 5):
+                for stop in (start + 1, start + 10, start + 100):
+                    self.assertEqual(
+                        list(self.index.find_overlaps(key, start, stop)),
+                        self.find(key, start, stop))
+
+    def test_build(self):
+        """
+        Intervals added after a build are merged into the arrays by the
+        next build, here without NumPy, and a query before it fails
+        """
+        self.intervals.append(('chr1', 25, 26))
+        self.index.add('chr1', 25, 26, 6)
+        self.assertRaises(AssertionError, self.index.find_overlaps, 'chr1',
+                          0, 10)
+        numpy = interval_index.numpy
+        interval_index.numpy = None
+        try:
+            self.index.build()
+        finally:
+            interval_index.numpy = numpy
+        self.assertEqual(len(self.index), 7)
+        self.assertEqual(list(self.index.find_overlaps('chr1', 22, 28)),
+                         [1, 2, 6])
+
+    def test_find_overlaps_batch(self):
+        """
+        A batch of queries finds the overlaps of each query, in query
+        order, with or without NumPy
+        """
+        starts = range(0, 620, 5) * 3
+        stops = [ start + 1 for start in range(0, 620, 5) ] + \
+                [ start + 10 for start in range(0, 620, 5) ] + \
+                [ start + 100 for start in range(0, 620, 5) ]
+        expected = ([], [])
+        for i in range(0, len(starts)):
+            values = self.find('chr1', starts[i], stops[i])
+            expected[0].extend([i] * len(values))
+            expected[1].extend(values)
+
+        queries, values = self.index.find_overlaps_batch('chr1', starts,
+                                                         stops)
+        self.assertEqual((list(queries), list(values)), expected)
+        queries, values = self.index.find_overlaps_batch('chr3', starts,
+                                                         stops)
+        self.assertEqual((list(queries), list(values)), ([], []))
+        queries, values = self.index.find_overlaps_batch('chr1', [], [])
+        self.assertEqual((list(queries), list(values)), ([], []))
+
+        numpy = interval_index.numpy
+        interval_index.numpy = None
+        try:
+            self.assertEqual(self.index.find_overlaps_batch('chr1', starts,
+                                                            stops), expected)
+        finally:
+            interval_index.numpy = numpy
+
+    def test_long_intervals(self):
+        """
+        Intervals of very different lengths go into separate bins, with
+        the same overlaps found, with or without NumPy, and arrays
+        sorted by a build are taken back as they are
+        """
+        self.intervals = [ ('chr1', i, i + 5) for i in range(0, 2000, 7) ]
+        self.intervals.append(('chr1', 100, 100000))
+        self.intervals.append(('chr1', 50, 70))
+        starts = range(0, 2100, 13)
+        stops = [ start + 3 for start in starts ]
+        expected = ([], [])
+        for i in range(0, len(starts)):
+            values = self.find('chr1', starts[i], stops[i])
+            expected[0].extend([i] * len(values))
+            expected[1].extend(values)
+
+        numpy = interval_index.numpy
+        for useNumpy in (True, False):
+            if not useNumpy:
+                interval_index.numpy = None
+            try:
+                index = interval_index.IntervalIndex()
+                for value, (key, start, stop) in enumerate(self.intervals):
+                    index.add(key, start, stop, value)
+                index.build()
+                self.assertEqual([ b[2] for b in index.bins['chr1'] ],
+                                 [5, 20, 99900])
+                copy = interval_index.IntervalIndex()
+                copy.set_sorted('chr1', index.starts['chr1'],
+                                index.stops['chr1'], index.values['chr1'])
+                self.assertEqual(copy.bins, index.bins)
+                for i in range(0, len(starts)):
+                    self.assertEqual(copy.find_overlaps('chr1', starts[i],
+                                                        stops[i]),
+                                     self.find('chr1', starts[i], stops[i]))
+                queries, values = copy.find_overlaps_batch('chr1', starts,
+                                                           stops)
+                self.assertEqual((list(queries), list(values)), expected)
+            finally:
+                interval_index.numpy = numpy
+
+    def test_build_block_index(self):
+        ivals_list = [ [(('chr1', 0, 10, 1), ('chr2', 100, 110, 1)),
+                        (('chr1', 20, 30, 1), ('chr2', 120, 130, 1))],
+                       [],
+                       [(('chr2', 105, 125, -1), ('chr3', 0, 20, -1))] ]
+        index, firstBlocks = interval_index.build_block_index(ivals_list)
+        self.assertEqual(list(firstBlocks), [0, 2, 2])
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.get_nbytes(), 6 * 24)
+        values = index.find_overlaps('chr2', 108, 121)
+        self.assertEqual(values, [1, 4, 3])
+        numpy = interval_index.numpy
+        for useNumpy in (True, False):
+            if not useNumpy:
+                interval_index.numpy = None
+            try:
+                found = interval_index.get_alignment_blocks(firstBlocks,
+                                                            values)
+                self.assertEqual([ list(column) for column in found ],
+                                 [[0, 2, 0], [0, 0, 1], [1, 0, 1]])
+                found = interval_index.get_alignment_blocks(firstBlocks, [])
+                self.assertEqual([ list(column) for column in found ],
+                                 [[], [], []])
+            finally:
+                interval_index.numpy = numpy
+
+        # a block aligning a sequence to itself is found on each side
+        index, firstBlocks = interval_index.build_block_index(
+            [[(('chr1', 0, 10, 1), ('chr1', 5, 15, 1))]])
+        values = index.find_overlaps('chr1', 6, 8)
+        self.assertEqual([ list(column) for column in
+                           interval_index.get_alignment_blocks(firstBlocks,
+                                                               values) ],
+                         [[0, 0], [0, 0], [0, 1]])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Interval_index_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
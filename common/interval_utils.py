@@ -0,0 +1,355 @@
+# ! /usr/bin/env python2.5
+
+"""
+INTERVAL_UTILS MODULE
+=====================
+A module shared by the aligned-FASTA and clustalw loaders
+(`Clustalw_NLMSA`, `lagan_NLMSA`, `mlagan_NLMSA`) that extracts the
+ungapped aligned subintervals from a pair of gapped alignment rows.
+The module does not define any class.
+
+Functions:
+
+- `build_interval_list()`: extract all ungapped aligned subintervals from
+  a pair of aligned sequences, using NumPy when it is available
+- `build_interval_list_numpy()`: the NumPy implementation, working on the
+  rows as byte arrays
+- `build_interval_arrays()`: the same intervals as four NumPy arrays, of
+  their a_start, a_stop, b_start and b_stop coordinates
+- `build_interval_list_py()`: the pure-Python implementation, walking the
+  rows one column at a time; kept for checking results and for
+  installations without NumPy
+- `build_column_list()`: extract the ungapped subintervals of a single
+  aligned row together with their alignment column coordinates
+- `iter_pair_intervals()`: extract the intervals of many pairs of rows,
+  optionally in a pool of worker processes
+- `build_run_list()`: encode the runs of residues of an aligned row
+- `intersect_run_lists()`: extract the ungapped aligned subintervals of a
+  pair of rows, or of a range of their columns, from their run lists
+- `intersect_run_arrays()`: the same intervals as four NumPy arrays,
+  found with array operations
+- `iter_run_intersections()`: intersect the run lists of many pairs of
+  rows, optionally in a pool of worker processes
+
+
+How To Use This Module
+======================
+
+1. Make the ``common`` directory importable and import it:
+   ``import interval_utils``.
+
+2. Pass two aligned rows of equal length (strings, with '-' as the gap
+   character) to build_interval_list(a, b); a list of
+   (a_start, a_stop, b_start, b_stop) tuples is returned, with the
+   coordinates counted in residues (gaps excluded) from the start of
+   each row.
+   ``interval_list = interval_utils.build_interval_list(a, b)``
+
+3. To extract the intervals of many pairs of rows on several cores,
+   pass the rows and the pairs of row indices grouped into tasks to
+   iter_pair_intervals(); each worker process receives the rows once,
+   and the interval lists of each task are yielded in task order.
+   ``tasks = [[(0, 1), (0, 2)], [(1, 2)]]``
+   ``for interval_lists in interval_utils.iter_pair_intervals(rows, tasks,``
+   ``                                                         4):``
+
+4. When the same rows are paired many times, encode each of them once
+   with build_run_list() and intersect the run lists instead; this
+   takes time proportional to the number of runs rather than of
+   columns, and a range of columns can be picked out by bisection.
+   ``runs = [ interval_utils.build_run_list(row) for row in rows ]``
+   ``interval_list = interval_utils.intersect_run_lists(runs[0], runs[1],``
+   ``                                                   60, 120)``
+
+5. When the intervals go into NumPy arrays, e.g. the batches of
+   ival_arrays.IvalBatchBuilder, get them as four arrays of
+   coordinates, with no tuple made per interval, from
+   build_interval_arrays() or intersect_run_arrays(), or by passing
+   arrays=True to iter_pair_intervals() or iter_run_intersections().
+   ``a_starts, a_stops, b_starts, b_stops = \``
+   ``    interval_utils.build_interval_arrays(a, b)``
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+from array import array
+from bisect import bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import parallel_utils
+
+GAP = '-'
+
+def build_interval_list_py(a, b):
+    """
+    Hacky code to extract all ungapped aligned subintervals from a
+    pair of aligned sequences.
+    """
+    interval_list = []
+
+    a_start = None
+    b_start = None
+
+    a_count = b_count = 0
+    for i in range(0, len(a)):
+        if a[i] == '-' or b[i] == '-':
+            if a_start is not None:           # want to end at i-1
+                interval_list.append((a_start, a_count, b_start, b_count))
+
+                a_start = b_start = None
+        else:
+            if a_start is None:
+                a_start = a_count
+                b_start = b_count
+
+        if a[i] != '-':
+            a_count += 1
+        if b[i] != '-':
+            b_count += 1
+
+    if a_start is not None:
+        interval_list.append((a_start, a_count, b_start, b_count))
+
+    assert a_count == len(a.replace('-', ''))
+    assert b_count == len(b.replace('-', ''))
+
+    return interval_list
+
+def _residue_offsets(residues):
+    """
+    Given the boolean residue mask of a row, return an array whose i^th
+    element is the number of residues in the columns before column i
+    (one element longer than the row).
+    """
+    offsets = numpy.zeros(len(residues) + 1, dtype=numpy.int64)
+    numpy.cumsum(residues, out=offsets[1:])
+    return offsets
+
+def build_interval_arrays(a, b):
+    """
+    Extract all ungapped aligned subintervals from a pair of aligned
+    sequences, using NumPy on the rows as byte arrays: the runs of
+    columns where neither row has a gap are found from the boundaries
+    of the gap mask, and the residue coordinates of the run boundaries
+    are read off a cumulative sum of each row's residue mask.
+    Returns the a_start, a_stop, b_start and b_stop coordinates of the
+    intervals as four int64 arrays.
+    """
+    assert len(a) == len(b), "aligned sequences must have the same length"
+    if not len(a):
+        return tuple([ numpy.empty(0, dtype=numpy.int64)
+                       for k in range(0, 4) ])
+
+    a_res = numpy.frombuffer(a, dtype=numpy.uint8) != ord(GAP)
+    b_res = numpy.frombuffer(b, dtype=numpy.uint8) != ord(GAP)
+
+    # pad with unaligned columns so that every run has both boundaries
+    aligned = numpy.zeros(len(a) + 2, dtype=numpy.int8)
+    aligned[1:-1] = a_res & b_res
+    boundaries = numpy.diff(aligned)
+    starts = numpy.nonzero(boundaries == 1)[0]
+    stops = numpy.nonzero(boundaries == -1)[0]
+
+    a_offsets = _residue_offsets(a_res)
+    b_offsets = _residue_offsets(b_res)
+
+    return (a_offsets[starts], a_offsets[stops], b_offsets[starts],
+            b_offsets[stops])
+
+def build_interval_list_numpy(a, b):
+    """
+    Extract all ungapped aligned subintervals from a pair of aligned
+    sequences with build_interval_arrays().
+    Returns exactly the same tuples as build_interval_list_py().
+    """
+    return zip(*[ column.tolist() for column in build_interval_arrays(a, b) ])
+
+if numpy is not None:
+    build_interval_list = build_interval_list_numpy
+else:
+    build_interval_list = build_interval_list_py
+
+def build_column_list(a):
+    """
+    Extract the ungapped subintervals of a single aligned sequence,
+    as (a_start, a_stop, column_start, column_stop) tuples: the residue
+    coordinates of each run and the alignment columns it occupies.
+    """
+    return build_interval_list(a, 'N' * len(a))
+
+# the rows shared by the pairs of a worker process
+_rows = None
+
+def _set_rows(rows):
+    global _rows
+    _rows = rows
+
+def _build_pair_intervals(pairs):
+    return [ build_interval_list(_rows[i], _rows[j]) for (i, j) in pairs ]
+
+def _build_pair_interval_arrays(pairs):
+    return [ build_interval_arrays(_rows[i], _rows[j]) for (i, j) in pairs ]
+
+def iter_pair_intervals(rows, tasks, processes=None, chunksize=1,
+                        arrays=False):
+    """
+    For each task of tasks, a list of (i, j) pairs of indices in rows,
+    yield the list of build_interval_list(rows[i], rows[j]) of its pairs,
+    or of build_interval_arrays(rows[i], rows[j]) if arrays is True.
+    With processes > 1 the tasks are run in a pool of worker processes,
+    each given the rows only once; the results are yielded in task order
+    either way.
+    """
+    if arrays:
+        build, build_pairs = build_interval_arrays, \
+                             _build_pair_interval_arrays
+    else:
+        build, build_pairs = build_interval_list, _build_pair_intervals
+    if processes is None or processes <= 1 or \
+       parallel_utils.multiprocessing is None:
+        for pairs in tasks:
+            yield [ build(rows[i], rows[j]) for (i, j) in pairs ]
+        return
+
+    for interval_lists in parallel_utils.imap(build_pairs, tasks,
+                                              processes, _set_rows, (rows,),
+                                              chunksize):
+        yield interval_lists
+
+def build_run_list(a):
+    """
+    Encode the runs of residues between the gaps of an aligned row as a
+    (column_starts, column_stops, residue_starts) tuple of arrays, with
+    one element per run: the alignment columns the run occupies and the
+    number of residues before it in the row.
+    """
+    column_starts = array('l')
+    column_stops = array('l')
+    residue_starts = array('l')
+    for (a_start, a_stop, x, y) in build_column_list(a):
+        column_starts.append(x)
+        column_stops.append(y)
+        residue_starts.append(a_start)
+    return column_starts, column_stops, residue_starts
+
+def intersect_run_lists(a_runs, b_runs, start=0, stop=None):
+    """
+    Extract the ungapped aligned subintervals of two rows from their
+    run lists (see build_run_list()), in the columns start to stop (by
+    default all of them), by walking the two run lists side by side.
+    Returns the same (a_start, a_stop, b_start, b_stop) tuples as
+    build_interval_list(a[start:stop], b[start:stop]), except that the
+    residues are counted from the start of each row.
+    """
+    a_starts, a_stops, a_residues = a_runs
+    b_starts, b_stops, b_residues = b_runs
+    if stop is None:
+        stop = max([start] + a_stops[-1:].tolist() + b_stops[-1:].tolist())
+
+    # the first runs ending after column start
+    i = bisect_right(a_stops, start)
+    j = bisect_right(b_stops, start)
+    interval_list = []
+    while i < len(a_starts) and j < len(b_starts):
+        lo = max(a_starts[i], b_starts[j], start)
+        if lo >= stop:
+            break
+        a_stop = a_stops[i]
+        b_stop = b_stops[j]
+        hi = min(a_stop, b_stop, stop)
+        if lo < hi:
+            a_shift = a_residues[i] - a_starts[i]
+            b_shift = b_residues[j] - b_starts[j]
+            interval_list.append((lo + a_shift, hi + a_shift,
+                                  lo + b_shift, hi + b_shift))
+        # move past the run(s) ending first
+        if a_stop <= b_stop:
+            i += 1
+        if b_stop <= a_stop:
+            j += 1
+
+    return interval_list
+
+def _as_int64(column):
+    if not len(column):
+        return numpy.empty(0, dtype=numpy.int64)
+    return numpy.frombuffer(column, dtype='i%d' % column.itemsize).astype(
+        numpy.int64)
+
+def intersect_run_arrays(a_runs, b_runs, start=0, stop=None):
+    """
+    Extract the same intervals as intersect_run_lists(a_runs, b_runs,
+    start, stop) with NumPy array operations: the b runs overlapping
+    each a run are found by bisecting the run boundaries, and each
+    overlapping pair is clipped to the columns start to stop.
+    Returns the a_start, a_stop, b_start and b_stop coordinates of the
+    intervals as four int64 arrays.
+    """
+    a_starts, a_stops, a_residues = [ _as_int64(column)
+                                      for column in a_runs ]
+    b_starts, b_stops, b_residues = [ _as_int64(column)
+                                      for column in b_runs ]
+    if stop is None:
+        stop = max([start] + a_stops[-1:].tolist() + b_stops[-1:].tolist())
+
+    # the a runs overlapping the columns, and the b runs overlapping each
+    first = numpy.searchsorted(a_stops, start, 'right')
+    last = numpy.searchsorted(a_starts, stop)
+    i = numpy.arange(first, max(first, last))
+    b_first = numpy.searchsorted(b_stops, a_starts[i], 'right')
+    counts = numpy.maximum(numpy.searchsorted(b_starts, a_stops[i]) -
+                           b_first, 0)
+
+    # one element per overlapping pair of runs, as in
+    # IntervalIndex.find_overlaps_batch()
+    i = numpy.repeat(i, counts)
+    ends = numpy.cumsum(counts)
+    j = numpy.arange(len(i)) - numpy.repeat(ends - counts - b_first, counts)
+    lo = numpy.maximum(numpy.maximum(a_starts[i], b_starts[j]), start)
+    hi = numpy.minimum(numpy.minimum(a_stops[i], b_stops[j]), stop)
+    kept = lo < hi
+    i, j, lo, hi = i[kept], j[kept], lo[kept], hi[kept]
+
+    a_shift = a_residues[i] - a_starts[i]
+    b_shift = b_residues[j] - b_starts[j]
+    return lo + a_shift, hi + a_shift, lo + b_shift, hi + b_shift
+
+def _intersect_pair_runs(pairs):
+    return [ intersect_run_lists(_rows[i], _rows[j], start, stop)
+             for (i, j, start, stop) in pairs ]
+
+def _intersect_pair_run_arrays(pairs):
+    return [ intersect_run_arrays(_rows[i], _rows[j], start, stop)
+             for (i, j, start, stop) in pairs ]
+
+def iter_run_intersections(run_lists, tasks, processes=None, chunksize=1,
+                           arrays=False):
+    """
+    For each task of tasks, a list of (i, j, start, stop) tuples, yield
+    the list of intersect_run_lists(run_lists[i], run_lists[j], start,
+    stop) of its tuples, or of intersect_run_arrays() if arrays is True,
+    computed in a pool of processes worker processes as in
+    iter_pair_intervals().
+    """
+    if arrays:
+        intersect, intersect_pairs = intersect_run_arrays, \
+                                     _intersect_pair_run_arrays
+    else:
+        intersect, intersect_pairs = intersect_run_lists, \
+                                     _intersect_pair_runs
+    if processes is None or processes <= 1 or \
+       parallel_utils.multiprocessing is None:
+        for pairs in tasks:
+            yield [ intersect(run_lists[i], run_lists[j], start, stop)
+                    for (i, j, start, stop) in pairs ]
+        return
+
+    for interval_lists in parallel_utils.imap(intersect_pairs, tasks,
+                                              processes, _set_rows,
+                                              (run_lists,), chunksize):
+        yield interval_lists
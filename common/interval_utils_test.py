@@ -0,0 +1,125 @@
+import random
+import unittest
+import interval_utils
+
+class Interval_utils_test(unittest.TestCase):
+    """
+    Test that the NumPy interval extraction agrees with the
+    pure-Python implementation.
+    """
+
+    def setUp(self):
+        self.pairs = [('ACGT', 'ACGT'),
+                      ('AC-GT', 'ACG-T'),
+                      ('--AC--', 'A--CG-'),
+                      ('----', 'ACGT'),
+                      ('-', '-'),
+                      ('', '')]
+
+        rand = random.Random(1)
+        for i in range(0, 50):
+            length = rand.randint(1, 300)
+            gap_freq = rand.random()
+            row = lambda: ''.join([ rand.random() < gap_freq and '-' or 'A'
+                                    for j in range(0, length) ])
+            self.pairs.append((row(), row()))
+
+    def test_manual(self):
+        self.assertEqual(interval_utils.build_interval_list_py('AC-GT',
+                                                               'ACG-T'),
+                         [(0, 2, 0, 2), (3, 4, 3, 4)])
+        self.assertEqual(interval_utils.build_interval_list_py('--AC--',
+                                                               'A--CG-'),
+                         [(1, 2, 1, 2)])
+
+    def test_build_column_list(self):
+        self.assertEqual(interval_utils.build_column_list('--AC-G'),
+                         [(0, 2, 2, 4), (2, 3, 5, 6)])
+        self.assertEqual(interval_utils.build_column_list('----'), [])
+
+    def test_numpy_matches_py(self):
+        if interval_utils.numpy is None:
+            return
+
+        for a, b in self.pairs:
+            self.assertEqual(interval_utils.build_interval_list_numpy(a, b),
+                             interval_utils.build_interval_list_py(a, b))
+
+    def test_iter_pair_intervals(self):
+        rows = ['AC-GT', 'ACG-T', '-CGTA']
+        tasks = [[(0, 1), (1, 2)], [], [(2, 0)]]
+        expected = [ [ interval_utils.build_interval_list(rows[i], rows[j])
+                       for (i, j) in pairs ] for pairs in tasks ]
+        for processes in (None, 2):
+            self.assertEqual(list(interval_utils.iter_pair_intervals(
+                rows, tasks, processes)), expected)
+            if interval_utils.numpy is None:
+                continue
+            results = interval_utils.iter_pair_intervals(rows, tasks,
+                                                         processes,
+                                                         arrays=True)
+            self.assertEqual([ [ zip(*[ column.tolist() for column in arrays ])
+                                 for arrays in interval_arrays ]
+                               for interval_arrays in results ], expected)
+
+    def test_intersect_run_lists(self):
+        runs = interval_utils.build_run_list('--AC-G')
+        self.assertEqual([ list(column) for column in runs ],
+                         [[2, 5], [4, 6], [0, 2]])
+
+        for a, b in self.pairs:
+            a_runs = interval_utils.build_run_list(a)
+            b_runs = interval_utils.build_run_list(b)
+            self.assertEqual(interval_utils.intersect_run_lists(a_runs,
+                                                                b_runs),
+                             interval_utils.build_interval_list_py(a, b))
+
+            # a range of columns, with the residues before it added
+            start = len(a) // 3
+            stop = 2 * len(a) // 3
+            a_before = len(a[:start].replace('-', ''))
+            b_before = len(b[:start].replace('-', ''))
+            expected = [ (p + a_before, q + a_before, x + b_before,
+                          y + b_before) for (p, q, x, y) in
+                         interval_utils.build_interval_list_py(a[start:stop],
+                                                               b[start:stop]) ]
+            self.assertEqual(interval_utils.intersect_run_lists(
+                a_runs, b_runs, start, stop), expected)
+
+            if interval_utils.numpy is not None:
+                for (p, q) in ((0, None), (start, stop)):
+                    arrays = interval_utils.intersect_run_arrays(a_runs,
+                                                                 b_runs, p, q)
+                    self.assertEqual(zip(*[ column.tolist()
+                                            for column in arrays ]),
+                                     interval_utils.intersect_run_lists(
+                                         a_runs, b_runs, p, q))
+
+    def test_iter_run_intersections(self):
+        rows = ['AC-GT', 'ACG-T', '-CGTA']
+        run_lists = [ interval_utils.build_run_list(row) for row in rows ]
+        tasks = [[(0, 1, 0, 5), (1, 2, 2, 4)], [], [(2, 0, 0, 3)]]
+        expected = [ [ interval_utils.intersect_run_lists(
+            run_lists[i], run_lists[j], start, stop)
+                       for (i, j, start, stop) in pairs ] for pairs in tasks ]
+        for processes in (None, 2):
+            self.assertEqual(list(interval_utils.iter_run_intersections(
+                run_lists, tasks, processes)), expected)
+            if interval_utils.numpy is None:
+                continue
+            results = interval_utils.iter_run_intersections(
+                run_lists, tasks, processes, arrays=True)
+            self.assertEqual([ [ zip(*[ column.tolist() for column in arrays ])
+                                 for arrays in interval_arrays ]
+                               for interval_arrays in results ], expected)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Interval_utils_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,194 @@
+# ! /usr/bin/env python2.5
+
+"""
+IVAL_ARRAYS MODULE
+==================
+A module shared by the loaders that builds the aligned intervals of an
+alignment file as structured NumPy arrays, one row per interval pair,
+instead of lists of nested tuples, so they can be filtered, counted and
+loaded with vectorized operations. The module defines the following
+class:
+
+- `IvalBatchBuilder`, gathers interval pairs, one at a time into a
+  flat array or as arrays of coordinates, and turns them into a
+  structured array once a batch is full
+
+Functions:
+
+- `iter_ivals()`: turn a batch back into the ivals tuples taken by
+  loader_utils.BulkLoader and the build_*_ivals() generators
+
+Constants:
+
+- `IVAL_DTYPE`: the dtype of the batches, with the fields src_id,
+  src_start, src_stop, dest_id, dest_start, dest_stop, ori and dest_ori;
+  the IDs index the batch's block_store.NameTable
+- `BATCH_SIZE`: the default number of rows per batch
+
+
+How To Use This Module
+======================
+
+1. The format modules use it in their iter_ival_batches() functions,
+   which yield (batch, names) pairs; names is a NameTable shared by all
+   the batches of a file, so its IDs can be compared across batches:
+   ``for batch, names in blat_NLMSA.iter_ival_batches(buf, False):``
+   ``    kept = batch[batch['src_stop'] - batch['src_start'] >= 100]``
+
+2. A batch can be turned back into ivals tuples for loading:
+   ``loader.add(ival_arrays.iter_ivals(kept, names, oriented=True))``
+
+NumPy is needed to build the batches.
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import block_store
+
+FIELDS = ('src_id', 'src_start', 'src_stop', 'dest_id', 'dest_start',
+          'dest_stop', 'ori', 'dest_ori')
+if numpy is not None:
+    IVAL_DTYPE = numpy.dtype([('src_id', numpy.int32),
+                              ('src_start', numpy.int64),
+                              ('src_stop', numpy.int64),
+                              ('dest_id', numpy.int32),
+                              ('dest_start', numpy.int64),
+                              ('dest_stop', numpy.int64),
+                              ('ori', numpy.int8),
+                              ('dest_ori', numpy.int8)])
+else:
+    IVAL_DTYPE = None
+BATCH_SIZE = 100000
+
+class IvalBatchBuilder(object):
+    """
+    Gathers interval pairs, with their sequence names interned in a
+    NameTable, and turns them into structured arrays of IVAL_DTYPE:
+    pairs added one at a time go into a flat array of len(FIELDS)
+    values per pair, and arrays of intervals into structured arrays
+    filled a column at a time.
+    """
+
+    def __init__(self, batchSize=BATCH_SIZE, names=None):
+        assert numpy is not None, "NumPy is needed to build ival batches"
+        self.batchSize = batchSize
+        if names is None:
+            names = block_store.NameTable()
+        self.names = names
+        self.values = array('l')
+        self.chunks = []        # the structured arrays gathered so far
+        self.nChunkRows = 0
+
+    def __len__(self):
+        return self.nChunkRows + len(self.values) // len(FIELDS)
+
+    def get_id(self, name):
+        return self.names.get_id(name)
+
+    def add(self, srcId, srcStart, srcStop, destId, destStart, destStop,
+            ori=1, destOri=1):
+        """
+        Add an interval pair; the sequences are given by their IDs
+        """
+        self.values.extend((srcId, srcStart, srcStop, destId, destStart,
+                            destStop, ori, destOri))
+
+    def add_intervals(self, srcId, srcOffset, destId, destOffset,
+                      interval_list):
+        """
+        Add the (a_start, a_stop, b_start, b_stop) tuples of an
+        interval list, shifted by the offsets of the two rows
+        """
+        columns = numpy.array(interval_list, dtype=numpy.int64)
+        self.add_interval_arrays(srcId, srcOffset, destId, destOffset,
+                                 columns.reshape(-1, 4).T)
+
+    def add_interval_arrays(self, srcId, srcOffset, destId, destOffset,
+                            interval_arrays):
+        """
+        Add the intervals of the four arrays of interval_arrays, their
+        a_start, a_stop, b_start and b_stop coordinates, e.g. as
+        returned by interval_utils.build_interval_arrays(), shifted by
+        the offsets of the two rows
+        """
+        aStarts, aStops, bStarts, bStops = interval_arrays
+        if not len(aStarts):
+            return
+        self._pop_values()      # keeps the pairs in the order added
+        chunk = numpy.empty(len(aStarts), dtype=IVAL_DTYPE)
+        chunk['src_id'] = srcId
+        chunk['src_start'] = aStarts
+        chunk['src_stop'] = aStops
+        chunk['dest_id'] = destId
+        chunk['dest_start'] = bStarts
+        chunk['dest_stop'] = bStops
+        chunk['ori'] = 1
+        chunk['dest_ori'] = 1
+        if srcOffset:
+            chunk['src_start'] += srcOffset
+            chunk['src_stop'] += srcOffset
+        if destOffset:
+            chunk['dest_start'] += destOffset
+            chunk['dest_stop'] += destOffset
+        self.chunks.append(chunk)
+        self.nChunkRows += len(chunk)
+
+    def is_full(self):
+        return len(self) >= self.batchSize
+
+    def _pop_values(self):
+        """
+        Move the pairs of the flat array into a structured array
+        """
+        if not self.values:
+            return
+        columns = numpy.frombuffer(self.values,
+                                   dtype='i%d' % self.values.itemsize)
+        columns = columns.reshape(-1, len(FIELDS))
+        chunk = numpy.empty(len(columns), dtype=IVAL_DTYPE)
+        for k in range(0, len(FIELDS)):
+            chunk[FIELDS[k]] = columns[:, k]
+        self.values = array('l')
+        self.chunks.append(chunk)
+        self.nChunkRows += len(chunk)
+
+    def pop(self):
+        """
+        Returns the gathered interval pairs as a structured array and
+        starts a new batch
+        """
+        self._pop_values()
+        chunks = self.chunks
+        self.chunks = []
+        self.nChunkRows = 0
+        if not chunks:
+            return numpy.empty(0, dtype=IVAL_DTYPE)
+        if len(chunks) == 1:
+            return chunks[0]
+        return numpy.concatenate(chunks)
+
+def iter_ivals(batch, names, oriented=False):
+    """
+    Yield the ivals tuples of the rows of a batch, with the sequence
+    names looked up in names; (name, start, stop, ori) tuples if
+    oriented is True, else (name, start, stop) tuples.
+    """
+    columns = [ batch[field].tolist() for field in FIELDS ]
+    (src_id, src_start, src_stop, dest_id, dest_start, dest_stop, ori,
+     dest_ori) = columns
+    for i in range(0, len(batch)):
+        if oriented:
+            yield ((names[src_id[i]], src_start[i], src_stop[i], ori[i]),
+                   (names[dest_id[i]], dest_start[i], dest_stop[i],
+                    dest_ori[i]))
+        else:
+            yield ((names[src_id[i]], src_start[i], src_stop[i]),
+                   (names[dest_id[i]], dest_start[i], dest_stop[i]))
@@ -0,0 +1,59 @@
+import unittest
+import ival_arrays
+
+class Ival_arrays_test(unittest.TestCase):
+    """
+    Test that the ival batches read back as the ivals they were
+    built from.
+    """
+
+    def test_builder(self):
+        if ival_arrays.numpy is None:
+            return
+
+        builder = ival_arrays.IvalBatchBuilder(batchSize=3)
+        self.assertEqual(len(builder.pop()), 0)
+        id1 = builder.get_id('seq1')
+        id2 = builder.get_id('seq2')
+        builder.add(id1, 0, 10, id2, 5, 15, 1, -1)
+        builder.add_intervals(id2, 100, id1, 200, [(0, 2, 1, 3), (4, 5, 6, 7)])
+        self.assertTrue(builder.is_full())
+        self.assertEqual(builder.get_id('seq1'), id1)
+
+        batch = builder.pop()
+        self.assertEqual(len(builder), 0)
+        self.assertEqual(batch.dtype, ival_arrays.IVAL_DTYPE)
+        self.assertEqual(list(batch['dest_start']), [5, 201, 206])
+        self.assertEqual(list(ival_arrays.iter_ivals(batch, builder.names,
+                                                     True)),
+                         [(('seq1', 0, 10, 1), ('seq2', 5, 15, -1)),
+                          (('seq2', 100, 102, 1), ('seq1', 201, 203, 1)),
+                          (('seq2', 104, 105, 1), ('seq1', 206, 207, 1))])
+        self.assertEqual(list(ival_arrays.iter_ivals(batch[:1],
+                                                     builder.names)),
+                         [(('seq1', 0, 10), ('seq2', 5, 15))])
+
+        # arrays of intervals keep their place among the pairs added
+        builder.add(id1, 0, 1, id2, 2, 3)
+        builder.add_interval_arrays(id1, 10, id2, 0,
+                                    (ival_arrays.numpy.array([0, 5]),
+                                     ival_arrays.numpy.array([2, 6]),
+                                     ival_arrays.numpy.array([1, 8]),
+                                     ival_arrays.numpy.array([3, 9])))
+        builder.add(id2, 4, 5, id1, 6, 7)
+        self.assertEqual(len(builder), 4)
+        batch = builder.pop()
+        self.assertEqual(list(batch['src_start']), [0, 10, 15, 4])
+        self.assertEqual(list(batch['dest_stop']), [3, 3, 9, 7])
+        self.assertEqual(list(batch['dest_ori']), [1, 1, 1, 1])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Ival_arrays_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
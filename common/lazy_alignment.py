@@ -0,0 +1,219 @@
+# ! /usr/bin/env python2.5
+
+"""
+LAZY_ALIGNMENT MODULE
+=====================
+A module shared by the blat and blastz loaders that answers slice
+queries on an alignment file straight from the file, through its
+record index, without loading it into an NLMSA. The module defines the
+following classes:
+
+- `LazyAlignment`, a read-only alignment over a blat or blastz file,
+  sliced by sequence interval like an NLMSA
+- `LazyAlignmentSlice`, the intervals aligned to a sequence interval
+
+Constants:
+
+- `CACHE_SIZE`: the default number of parsed records kept by a
+  LazyAlignment
+
+A LazyAlignment reads the offset_index.RecordIndex of its file, which
+gives the byte range of each record and the interval it covers on each
+of its sequences, with these intervals already sorted in an
+interval_index.IntervalIndex. A slice query finds the records
+overlapping the interval there, reads and parses only these records,
+and clips their ungapped blocks to the interval; the parsed records are
+kept in an LRU cache, so overlapping queries do not parse them again.
+Opening the alignment thus takes a pass over the file the first time,
+to build the index, and reading the index file afterwards, and the
+time of a query grows with the records it overlaps only.
+
+
+How To Use This Module
+======================
+
+1. Make the ``common`` directory importable and import it:
+   ``import lazy_alignment``.
+
+2. Open the alignment of a file through the function of its format,
+   e.g. blat_NLMSA.create_lazy_blat() or
+   blastz_NLMSA.create_lazy_blastz(), and slice it as an NLMSA:
+   ``al = blat_NLMSA.create_lazy_blat('output.psl', srcDB, destDB)``
+   ``for src, dest, edge in al[srcDB['chr1'][1000:2000]].edges():``
+   ``    ...``
+   ``al.close()``
+
+   Both sequences of the records can be queried; the source intervals
+   are in the orientation of the query interval.
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+from pygr import nlmsa_utils
+
+import input_utils
+import loader_utils
+import offset_index
+
+CACHE_SIZE = 1000
+
+def _clip_ivals(src, dest, start, stop):
+    """
+    Returns the ivals of src, a (name, start, stop, ori) ival, and of
+    dest, the ival aligned to it, clipped to the part of src in start
+    to stop; dest is scaled if it is longer, e.g. for a protein-DNA
+    alignment
+    """
+    name, a, b, ori = src
+    name2, x, y, ori2 = dest
+    lo = max(a, start)
+    hi = min(b, stop)
+    # the offsets of the clipped part in src, along its orientation
+    if ori > 0:
+        i, j = lo - a, hi - a
+    else:
+        i, j = b - hi, b - lo
+    if y - x != b - a:
+        i, j = i * (y - x) // (b - a), j * (y - x) // (b - a)
+    if ori2 > 0:
+        x, y = x + i, x + j
+    else:
+        x, y = y - j, y - i
+    return (name, lo, hi, ori), (name2, x, y, ori2)
+
+class LazyAlignment(object):
+    """
+    A read-only alignment over the file at path, plain or BGZF
+    compressed, sliced by sequence interval: al[ival] returns the
+    LazyAlignmentSlice of ival, read from the file as needed.
+    index - the offset_index.RecordIndex of the file
+    read_ivals - a function taking the lines of a record and the two
+    ivals of the record in the index, and returning the list of the
+    (ival1, ival2) pairs of the ungapped blocks of the record
+    srcDB, destDB - the databases of the first and second sequences of
+    the records (destDB defaults to srcDB)
+    cacheSize - the number of parsed records kept
+    """
+
+    def __init__(self, path, index, read_ivals, srcDB, destDB=None,
+                 cacheSize=CACHE_SIZE):
+        self.path = path
+        self.index = index
+        self.read_ivals = read_ivals
+        self.srcDB = srcDB
+        if destDB is None:
+            destDB = srcDB
+        self.destDB = destDB
+        self.compression = input_utils.get_compression(path)
+        assert self.compression != 'gzip', \
+               "a gzip file cannot be indexed, compress it with BGZF instead"
+        self.records = loader_utils.LRUCache(cacheSize)
+        self.nParsed = 0        # the number of records parsed
+
+        # the intervals of the records on both of their sequences; the
+        # value of each is 2 * record + side
+        self.intervals = index.get_intervals()
+        self.ifile = open(path, 'rb')
+
+    def __len__(self):
+        """
+        Returns the number of records of the file
+        """
+        return len(self.index)
+
+    def __getitem__(self, ival):
+        return LazyAlignmentSlice(self, ival)
+
+    def get_record_ivals(self, i):
+        """
+        Returns the (ival1, ival2) pairs of the ungapped blocks of
+        record i, parsing it unless it is cached
+        """
+        try:
+            return self.records[i]
+        except KeyError:
+            pass
+        start, stop = self.index.get_range(i)
+        lines = offset_index.iter_range_lines(self.ifile, start, stop,
+                                              self.compression)
+        ivals = list(self.read_ivals(lines, *self.index.get_ivals(i)))
+        self.nParsed += 1
+        self.records[i] = ivals
+        return ivals
+
+    def find_ivals(self, name, start, stop):
+        """
+        Returns the (src, dest, side) tuples of the ungapped blocks
+        aligned to start to stop of sequence name, in forward
+        coordinates: src is the part of the block on name, as a forward
+        (name, start, stop, 1) ival, dest the ival aligned to it, and
+        side 0 or 1 as name is the first or second sequence of the
+        record; they are sorted by src start, then dest
+        """
+        found = []
+        for value in self.intervals.find_overlaps(name, start, stop):
+            i, side = divmod(value, 2)
+            for ivals in self.get_record_ivals(i):
+                src = ivals[side]
+                if src[0] != name or src[2] <= start or src[1] >= stop:
+                    continue
+                src, dest = _clip_ivals(src, ivals[1 - side], start, stop)
+                if src[3] < 0:          # the reverse of both is aligned
+                    src = src[0:3] + (1,)
+                    dest = dest[0:3] + (-dest[3],)
+                found.append((src[1], dest, src, side))
+        found.sort()
+        return [ (src, dest, side) for (srcStart, dest, src, side)
+                 in found ]
+
+    def close(self):
+        self.ifile.close()
+
+class LazyAlignmentSlice(object):
+    """
+    The intervals aligned to a sequence interval ival in a
+    LazyAlignment, found when it is created; iterating over it gives
+    the aligned intervals, as for an NLMSA slice.
+    """
+
+    def __init__(self, alignment, ival):
+        self.alignment = alignment
+        self.ival = ival
+        seq = ival.pathForward
+        if ival.orientation < 0:
+            start, stop = -ival.stop, -ival.start
+        else:
+            start, stop = ival.start, ival.stop
+
+        self._edges = []
+        for src, dest, side in alignment.find_ivals(seq.id, start, stop):
+            if side == 0:
+                destSeq = alignment.destDB[dest[0]]
+            else:
+                destSeq = alignment.srcDB[dest[0]]
+            srcIval = nlmsa_utils.get_interval(seq, src[1], src[2], 1)
+            destIval = nlmsa_utils.get_interval(destSeq, dest[1], dest[2],
+                                                dest[3])
+            if ival.orientation < 0:
+                srcIval, destIval = -srcIval, -destIval
+            self._edges.append((srcIval, destIval, None))
+
+    def __len__(self):
+        return len(self._edges)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        """
+        Returns the intervals aligned to the interval
+        """
+        return [ dest for (src, dest, edge) in self._edges ]
+
+    def edges(self):
+        """
+        Returns the (src, dest, None) tuples of the aligned intervals:
+        src is the part of the interval aligned to dest
+        """
+        return list(self._edges)
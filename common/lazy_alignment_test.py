@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pygr import sequence
+import input_utils
+import lazy_alignment
+import offset_index
+
+def build_blocks_index(path):
+    """
+    Index a file of "name1 start1 stop1 ori1 name2 start2 stop2 ori2"
+    lines, one record of one block per line
+    """
+    compression = input_utils.get_compression(path)
+    index = offset_index.RecordIndex()
+    ifile = open(path, 'rb')
+    lines = list(offset_index.iter_line_offsets(ifile, compression))
+    ifile.close()
+    stops = [ offset for (offset, line) in lines[1:] ]
+    stops.append(offset_index.get_end_offset(path, compression))
+    for (offset, line), stop in zip(lines, stops):
+        ival1, ival2 = read_blocks([line], None, None)[0]
+        index.add(offset, stop, ival1, ival2)
+    return index
+
+def read_blocks(lines, ival1, ival2):
+    ivals = []
+    for line in lines:
+        fields = line.split()
+        ivals.append(((fields[0],) + tuple(map(int, fields[1:4])),
+                      (fields[4],) + tuple(map(int, fields[5:8]))))
+    return ivals
+
+def revcomp(s):
+    return str(-sequence.Sequence(s, 'r'))
+
+class Lazy_alignment_test(unittest.TestCase):
+    """
+    Test the slices of a LazyAlignment: the records read, the clipping
+    of their blocks in both orientations, and the record cache.
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, 'blocks')
+        a = 'ACGTTGCAAGGCTTAACCGGATATCCGAGT' * 2
+        # b holds a[0:20] and a[20:40] reversed, c a[30:60] protein-like
+        # 3 letters per letter of a
+        self.db = dict(a=sequence.Sequence(a, 'a'),
+                       b=sequence.Sequence(revcomp(a[0:20]) +
+                                           a[20:40] + revcomp(a[20:40]), 'b'),
+                       c=sequence.Sequence('N' * 90, 'c'))
+        self.lines = [ 'a 0 20 1 b 0 20 -1\n', 'a 20 40 -1 b 40 60 1\n',
+                       'a 20 40 1 b 20 40 1\n', 'a 30 60 1 c 0 90 1\n' ]
+        ofile = open(self.path, 'wb')
+        ofile.write(''.join(self.lines))
+        ofile.close()
+        self.index = offset_index.load_index(self.path, build_blocks_index,
+                                             offset_index.RecordIndex)
+        self.al = lazy_alignment.LazyAlignment(self.path, self.index,
+                                               read_blocks, self.db)
+
+    def tearDown(self):
+        self.al.close()
+        shutil.rmtree(self.tempDir)
+
+    def test_record_index(self):
+        self.assertEqual(len(self.al), 4)
+        self.assert_(os.path.exists(self.path + '.rix'))
+        saved = offset_index.read_index(self.path + '.rix',
+                                        offset_index.RecordIndex)
+        self.assertEqual([ saved.get_ivals(i) for i in range(0, 4) ],
+                         [ read_blocks([line], None, None)[0]
+                           for line in self.lines ])
+        self.assertEqual(saved.get_range(1), (19, 40))
+
+        # the sorted intervals of the records are read back as they are
+        built = build_blocks_index(self.path).get_intervals()
+        self.assertEqual(sorted(saved.intervals.keys()), ['a', 'b', 'c'])
+        for key in ('a', 'b', 'c'):
+            self.assertEqual(saved.intervals.bins[key], built.bins[key])
+            self.assertEqual(list(saved.intervals.values[key]),
+                             list(built.values[key]))
+        self.assertEqual(saved.intervals.find_overlaps('b', 15, 25), [1, 5])
+        self.assertRaises(AssertionError, offset_index.read_index,
+                          self.path + '.rix', offset_index.OffsetIndex)
+
+    def test_slice(self):
+        """
+        Each interval aligned to a part of a holds the same letters as it,
+        whatever the orientation of the blocks and of the query
+        """
+        a = self.db['a']
+        for ival in (a[5:15], a[15:25], a[0:40], -a[12:33]):
+            edges = self.al[ival].edges()
+            for src, dest, edge in edges:
+                if dest.pathForward.id != 'c':
+                    self.assertEqual(str(src), str(dest))
+            self.assertEqual(self.al[ival].keys(),
+                             [ dest for (src, dest, edge) in edges ])
+        self.assertEqual([ repr(s) for s in self.al[a[5:15]] ],
+                         ['-b[5:15]'])
+        self.assertEqual([ repr(s) for s in self.al[a[25:35]] ],
+                         ['b[25:35]', '-b[45:55]', 'c[0:15]'])
+        self.assertEqual([ repr(s) for s in self.al[a[50:60]] ],
+                         ['c[60:90]'])
+        self.assertEqual(len(self.al[a[40:50]]), 1)
+
+        # the other sequence, and no block
+        b = self.db['b']
+        self.assertEqual([ (repr(src), repr(dest)) for (src, dest, edge)
+                           in self.al[b[10:30]].edges() ],
+                         [('b[10:20]', '-a[0:10]'), ('b[20:30]', 'a[20:30]')])
+        self.assertEqual(len(self.al[self.db['c'][0:3]]), 1)
+        self.assertEqual(len(self.al[sequence.Sequence('ACGT', 'd')]), 0)
+
+    def test_cache(self):
+        """
+        Only the records overlapping a slice are parsed, once while they
+        are cached
+        """
+        a = self.db['a']
+        self.assertEqual(self.al.nParsed, 0)
+        self.al[a[0:5]]
+        self.assertEqual(self.al.nParsed, 1)
+        self.al[a[0:10]]
+        self.assertEqual(self.al.nParsed, 1)
+        self.al[a[0:40]]
+        self.assertEqual(self.al.nParsed, 4)
+
+        al = lazy_alignment.LazyAlignment(self.path, self.index, read_blocks,
+                                          self.db, cacheSize=1)
+        try:
+            al[a[0:5]]
+            al[a[50:55]]
+            al[a[0:5]]
+            self.assertEqual(al.nParsed, 3)
+        finally:
+            al.close()
+
+    def test_bgzf(self):
+        """
+        The records of a BGZF compressed file are read through their
+        virtual offsets
+        """
+        path = os.path.join(self.tempDir, 'blocks.bgz')
+        input_utils.write_bgzf(path, ''.join(self.lines), 7)
+        index = offset_index.load_index(path, build_blocks_index,
+                                        offset_index.RecordIndex)
+        al = lazy_alignment.LazyAlignment(path, index, read_blocks, self.db)
+        try:
+            a = self.db['a']
+            self.assertEqual([ repr(s) for s in al[a] ],
+                             [ repr(s) for s in self.al[a] ])
+        finally:
+            al.close()
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Lazy_alignment_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
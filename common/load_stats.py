@@ -0,0 +1,267 @@
+# ! /usr/bin/env python2.5
+
+"""
+LOAD_STATS MODULE
+=================
+A module shared by the create_NLMSA_* functions of the loaders that
+measures where the time of a load goes. The create_NLMSA_* functions
+accept an instrumentation object (instrument) and report the stages of
+the load to it; without one they do no measuring at all. The module
+defines the following classes:
+
+- `LoadStats`, an instrumentation object collecting, for each stage,
+  the wall clock and CPU seconds, the number of calls, the number of
+  records or intervals handled and the peak memory, and printing them
+  as a summary table
+- `StageStats`, the measures of one stage
+
+Functions:
+
+- `iter_stage()`: yield the items of an iterable, reporting the time
+  spent getting each of them as a stage
+- `call_stage()`: call a function, reporting its time as a stage
+
+Constants:
+
+- `STAGES`: the stages reported by the loaders, in load order: parse
+  (reading the alignment records), ivals (extracting the aligned
+  intervals), convert (looking the intervals' sequences up with
+  CoordsToIntervals), add (add_aligned_intervals()) and build
+  (al.build())
+
+An instrumentation object has two methods: start(stage), called when a
+stage starts, and stop(stage, count), called when it stops with the
+number of records or intervals it handled. Stages nest, e.g. the parse
+stage runs within the ivals stage as the records are read lazily;
+LoadStats charges each moment to the innermost stage only, so the
+stages add up to the time of the load.
+
+
+How To Use This Module
+======================
+
+1. Make the ``common`` directory importable and import it:
+   ``import load_stats``.
+
+2. Pass a LoadStats to a create_NLMSA_* function and print its table:
+   ``stats = load_stats.LoadStats()``
+   ``nlmsa_aln = create_NLMSA_blastz(buf, seqDb, al, instrument=stats)``
+   ``stats.print_report()``
+
+   The peak memory is the peak resident set size of the process at the
+   end of each stage, and also the peak of the traced Python
+   allocations if tracemalloc is tracing.
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+STAGES = ('parse', 'ivals', 'convert', 'add', 'build')
+
+def _get_times():
+    """
+    Returns the wall clock and CPU (user + system) seconds
+    """
+    times = os.times()
+    return time.time(), times[0] + times[1]
+
+def _get_maxrss():
+    """
+    Returns the peak resident set size of the process in kB, or None
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024                 # bytes, not kB
+    return maxrss
+
+def _get_traced_peak():
+    """
+    Returns the peak of the traced Python allocations in bytes, or None
+    if tracemalloc is not tracing
+    """
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.get_traced_memory()[1]
+
+class StageStats(object):
+    """
+    The measures of a stage of a load.
+    wall, cpu - the wall clock and CPU seconds spent in the stage
+    calls - the number of times the stage ran
+    count - the number of records or intervals it handled
+    maxrss - the peak resident set size of the process in kB
+    tracedPeak - the peak of the traced Python allocations in bytes
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.
+        self.cpu = 0.
+        self.calls = 0
+        self.count = 0
+        self.maxrss = None
+        self.tracedPeak = None
+
+    def __repr__(self):
+        return '<StageStats %s: %d calls, %d counted, %.3f s>' % \
+               (self.name, self.calls, self.count, self.wall)
+
+class LoadStats(object):
+    """
+    An instrumentation object collecting StageStats for the stages
+    reported to it, charging nested stages' time to the innermost one.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.order = []         # the stage names, as they first started
+        self._running = []      # [name, wall, cpu] of the started stages
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+    def get_stage(self, name):
+        """
+        Returns the StageStats of stage name, creating it if needed
+        """
+        try:
+            return self.stages[name]
+        except KeyError:
+            stage = self.stages[name] = StageStats(name)
+            self.order.append(name)
+            return stage
+
+    def _charge(self, running, wall, cpu):
+        """
+        Add the time since running was started or resumed to its stage
+        """
+        stage = self.get_stage(running[0])
+        stage.wall += wall - running[1]
+        stage.cpu += cpu - running[2]
+
+    def start(self, name):
+        """
+        Start stage name, pausing the stage running, if any
+        """
+        wall, cpu = _get_times()
+        if self._running:
+            self._charge(self._running[-1], wall, cpu)
+        self._running.append([name, wall, cpu])
+
+    def stop(self, name, count=0):
+        """
+        Stop stage name, which handled count records or intervals, and
+        resume the stage it paused, if any
+        """
+        wall, cpu = _get_times()
+        running = self._running.pop()
+        assert running[0] == name, "stage %s stopped while %s runs" % \
+               (name, running[0])
+        self._charge(running, wall, cpu)
+
+        stage = self.get_stage(name)
+        stage.calls += 1
+        stage.count += count
+        stage.maxrss = max(stage.maxrss, _get_maxrss())
+        stage.tracedPeak = max(stage.tracedPeak, _get_traced_peak())
+
+        if self._running:
+            self._running[-1][1:] = [wall, cpu]
+
+    def get_stages(self):
+        """
+        Returns the StageStats of the stages, in the order of STAGES,
+        followed by any other stage in the order they first started
+        """
+        names = [ name for name in STAGES if name in self.stages ]
+        names += [ name for name in self.order if name not in STAGES ]
+        return [ self.stages[name] for name in names ]
+
+    def report(self):
+        """
+        Returns the measures of the stages as a table, with a total line
+        """
+        lines = ['%-8s %8s %10s %10s %10s %10s %12s'
+                 % ('stage', 'calls', 'count', 'wall (s)', 'cpu (s)',
+                    'rss (kB)', 'traced (kB)')]
+        wall = cpu = 0.
+        for stage in self.get_stages():
+            maxrss = tracedPeak = '-'
+            if stage.maxrss is not None:
+                maxrss = '%d' % stage.maxrss
+            if stage.tracedPeak is not None:
+                tracedPeak = '%d' % (stage.tracedPeak // 1024)
+            lines.append('%-8s %8d %10d %10.3f %10.3f %10s %12s'
+                         % (stage.name, stage.calls, stage.count,
+                            stage.wall, stage.cpu, maxrss, tracedPeak))
+            wall += stage.wall
+            cpu += stage.cpu
+        lines.append('%-8s %8s %10s %10.3f %10.3f' % ('total', '', '',
+                                                      wall, cpu))
+        return '\n'.join(lines)
+
+    def print_report(self, ofile=None):
+        """
+        Write the table of report() to ofile (default sys.stderr)
+        """
+        if ofile is None:
+            ofile = sys.stderr
+        ofile.write(self.report() + '\n')
+
+def iter_stage(iterable, instrument, name, count=None):
+    """
+    Returns an iterator over the items of iterable, reporting the time
+    taken to get each of them to instrument as stage name, with a count
+    of count(item), or of 1 if count is None. If instrument is None,
+    iterable is returned as is.
+    """
+    if instrument is None:
+        return iterable
+    return _iter_stage(iterable, instrument, name, count)
+
+def _iter_stage(iterable, instrument, name, count):
+    it = iter(iterable)
+    while True:
+        instrument.start(name)
+        try:
+            item = it.next()
+        except StopIteration:
+            instrument.stop(name, 0)
+            return
+        except:
+            instrument.stop(name, 0)
+            raise
+        if count is None:
+            instrument.stop(name, 1)
+        else:
+            instrument.stop(name, count(item))
+        yield item
+
+def call_stage(instrument, name, func, *args):
+    """
+    Returns func(*args), reporting the time it took to instrument as
+    stage name, unless instrument is None
+    """
+    if instrument is None:
+        return func(*args)
+    instrument.start(name)
+    try:
+        return func(*args)
+    finally:
+        instrument.stop(name, 0)
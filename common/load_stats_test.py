@@ -0,0 +1,57 @@
+import unittest
+from cStringIO import StringIO
+import load_stats
+
+class Load_stats_test(unittest.TestCase):
+    """
+    Test that the stages are counted, that nested stages are charged to
+    the innermost one only, and that nothing is measured without an
+    instrument.
+    """
+
+    def test_stages(self):
+        stats = load_stats.LoadStats()
+        items = load_stats.iter_stage([[1, 2], [3]], stats, 'ivals', len)
+        self.assertEqual(list(items), [[1, 2], [3]])
+        self.assertEqual(load_stats.call_stage(stats, 'build', max, 1, 2), 2)
+        self.assertEqual(stats['ivals'].calls, 3)
+        self.assertEqual(stats['ivals'].count, 3)
+        self.assertEqual(stats['build'].calls, 1)
+
+        stats.start('other')
+        stats.stop('other', 5)
+        self.assertEqual([ stage.name for stage in stats.get_stages() ],
+                         ['ivals', 'build', 'other'])
+        report = StringIO()
+        stats.print_report(report)
+        self.assertEqual(len(report.getvalue().splitlines()), 5)
+
+    def test_nested(self):
+        stats = load_stats.LoadStats()
+        stats.start('ivals')
+        for i in range(0, 3):
+            stats.start('parse')
+            sum(xrange(200000))
+            stats.stop('parse', 1)
+        stats.stop('ivals', 1)
+        self.assert_(stats['parse'].wall > stats['ivals'].wall)
+        self.assertEqual(stats['parse'].count, 3)
+
+        stats.start('parse')
+        self.assertRaises(AssertionError, stats.stop, 'ivals')
+
+    def test_no_instrument(self):
+        items = [[1], [2]]
+        self.assert_(load_stats.iter_stage(items, None, 'ivals') is items)
+        self.assertEqual(load_stats.call_stage(None, 'build', max, 1, 2), 2)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Load_stats_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,412 @@
+# ! /usr/bin/env python2.5
+
+"""
+LOADER_UTILS MODULE
+===================
+A module shared by the create_NLMSA_* functions of the loaders that adds
+the aligned intervals to an NLMSA in batches. The module defines the
+following class:
+
+- `BulkLoader`, gathers ivals into batches and adds each batch to the
+  NLMSA through a single, reused CoordsToIntervals converter
+- `LRUCache`, a dictionary keeping only its most recently used items
+- `SeqNameResolver`, looks sequence names up in a sequence database,
+  resolving each distinct name only once per load
+- `IvalColumns`, a batch of ivals held as columns of integers, which a
+  BulkLoader adds without building a tuple per ival
+
+Constants:
+
+- `IVALS_ATTRS`: the alignedIvalsAttrs of (name, start, stop) ivals
+- `ORIENTED_IVALS_ATTRS`: the alignedIvalsAttrs of
+  (name, start, stop, ori) ivals
+- `BATCH_SIZE`: the default number of ivals per batch
+- `CACHE_SIZE`: the default number of recently used sequences kept by a
+  SeqNameResolver
+
+
+How To Use This Module
+======================
+
+1. Make the ``common`` directory importable and import it:
+   ``import loader_utils``.
+
+2. Create a loader for the NLMSA, pass it the ivals lists as they are
+   built, and close it before building the NLMSA:
+   ``loader = loader_utils.BulkLoader(al, seqDb)``
+   ``for ivals in build_blastz_ivals(buf, seqDb):``
+   ``    loader.add(ivals)``
+   ``loader.close()``
+   ``al.build()``
+
+   Batches are limited to batchSize ivals (default `BATCH_SIZE`), or to
+   roughly batchBytes bytes of ivals if that is given. After close(),
+   the loader's nIntervals, seconds and get_rate() give the number of
+   intervals added and how fast they were added; with verbose=True
+   this is also written to stderr.
+
+3. The loader resolves the sequence names of the ivals through a
+   SeqNameResolver, which keeps the cacheSize most recently used
+   sequences (default `CACHE_SIZE`). Names passed as seqNames, e.g. the
+   names returned by parse_blat(), are resolved up front and kept for
+   the whole load.
+   ``loader = loader_utils.BulkLoader(al, seqDb, seqNames=names)``
+
+4. Batches of ivals read as columns, e.g. from a cache_utils.IvalsCache,
+   are passed to add() as IvalColumns; their intervals are made
+   straight from the columns for add_aligned_intervals(), with no ivals
+   tuples and no CoordsToIntervals in between.
+   ``loader.add(loader_utils.IvalColumns(columns, names, oriented=True))``
+
+5. To see how the time of a load splits between looking the sequences
+   up and adding the intervals, pass a load_stats.LoadStats as
+   instrument; each batch is then converted to intervals (the convert
+   stage) before it is added (the add stage).
+   ``loader = loader_utils.BulkLoader(al, seqDb, instrument=stats)``
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+import sys
+import time
+from pygr import nlmsa_utils
+
+IVALS_ATTRS = dict(id=0, start=1, stop=2, idDest=0, startDest=1, stopDest=2)
+ORIENTED_IVALS_ATTRS = dict(id=0, start=1, stop=2, idDest=0, startDest=1,
+                            stopDest=2, ori=3, oriDest=3)
+BATCH_SIZE = 100000
+CACHE_SIZE = 10000
+
+def _ival_size(ival):
+    """
+    Estimate the number of bytes taken by an ival and the tuples and
+    values it contains.
+    """
+    size = sys.getsizeof(ival)
+    if isinstance(ival, tuple):
+        for item in ival:
+            size += _ival_size(item)
+    return size
+
+class LRUCache(object):
+    """
+    A dictionary that keeps only its maxSize most recently used items.
+    The items are kept in a circular doubly linked list of
+    [previous, next, key, value] links, most recent first.
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.links = {}
+        self.root = root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def __getitem__(self, key):
+        link = self.links[key]             # KeyError if not found
+        self._move_to_front(link)
+        return link[3]
+
+    def __setitem__(self, key, value):
+        try:
+            link = self.links[key]
+        except KeyError:
+            if self.maxSize < 1:
+                return
+            if len(self.links) >= self.maxSize:    # drop the oldest item
+                oldest = self.root[0]
+                self._unlink(oldest)
+                del self.links[oldest[2]]
+            link = [self.root, self.root[1], key, value]
+            self.root[1][0] = link
+            self.root[1] = link
+            self.links[key] = link
+        else:
+            link[3] = value
+            self._move_to_front(link)
+
+    def _unlink(self, link):
+        previous, after = link[0], link[1]
+        previous[1] = after
+        after[0] = previous
+
+    def _move_to_front(self, link):
+        self._unlink(link)
+        link[0] = self.root
+        link[1] = self.root[1]
+        self.root[1][0] = link
+        self.root[1] = link
+
+class SeqNameResolver(object):
+    """
+    Looks sequence names up in a sequence database, resolving each
+    distinct name only once: pre-resolved names are kept for the life
+    of the resolver, the others in a cache of the cacheSize most
+    recently used sequences.
+    """
+
+    def __init__(self, seqDb, cacheSize=CACHE_SIZE, seqNames=()):
+        self.seqDb = seqDb
+        self.resolved = {}
+        self.cache = LRUCache(cacheSize)
+        self.nLookups = 0
+        self.preload(seqNames)
+
+    def preload(self, seqNames):
+        """
+        Resolve the given names now and keep them; the names that are not
+        in the database are skipped
+        """
+        for name in seqNames:
+            if name not in self.resolved:
+                try:
+                    self.resolved[name] = self._lookup(name)
+                except KeyError:
+                    pass
+
+    def _lookup(self, name):
+        self.nLookups += 1
+        return self.seqDb[name]
+
+    def __getitem__(self, name):
+        try:
+            return self.resolved[name]
+        except KeyError:
+            pass
+        try:
+            return self.cache[name]
+        except KeyError:
+            seq = self.cache[name] = self._lookup(name)
+            return seq
+
+class IvalColumns(object):
+    """
+    A batch of ivals held as eight columns, arrays or lists of integers:
+    src_id, src_start, src_stop, src_ori, dest_id, dest_start, dest_stop
+    and dest_ori, the IDs indexing the list of sequence names names.
+    Iterating over it gives the ivals tuples of its rows,
+    (name, start, stop, ori) ones if oriented is True.
+    """
+
+    def __init__(self, columns, names, oriented=False):
+        self.columns = columns
+        self.names = names
+        self.oriented = oriented
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __iter__(self):
+        names = self.names
+        (src_id, src_start, src_stop, src_ori, dest_id, dest_start,
+         dest_stop, dest_ori) = [ column.tolist() for column in self.columns ]
+        for i in range(0, len(src_id)):
+            if self.oriented:
+                yield ((names[src_id[i]], src_start[i], src_stop[i],
+                        src_ori[i]),
+                       (names[dest_id[i]], dest_start[i], dest_stop[i],
+                        dest_ori[i]))
+            else:
+                yield ((names[src_id[i]], src_start[i], src_stop[i]),
+                       (names[dest_id[i]], dest_start[i], dest_stop[i]))
+
+class BulkLoader(object):
+    """
+    Gathers ivals into batches and adds each batch to an NLMSA with
+    add_aligned_intervals(), converting them to intervals with a
+    single CoordsToIntervals whose sequence names are resolved through
+    SeqNameResolvers.
+    """
+
+    def __init__(self, al, srcDB, destDB=None, alignedIvalsAttrs=IVALS_ATTRS,
+                 batchSize=None, batchBytes=None, verbose=False,
+                 cacheSize=CACHE_SIZE, seqNames=None, instrument=None):
+        self.al = al
+        self.instrument = instrument
+        if seqNames is None:
+            seqNames = ()
+        seqNames = list(seqNames)       # read once, for both resolvers
+        self.srcResolver = SeqNameResolver(srcDB, cacheSize)
+        if destDB is None or destDB is srcDB:
+            self.destResolver = self.srcResolver
+        else:
+            self.destResolver = SeqNameResolver(destDB, cacheSize)
+
+        # the names may belong to either database
+        self.srcResolver.preload(seqNames)
+        if self.destResolver is not self.srcResolver:
+            self.destResolver.preload(seqNames)
+
+        self.cti = nlmsa_utils.CoordsToIntervals(self.srcResolver,
+                                                 self.destResolver,
+                                                 alignedIvalsAttrs)
+        if batchSize is None and batchBytes is None:
+            batchSize = BATCH_SIZE
+        self.batchSize = batchSize
+        self.batchBytes = batchBytes
+        self.verbose = verbose
+
+        self.batch = []
+        if batchBytes is None:
+            self.batchLimit = batchSize
+        else:
+            self.batchLimit = None     # set from the size of the first ival
+        self.nIntervals = 0
+        self.nBatches = 0
+        self.seconds = 0.
+
+    def add(self, ivals):
+        """
+        Add a list of ivals, adding a batch of batchLimit ivals to the
+        NLMSA each time the batch gets full; IvalColumns are added with
+        add_columns()
+        """
+        if isinstance(ivals, IvalColumns):
+            self.add_columns(ivals)
+            return
+        self.batch.extend(ivals)
+        if self.batchLimit is None:
+            if not self.batch:
+                return
+            self._set_batch_limit(self.batch[0])
+        batch = self.batch
+        limit = self.batchLimit
+        i = 0
+        while len(batch) - i >= limit:
+            self._add_batch(batch[i:i + limit])
+            i += limit
+        if i:
+            self.batch = batch[i:]
+
+    def add_columns(self, columns):
+        """
+        Add the ivals of an IvalColumns to the NLMSA, in batches of
+        batchLimit ivals, making their intervals straight from the
+        columns; the ivals added before are added first
+        """
+        if not len(columns):
+            return
+        self.flush()
+        if self.batchLimit is None:
+            self._set_batch_limit(iter(columns).next())
+        limit = self.batchLimit
+        for start in range(0, len(columns), limit):
+            stop = min(start + limit, len(columns))
+            self._add_intervals(lambda: self._iter_column_intervals(
+                columns, start, stop), stop - start)
+
+    def _iter_column_intervals(self, columns, start, stop):
+        """
+        Yield the (src, dest) intervals of rows start to stop of an
+        IvalColumns, looking each of its sequence IDs up once
+        """
+        names = columns.names
+        (src_id, src_start, src_stop, src_ori, dest_id, dest_start,
+         dest_stop, dest_ori) = [ column[start:stop].tolist()
+                                  for column in columns.columns ]
+        srcSeqs = {}
+        destSeqs = {}
+        get_interval = nlmsa_utils.get_interval
+        for i in range(0, stop - start):
+            try:
+                srcSeq = srcSeqs[src_id[i]]
+            except KeyError:
+                srcSeq = srcSeqs[src_id[i]] = \
+                         self.srcResolver[names[src_id[i]]]
+            try:
+                destSeq = destSeqs[dest_id[i]]
+            except KeyError:
+                destSeq = destSeqs[dest_id[i]] = \
+                          self.destResolver[names[dest_id[i]]]
+            yield (get_interval(srcSeq, src_start[i], src_stop[i],
+                                src_ori[i]),
+                   get_interval(destSeq, dest_start[i], dest_stop[i],
+                                dest_ori[i]))
+
+    def _set_batch_limit(self, ival):
+        """
+        Turn batchBytes into a number of ivals, from the size of ival,
+        the first one added
+        """
+        limit = max(1, self.batchBytes // _ival_size(ival))
+        if self.batchSize is not None:
+            limit = min(limit, self.batchSize)
+        self.batchLimit = limit
+
+    def flush(self):
+        """
+        Add the ivals of the current batch to the NLMSA
+        """
+        if not self.batch:
+            return
+        self._add_batch(self.batch)
+        self.batch = []
+
+    def _add_batch(self, batch):
+        """
+        Add a batch of ivals to the NLMSA
+        """
+        self._add_intervals(lambda: self.cti(batch), len(batch))
+
+    def _add_intervals(self, get_intervals, n):
+        """
+        Add the n (src, dest) intervals returned by get_intervals() to
+        the NLMSA as a batch
+        """
+        t = time.time()
+        if self.instrument is None:
+            self.al.add_aligned_intervals(get_intervals())
+        else:
+            self._add_intervals_instrumented(get_intervals, n)
+        self.seconds += time.time() - t
+
+        self.nIntervals += n
+        self.nBatches += 1
+
+    def _add_intervals_instrumented(self, get_intervals, n):
+        """
+        Add the n intervals returned by get_intervals() to the NLMSA,
+        reporting their conversion to intervals and their addition to
+        the instrument as the convert and add stages
+        """
+        instrument = self.instrument
+        instrument.start('convert')
+        try:
+            intervals = list(get_intervals())
+        finally:
+            instrument.stop('convert', n)
+
+        instrument.start('add')
+        try:
+            self.al.add_aligned_intervals(intervals)
+        finally:
+            instrument.stop('add', n)
+
+    def close(self):
+        """
+        Add the remaining ivals; reports the rate if verbose
+        """
+        self.flush()
+        if self.verbose:
+            sys.stderr.write(self.report() + '\n')
+
+    def get_rate(self):
+        """
+        Returns the number of intervals added per second
+        """
+        if not self.seconds:
+            return 0.
+        return self.nIntervals / self.seconds
+
+    def report(self):
+        """
+        Returns a one-line summary of the intervals added
+        """
+        return '%d intervals in %d batches, %.2f s (%.0f intervals/s)' % \
+               (self.nIntervals, self.nBatches, self.seconds, self.get_rate())
@@ -0,0 +1,219 @@
+import unittest
+from array import array
+from pygr import sequence
+import loader_utils
+
+class RecordingNLMSA(object):
+    """
+    Records the batches of intervals it is given
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def add_aligned_intervals(self, alignedIvals):
+        self.batches.append(list(alignedIvals))
+
+class CountingDict(dict):
+    """
+    Counts the lookups made in a sequence database
+    """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.nLookups = 0
+
+    def __getitem__(self, k):
+        self.nLookups += 1
+        return dict.__getitem__(self, k)
+
+class FreshSeqDict(object):
+    """
+    Returns a new sequence object on each lookup, and counts them
+    """
+
+    def __init__(self):
+        self.nLookups = 0
+
+    def __getitem__(self, k):
+        self.nLookups += 1
+        return sequence.Sequence('ACGT', k)
+
+class LRUCache_test(unittest.TestCase):
+
+    def test_lru(self):
+        cache = loader_utils.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache['a'], 1)
+        cache['c'] = 3                  # drops 'b', the least recently used
+        self.assertEqual(len(cache), 2)
+        self.assertFalse('b' in cache)
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+        cache['a'] = 4
+        cache['d'] = 5                  # drops 'c'
+        self.assertEqual(sorted(cache.links.keys()), ['a', 'd'])
+        self.assertEqual(cache['a'], 4)
+
+    def test_no_cache(self):
+        cache = loader_utils.LRUCache(0)
+        cache['a'] = 1
+        self.assertEqual(len(cache), 0)
+
+class SeqNameResolver_test(unittest.TestCase):
+
+    def setUp(self):
+        self.db = CountingDict([ ('seq%d' % i,
+                                  sequence.Sequence('ACGT', 'seq%d' % i))
+                                 for i in range(0, 10) ])
+
+    def test_resolve_once(self):
+        resolver = loader_utils.SeqNameResolver(self.db)
+        for i in range(0, 5):
+            for name in ('seq1', 'seq2', 'seq1'):
+                self.assertTrue(resolver[name] is self.db[name])
+        self.assertEqual(resolver.nLookups, 2)
+        self.assertRaises(KeyError, resolver.__getitem__, 'unknown')
+
+    def test_preload(self):
+        resolver = loader_utils.SeqNameResolver(self.db, cacheSize=1,
+                                                seqNames=['seq1', 'seq2'])
+        self.assertEqual(self.db.nLookups, 2)
+        for name in ('seq1', 'seq2', 'seq3', 'seq4', 'seq1', 'seq2'):
+            resolver[name]
+        self.assertEqual(self.db.nLookups, 4)
+
+        # names missing from the database are skipped
+        resolver.preload(['seq5', 'unknown', 'seq5'])
+        self.assertEqual(self.db.nLookups, 6)
+        self.assertTrue('unknown' not in resolver.resolved)
+        self.assertTrue(resolver['seq5'] is self.db['seq5'])
+
+    def test_cache_size(self):
+        """
+        Only the most recent sequences are kept
+        """
+        db = FreshSeqDict()
+        resolver = loader_utils.SeqNameResolver(db, cacheSize=2)
+        for name in ('seq0', 'seq1', 'seq2', 'seq2', 'seq1'):
+            resolver[name]
+        self.assertEqual(db.nLookups, 3)
+        resolver['seq0']
+        self.assertEqual(db.nLookups, 4)
+
+class BulkLoader_test(unittest.TestCase):
+
+    def setUp(self):
+        self.db = dict(seq1=sequence.Sequence('ACGT' * 25, 'seq1'),
+                       seq2=sequence.Sequence('TTGCA' * 20, 'seq2'))
+        self.ivals = [ (('seq1', i, i + 5), ('seq2', i, i + 5))
+                       for i in range(0, 50) ]
+
+    def test_batch_size(self):
+        al = RecordingNLMSA()
+        loader = loader_utils.BulkLoader(al, self.db, batchSize=20)
+        for i in range(0, 50, 10):
+            loader.add(self.ivals[i:i+10])
+        loader.close()
+
+        self.assertEqual([len(batch) for batch in al.batches], [20, 20, 10])
+        self.assertEqual(loader.nIntervals, 50)
+        self.assertEqual(loader.nBatches, 3)
+        src, dest = al.batches[-1][-1]
+        self.assertEqual(repr(src), 'seq1[49:54]')
+        self.assertEqual(repr(dest), 'seq2[49:54]')
+
+        # a list longer than a batch is split into full batches
+        al = RecordingNLMSA()
+        loader = loader_utils.BulkLoader(al, self.db, batchSize=15)
+        loader.add(self.ivals[0:10])
+        loader.add(self.ivals[10:50])
+        loader.close()
+        self.assertEqual([len(batch) for batch in al.batches],
+                         [15, 15, 15, 5])
+        self.assertEqual([ repr(batch[0][0]) for batch in al.batches ],
+                         ['seq1[0:5]', 'seq1[15:20]', 'seq1[30:35]',
+                          'seq1[45:50]'])
+
+    def test_batch_bytes(self):
+        al = RecordingNLMSA()
+        ival_bytes = loader_utils._ival_size(self.ivals[0])
+        loader = loader_utils.BulkLoader(al, self.db,
+                                         batchBytes=25 * ival_bytes)
+        loader.add(self.ivals)
+        loader.close()
+
+        self.assertEqual(loader.batchLimit, 25)
+        self.assertEqual([len(batch) for batch in al.batches], [25, 25])
+
+    def test_oriented(self):
+        al = RecordingNLMSA()
+        loader = loader_utils.BulkLoader(al, self.db, self.db,
+                                         loader_utils.ORIENTED_IVALS_ATTRS)
+        loader.add([(('seq1', 0, 10, 1), ('seq2', 10, 20, -1))])
+        loader.close()
+
+        src, dest = al.batches[0][0]
+        self.assertEqual(dest.orientation, -1)
+        self.assertEqual(str(dest), str(-self.db['seq2'][10:20]))
+        self.assertTrue(loader.report().startswith('1 intervals in 1 batches'))
+
+    def test_seq_names(self):
+        """
+        The names, even given by a generator, are preloaded by both
+        resolvers, each keeping the names of its own database
+        """
+        srcDB = CountingDict(seq1=self.db['seq1'])
+        destDB = CountingDict(seq2=self.db['seq2'])
+        loader = loader_utils.BulkLoader(RecordingNLMSA(), srcDB, destDB,
+                                         seqNames=iter(['seq1', 'seq2']))
+        self.assertEqual(loader.srcResolver.resolved.keys(), ['seq1'])
+        self.assertEqual(loader.destResolver.resolved.keys(), ['seq2'])
+        self.assertEqual((srcDB.nLookups, destDB.nLookups), (2, 2))
+
+    def test_columns(self):
+        """
+        IvalColumns are added in batches straight from their columns,
+        after the ivals added before them
+        """
+        # seq1[i:i+5] aligned to the reverse of seq2[i:i+5]
+        columns = [ [0] * 50, range(0, 50), range(5, 55), [1] * 50,
+                    [1] * 50, range(0, 50), range(5, 55), [-1] * 50 ]
+        batch = loader_utils.IvalColumns([ array('l', column)
+                                           for column in columns ],
+                                         ['seq1', 'seq2'], oriented=True)
+        self.assertEqual(len(batch), 50)
+        self.assertEqual(list(batch)[1],
+                         (('seq1', 1, 6, 1), ('seq2', 1, 6, -1)))
+
+        al = RecordingNLMSA()
+        loader = loader_utils.BulkLoader(al, self.db, batchSize=20)
+        loader.add(self.ivals[0:5])
+        loader.add(batch)
+        loader.close()
+        self.assertEqual([len(b) for b in al.batches], [5, 20, 20, 10])
+        self.assertEqual(loader.nIntervals, 55)
+        src, dest = al.batches[-1][-1]
+        self.assertEqual(repr(src), 'seq1[49:54]')
+        self.assertEqual(str(dest), str(-self.db['seq2'][49:54]))
+
+    def test_resolve_once(self):
+        al = RecordingNLMSA()
+        db = CountingDict(self.db)
+        loader = loader_utils.BulkLoader(al, db, batchSize=7)
+        loader.add(self.ivals)
+        loader.close()
+        self.assertEqual(db.nLookups, 2)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(LRUCache_test))
+    suite.addTest(unittest.makeSuite(SeqNameResolver_test))
+    suite.addTest(unittest.makeSuite(BulkLoader_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
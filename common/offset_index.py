@@ -0,0 +1,488 @@
+# ! /usr/bin/env python2.5
+
+"""
+OFFSET_INDEX MODULE
+===================
+A module shared by the blat and blastz loaders that indexes the records
+of an alignment file by their sequence names, in a sidecar file stored
+next to it, so that the records of a few sequences are read without
+reading the rest of the file. The module defines the following
+classes:
+
+- `OffsetIndex`, the byte ranges of the records of a file with the pair
+  of sequence names and the orientation of each range
+- `RecordIndex`, the byte range of each record of a file with the
+  interval it covers on each of its sequences, for the queries of a
+  lazy_alignment.LazyAlignment
+
+Functions:
+
+- `get_index_path()`: the path of a sidecar index file of a file
+- `read_index()`: read an index file
+- `load_index()`: return an index of a file, from its sidecar file if
+  it is up to date, else from the format's index builder, saving it
+- `get_fingerprint()`: identify the records of some sequences of a file
+  by the file's size, modification time and index entries
+- `iter_line_offsets()`: read the lines of a file with their offsets
+- `iter_range_lines()`: read the lines of a range of a file
+- `get_end_offset()`: the offset of the end of a file
+
+The ranges are byte offsets in a plain file, and BGZF virtual offsets
+(the block offset shifted left by 16 bits, plus the offset in the
+block, see parallel_utils.iter_bgzf_lines()) in a BGZF compressed file;
+a gzip file cannot be read from the middle and is not indexed.
+
+In an OffsetIndex, consecutive records of the same sequence pair share
+one range, so the index of a file sorted by sequence holds a few ranges
+per sequence. An index file holds a header, with the size and
+modification time of the indexed file, the table of sequence names and
+int64 values in native byte order. An OffsetIndex file (<file>.oix)
+holds its ranges grouped by name ID: a table of the first row of each
+name, then the rows of the ranges of each name in file order, each row
+being the start, stop, name1_id, name2_id and orient of a range, under
+both of its names if they differ; reading it reads the header, the
+names and the table only, and the rows of the names asked for are read
+from the file when they are asked for. A RecordIndex file (<file>.rix)
+holds the columns start, stop, name1_id, start1, stop1, ori1, name2_id,
+start2, stop2 and ori2, then the intervals the records cover grouped by
+name ID: a table of the first interval of each name, and the starts,
+the stops and the values (2 * record + side) of the intervals, sorted
+as in an interval_index.IntervalIndex, which is read back from them
+without sorting them or looping over the records. An index whose file
+has changed size or modification time since, or written in an older
+layout, is rebuilt.
+
+
+How To Use This Module
+======================
+
+1. Make the ``common`` directory importable and import it:
+   ``import offset_index``.
+
+2. Get the index of a file from the format's builder, a function taking
+   the path of the file and returning its OffsetIndex, and read the
+   lines of the records of some sequences:
+   ``index = offset_index.load_index('output.psl', build_blat_index)``
+   ``for start, stop, name1, name2, orient in index.get_entries(names):``
+   ``    lines = offset_index.iter_range_lines(ifile, start, stop, None)``
+
+3. To cache what is read from the records of some sequences, key it by
+   their fingerprint rather than by a hash of the whole file:
+   ``fingerprint = offset_index.get_fingerprint(index, names)``
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+import os
+import struct
+import tempfile
+from array import array
+
+try:
+    import hashlib
+    _new_hash = hashlib.sha1
+except ImportError:
+    import sha
+    _new_hash = sha.new
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import block_store
+import interval_index
+import parallel_utils
+
+MAGIC = 'PYGROIX2'
+HEADER = '8sqqqqq'      # magic, size, mtime, n_entries, n_names, names_len
+HEADER_SIZE = struct.calcsize(HEADER)
+SUFFIX = '.oix'
+
+if array('l').itemsize == 8:
+    _INT64 = 'l'
+else:
+    _INT64 = 'q'
+
+def get_index_path(path, suffix=SUFFIX):
+    """
+    Returns the path of the sidecar index file of the file at path with
+    the given suffix
+    """
+    return path + suffix
+
+def _get_stat(path):
+    st = os.stat(path)
+    return st.st_size, int(st.st_mtime)
+
+class _ColumnIndex(object):
+    """
+    Int64 columns describing the records of an alignment file, with a
+    table of the sequence names they hold the IDs of; size and mtime
+    are those of the indexed file. Subclasses set the magic string and
+    the suffix of their index files and their number of columns.
+    """
+    magic = None
+    suffix = None
+    nColumns = 0
+
+    def __init__(self, size=0, mtime=0):
+        self.size = size
+        self.mtime = mtime
+        self.names = block_store.NameTable()
+        self.columns = [ array(_INT64) for k in range(0, self.nColumns) ]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def get_names(self):
+        """
+        Returns the names of the sequences of the records
+        """
+        return list(self.names.names)
+
+    def is_current(self, path):
+        """
+        Returns True if the file at path has the size and modification
+        time of the indexed file
+        """
+        return (self.size, self.mtime) == _get_stat(path)
+
+    def save(self, path):
+        """
+        Write the index to path, through a temp file renamed into place
+        """
+        names_blob = '\n'.join(self.names.names)
+        header = struct.pack(HEADER, self.magic, self.size, self.mtime,
+                             len(self), len(self.names), len(names_blob))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                        suffix='.tmp')
+        ofile = os.fdopen(fd, 'wb')
+        try:
+            try:
+                ofile.write(header)
+                ofile.write(names_blob)
+                self._write_body(ofile)
+            finally:
+                ofile.close()
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+    def _write_body(self, ofile):
+        for column in self.columns:
+            column.tofile(ofile)
+
+    def _read_body(self, ifile, n_entries):
+        for column in self.columns:
+            column.fromfile(ifile, n_entries)
+
+class OffsetIndex(_ColumnIndex):
+    """
+    The byte ranges of the records of an alignment file, each with the
+    names of its two sequences and its orientation (0 if the records
+    give their own). A built index holds its ranges as columns, in file
+    order; an index read from its file holds the table of the rows of
+    each name only, and reads the rows of a name when asked for them.
+    """
+    magic = MAGIC
+    suffix = SUFFIX
+    nColumns = 5
+
+    def __init__(self, size=0, mtime=0):
+        _ColumnIndex.__init__(self, size, mtime)
+        self.nameOffsets = None # the first row of each name ID, and the end
+        self.rows = None        # the rows grouped by name ID, if in memory
+        self.path = None        # else the index file and the offset of the
+        self.rowsOffset = 0     # rows in it
+        self.nEntries = 0
+
+    def __len__(self):
+        if self.path is not None:
+            return self.nEntries
+        return len(self.columns[0])
+
+    def add(self, start, stop, name1, name2, orient=0):
+        """
+        Add the range start to stop of records of name1 and name2,
+        merging it with the last range if it follows it for the same
+        sequences and orientation
+        """
+        starts, stops, ids1, ids2, orients = self.columns
+        id1 = self.names.get_id(name1)
+        id2 = self.names.get_id(name2)
+        if starts and stops[-1] == start and ids1[-1] == id1 and \
+           ids2[-1] == id2 and orients[-1] == orient:
+            stops[-1] = stop
+            return
+        for column, value in zip(self.columns,
+                                 (start, stop, id1, id2, orient)):
+            column.append(value)
+        self.nameOffsets = self.rows = None
+
+    def _group_rows(self):
+        """
+        Group the rows of the built index by name ID
+        """
+        starts, stops, ids1, ids2, orients = self.columns
+        groups = [ [] for k in range(0, len(self.names)) ]
+        for i in range(0, len(starts)):
+            groups[ids1[i]].append(i)
+            if ids2[i] != ids1[i]:
+                groups[ids2[i]].append(i)
+        self.nameOffsets = array(_INT64, [0])
+        self.rows = array(_INT64)
+        for group in groups:
+            for i in group:
+                self.rows.extend((starts[i], stops[i], ids1[i], ids2[i],
+                                  orients[i]))
+            self.nameOffsets.append(len(self.rows) // self.nColumns)
+
+    def _write_body(self, ofile):
+        if self.rows is None:
+            self._group_rows()
+        self.nameOffsets.tofile(ofile)
+        self.rows.tofile(ofile)
+
+    def _read_body(self, ifile, n_entries):
+        self.nameOffsets = array(_INT64)
+        self.nameOffsets.fromfile(ifile, len(self.names) + 1)
+        self.path = ifile.name
+        self.rowsOffset = ifile.tell()
+        self.nEntries = n_entries
+
+    def _read_name_rows(self, ifile, nameId):
+        """
+        Returns the rows of name ID nameId, as a flat array
+        """
+        start = self.nameOffsets[nameId] * self.nColumns
+        stop = self.nameOffsets[nameId + 1] * self.nColumns
+        if self.rows is not None:
+            return self.rows[start:stop]
+        rows = array(_INT64)
+        ifile.seek(self.rowsOffset + start * rows.itemsize)
+        rows.fromfile(ifile, stop - start)
+        return rows
+
+    def get_entries(self, names):
+        """
+        Returns the (start, stop, name1, name2, orient) ranges of the
+        records of any of the sequences names, in file order; only the
+        rows of these names are read
+        """
+        if self.path is None and self.rows is None:
+            self._group_rows()
+        nameIds = set([ self.names.ids[name] for name in names
+                        if name in self.names.ids ])
+        if not nameIds:
+            return []
+
+        entries = set()         # a range is listed under both its names
+        ifile = None
+        if self.rows is None:
+            ifile = open(self.path, 'rb')
+        try:
+            for nameId in nameIds:
+                rows = self._read_name_rows(ifile, nameId)
+                for i in range(0, len(rows), self.nColumns):
+                    entries.add(tuple(rows[i:i + self.nColumns]))
+        finally:
+            if ifile is not None:
+                ifile.close()
+        entries = list(entries)
+        entries.sort()
+        return [ (start, stop, self.names[id1], self.names[id2], orient)
+                 for (start, stop, id1, id2, orient) in entries ]
+
+class RecordIndex(_ColumnIndex):
+    """
+    The byte range of each record of an alignment file, with the
+    (name, start, stop, ori) interval it covers on each of its two
+    sequences, in the coordinates of its ivals, and these intervals in
+    an interval_index.IntervalIndex keyed by name, the value of each
+    being 2 * record + side, side 0 or 1 as name is the first or second
+    sequence of the record.
+    """
+    magic = 'PYGRRIX2'
+    suffix = '.rix'
+    nColumns = 10
+
+    def __init__(self, size=0, mtime=0):
+        _ColumnIndex.__init__(self, size, mtime)
+        self.intervals = None
+
+    def add(self, start, stop, ival1, ival2):
+        """
+        Add the record in the range start to stop, covering ival1 and
+        ival2, two (name, start, stop, ori) tuples
+        """
+        name1, start1, stop1, ori1 = ival1
+        name2, start2, stop2, ori2 = ival2
+        values = (start, stop, self.names.get_id(name1), start1, stop1, ori1,
+                  self.names.get_id(name2), start2, stop2, ori2)
+        for column, value in zip(self.columns, values):
+            column.append(value)
+        self.intervals = None
+
+    def get_intervals(self):
+        """
+        Returns the interval_index.IntervalIndex of the intervals covered
+        by the records, built if it was not read from the index file
+        """
+        if self.intervals is None:
+            self.intervals = interval_index.IntervalIndex()
+            columns = self.columns
+            for i in range(0, len(self)):
+                self.intervals.add(self.names[columns[2][i]], columns[3][i],
+                                   columns[4][i], 2 * i)
+                self.intervals.add(self.names[columns[6][i]], columns[7][i],
+                                   columns[8][i], 2 * i + 1)
+            self.intervals.build()
+        return self.intervals
+
+    def _write_body(self, ofile):
+        _ColumnIndex._write_body(self, ofile)
+        intervals = self.get_intervals()
+        names = self.names.names
+        nameOffsets = array(_INT64, [0])
+        for name in names:
+            nameOffsets.append(nameOffsets[-1] +
+                               len(intervals.starts.get(name, ())))
+        nameOffsets.tofile(ofile)
+        for column in (intervals.starts, intervals.stops, intervals.values):
+            for name in names:
+                if name in column:
+                    interval_index._as_array(column[name]).tofile(ofile)
+
+    def _read_body(self, ifile, n_entries):
+        _ColumnIndex._read_body(self, ifile, n_entries)
+        nameOffsets = array(_INT64)
+        nameOffsets.fromfile(ifile, len(self.names) + 1)
+        n = nameOffsets[-1]
+        data = ifile.read(3 * n * nameOffsets.itemsize)
+        if numpy is not None:
+            values = numpy.frombuffer(data, dtype=numpy.int64)
+        else:
+            values = array(_INT64, data)
+        self.intervals = interval_index.IntervalIndex()
+        for k, name in enumerate(self.names.names):
+            first, end = nameOffsets[k], nameOffsets[k + 1]
+            if first < end:
+                self.intervals.set_sorted(name, values[first:end],
+                                          values[n + first:n + end],
+                                          values[2 * n + first:2 * n + end])
+
+    def get_range(self, i):
+        """
+        Returns the start and stop of the range of record i
+        """
+        return self.columns[0][i], self.columns[1][i]
+
+    def get_ivals(self, i):
+        """
+        Returns the two (name, start, stop, ori) intervals covered by
+        record i
+        """
+        columns = self.columns
+        return ((self.names[columns[2][i]], columns[3][i], columns[4][i],
+                 columns[5][i]),
+                (self.names[columns[6][i]], columns[7][i], columns[8][i],
+                 columns[9][i]))
+
+def read_index(path, indexClass=OffsetIndex):
+    """
+    Returns the index, of class indexClass, of the index file at path
+    """
+    ifile = open(path, 'rb')
+    try:
+        (magic, size, mtime, n_entries, n_names,
+         names_len) = struct.unpack(HEADER, ifile.read(HEADER_SIZE))
+        assert magic == indexClass.magic, \
+               "%s is not a %s file" % (path, indexClass.__name__)
+        index = indexClass(size, mtime)
+        if n_names:
+            for name in ifile.read(names_len).split('\n'):
+                index.names.get_id(name)
+        index._read_body(ifile, n_entries)
+    finally:
+        ifile.close()
+    return index
+
+def _read_magic(path):
+    ifile = open(path, 'rb')
+    try:
+        return ifile.read(len(MAGIC))
+    finally:
+        ifile.close()
+
+def load_index(path, build, indexClass=OffsetIndex):
+    """
+    Returns the index, of class indexClass, of the file at path: read
+    from its sidecar index file if the file has not changed since, or
+    else built by build(path) and saved to the sidecar file, if its
+    directory is writable
+    """
+    indexPath = get_index_path(path, indexClass.suffix)
+    if os.path.exists(indexPath) and \
+       _read_magic(indexPath) == indexClass.magic:
+        index = read_index(indexPath, indexClass)
+        if index.is_current(path):
+            return index
+
+    index = build(path)
+    index.size, index.mtime = _get_stat(path)
+    try:
+        index.save(indexPath)
+    except (IOError, OSError):
+        pass                    # used once, from memory
+    return index
+
+def get_fingerprint(index, names):
+    """
+    Returns a string identifying the records of the sequences names in
+    the file of index, an OffsetIndex: the size and modification time
+    of the file and a hash of the index entries of these names, read
+    from the sidecar file rather than the whole file
+    """
+    h = _new_hash(repr(index.get_entries(names)))
+    return '%d:%d:oix:%s' % (index.size, index.mtime, h.hexdigest())
+
+def get_end_offset(path, compression):
+    """
+    Returns the offset of the end of the file at path, compressed as
+    given by input_utils.get_compression()
+    """
+    if compression == 'bgzf':
+        return os.path.getsize(path) << 16
+    return os.path.getsize(path)
+
+def iter_line_offsets(ifile, compression):
+    """
+    Yield the (offset, line) pairs of the lines of the file object
+    ifile, compressed as given by input_utils.get_compression()
+    """
+    assert compression != 'gzip', \
+           "a gzip file cannot be indexed, compress it with BGZF instead"
+    if compression == 'bgzf':
+        for (offset, pos), line in parallel_utils.iter_bgzf_lines(
+                ifile, offsets=True):
+            yield (offset << 16) | pos, line
+        return
+
+    offset = 0
+    for line in ifile:
+        yield offset, line
+        offset += len(line)
+
+def iter_range_lines(ifile, start, stop, compression):
+    """
+    Yield the lines of the file object ifile, compressed as given by
+    input_utils.get_compression(), that start in the range start to stop
+    """
+    if compression == 'bgzf':
+        return parallel_utils.iter_bgzf_lines(ifile,
+                                              (start >> 16, start & 0xffff),
+                                              (stop >> 16, stop & 0xffff))
+    return parallel_utils.iter_lines(ifile, start, stop)
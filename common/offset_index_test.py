@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+import input_utils
+import offset_index
+
+def build_pairs_index(path):
+    """
+    Index a file of "name1 name2" lines, one record per line
+    """
+    compression = input_utils.get_compression(path)
+    index = offset_index.OffsetIndex()
+    ifile = open(path, 'rb')
+    lines = list(offset_index.iter_line_offsets(ifile, compression))
+    ifile.close()
+    stops = [ offset for (offset, line) in lines[1:] ]
+    stops.append(offset_index.get_end_offset(path, compression))
+    for (offset, line), stop in zip(lines, stops):
+        name1, name2 = line.split()
+        index.add(offset, stop, name1, name2)
+    return index
+
+class Offset_index_test(unittest.TestCase):
+    """
+    Test the indexing of the records of a file by sequence names, the
+    sidecar index file, and the reading of the records of some names.
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, 'pairs')
+        self.lines = [ 'chr1 chr2\n', 'chr1 chr2\n', 'chr3 chr1\n',
+                       'chr2 chr4\n', 'chr1 chr2\n' ]
+        ofile = open(self.path, 'wb')
+        ofile.write(''.join(self.lines))
+        ofile.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def read_names(self, path, index, names):
+        compression = input_utils.get_compression(path)
+        ifile = open(path, 'rb')
+        lines = []
+        for start, stop, name1, name2, orient in index.get_entries(names):
+            lines.extend(offset_index.iter_range_lines(ifile, start, stop,
+                                                       compression))
+        ifile.close()
+        return lines
+
+    def test_index(self):
+        index = build_pairs_index(self.path)
+        self.assertEqual(len(index), 4)         # the first two are merged
+        self.assertEqual(index.get_names(), ['chr1', 'chr2', 'chr3', 'chr4'])
+        self.assertEqual(index.get_entries(['chr4', 'chr3']),
+                         [(20, 30, 'chr3', 'chr1', 0),
+                          (30, 40, 'chr2', 'chr4', 0)])
+        self.assertEqual(index.get_entries(['chr5']), [])
+        self.assertEqual(self.read_names(self.path, index, ['chr2']),
+                         self.lines[0:2] + self.lines[3:5])
+
+        bgzfPath = self.path + '.bgz'
+        input_utils.write_bgzf(bgzfPath, ''.join(self.lines), 7)
+        index = build_pairs_index(bgzfPath)
+        self.assertEqual(self.read_names(bgzfPath, index, ['chr3', 'chr4']),
+                         self.lines[2:4])
+
+    def test_load_index(self):
+        builds = []
+        def build(path):
+            builds.append(path)
+            return build_pairs_index(path)
+
+        index = offset_index.load_index(self.path, build)
+        indexPath = offset_index.get_index_path(self.path)
+        self.assert_(os.path.exists(indexPath))
+        saved = offset_index.load_index(self.path, build)
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(len(saved), len(index))
+        self.assertEqual(saved.get_names(), index.get_names())
+        self.assertEqual(saved.rows, None)      # read by name when asked
+        self.assertEqual(list(saved.nameOffsets), [0, 3, 6, 7, 8])
+        for names in (['chr1'], ['chr3'], ['chr2', 'chr4'], ['chr5'],
+                      index.get_names()):
+            self.assertEqual(saved.get_entries(names),
+                             index.get_entries(names))
+        self.assertEqual(offset_index.get_fingerprint(saved, ['chr3']),
+                         offset_index.get_fingerprint(index, ['chr3']))
+        self.assertNotEqual(offset_index.get_fingerprint(saved, ['chr3']),
+                            offset_index.get_fingerprint(saved, ['chr4']))
+
+        # an index file of an older layout is rebuilt
+        data = open(indexPath, 'rb').read()
+        open(indexPath, 'wb').write('PYGROIX1' + data[8:])
+        offset_index.load_index(self.path, build)
+        self.assertEqual(len(builds), 2)
+
+        # a changed file is indexed again
+        ofile = open(self.path, 'ab')
+        ofile.write('chr5 chr1\n')
+        ofile.close()
+        index = offset_index.load_index(self.path, build)
+        self.assertEqual(len(builds), 3)
+        self.assertEqual(self.read_names(self.path, index, ['chr5']),
+                         ['chr5 chr1\n'])
+
+        self.assertRaises(AssertionError, offset_index.iter_line_offsets(
+            None, 'gzip').next)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Offset_index_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
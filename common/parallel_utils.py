@@ -0,0 +1,202 @@
+# ! /usr/bin/env python2.5
+
+"""
+PARALLEL_UTILS MODULE
+=====================
+A module shared by the loaders that parse their input in several worker
+processes. The module does not define any class.
+
+Functions:
+
+- `split_lines()`: split a file into byte ranges that start and end on
+  line boundaries
+- `iter_lines()`: read the lines of one such byte range
+- `split_bgzf_lines()`: split a BGZF compressed file into ranges of
+  virtual offsets that start on line boundaries
+- `iter_bgzf_lines()`: read the lines of one such range
+- `imap()`: apply a function to a sequence of arguments in a pool of
+  worker processes, yielding the results in the order of the arguments
+
+The worker processes need the multiprocessing module (Python 2.6 and
+later); without it, or with processes=1, imap() runs the function in
+the calling process, so the results are always the same.
+
+A position in a BGZF file (see input_utils) is given by a virtual
+offset, the pair of the byte offset of a block in the file and of an
+offset in the decompressed data of the block. A worker reading a range
+of a BGZF file seeks straight to its first block and decompresses the
+blocks of the range only, plus the next one if a line runs over.
+
+
+How To Use This Module
+======================
+
+1. Make the ``common`` directory importable and import it:
+   ``import parallel_utils``.
+
+2. Split the file into shards, and parse each shard in a worker with a
+   module-level function that opens the file and reads its lines:
+   ``shards = parallel_utils.split_lines(path, 16, start=header_size)``
+   ``args = [ (path, start, stop) for (start, stop) in shards ]``
+   ``for result in parallel_utils.imap(parse_shard, args, 4):``
+   ``    ...``
+
+   A BGZF file is split and read the same way, with split_bgzf_lines()
+   and iter_bgzf_lines().
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+import os
+
+import input_utils
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+SHARDS_PER_PROCESS = 4
+
+def split_lines(path, nShards, start=0):
+    """
+    Split the file at path, from byte start to its end, into at most
+    nShards (start, stop) byte ranges of similar size, each starting at
+    the beginning of a line and ending after a newline (or at the end of
+    the file).
+    """
+    size = os.path.getsize(path)
+    bounds = [start]
+
+    ifile = open(path, 'rb')
+    try:
+        for i in range(1, nShards):
+            pos = start + (size - start) * i // nShards
+            if pos <= bounds[-1]:
+                continue
+            # move to the start of the line following byte pos - 1
+            ifile.seek(pos - 1)
+            ifile.readline()
+            pos = ifile.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+    finally:
+        ifile.close()
+
+    if size > start:
+        bounds.append(size)
+    return zip(bounds[:-1], bounds[1:])
+
+def iter_lines(ifile, start, stop):
+    """
+    Yield the lines of the file object ifile that start in the byte
+    range start to stop.
+    """
+    ifile.seek(start)
+    pos = start
+    while pos < stop:
+        line = ifile.readline()
+        if not line:
+            break
+        pos += len(line)
+        yield line
+
+def split_bgzf_lines(path, nShards, start=(0, 0)):
+    """
+    Split the BGZF file at path, from virtual offset start to its end,
+    into at most nShards (start, stop) ranges of virtual offsets with
+    similar numbers of blocks, each starting at the beginning of a line;
+    the stop of the last range is None, for the end of the file.
+    """
+    bounds = [start]
+
+    ifile = open(path, 'rb')
+    try:
+        offsets = input_utils.get_bgzf_offsets(ifile, start[0])
+        if not offsets:
+            return []
+        for i in range(1, nShards):
+            offset = offsets[len(offsets) * i // nShards]
+            if offset <= bounds[-1][0]:
+                continue
+            # move to the start of the first line starting in the block
+            data = input_utils.read_bgzf_block(ifile, offset)[0]
+            pos = data.find('\n')
+            if pos >= 0:
+                bounds.append((offset, pos + 1))
+    finally:
+        ifile.close()
+
+    bounds.append(None)
+    return zip(bounds[:-1], bounds[1:])
+
+def iter_bgzf_lines(ifile, start=(0, 0), stop=None, offsets=False):
+    """
+    Yield the lines of the BGZF file object ifile that start between the
+    virtual offsets start and stop (None for the end of the file), or
+    (virtual offset, line) pairs if offsets is True.
+    """
+    partial = None      # the virtual offset and pieces of a line running
+                        # over the end of a block
+    for offset, data in input_utils.iter_bgzf_blocks(ifile, start[0]):
+        pos = 0
+        if offset == start[0]:
+            pos = start[1]
+        if partial is not None:
+            end = data.find('\n') + 1
+            if not end:
+                partial[1].append(data)
+                continue
+            partial[1].append(data[:end])
+            line = ''.join(partial[1])
+            if offsets:
+                line = partial[0], line
+            yield line
+            partial = None
+            pos = end
+        while pos < len(data):
+            if stop is not None and (offset, pos) >= stop:
+                return
+            end = data.find('\n', pos) + 1
+            if not end:
+                partial = ((offset, pos), [data[pos:]])
+                break
+            if offsets:
+                yield (offset, pos), data[pos:end]
+            else:
+                yield data[pos:end]
+            pos = end
+
+    if partial is not None:
+        line = ''.join(partial[1])
+        if offsets:
+            line = partial[0], line
+        yield line
+
+def imap(func, args, processes=None, initializer=None, initargs=(),
+         chunksize=1):
+    """
+    Yield func(arg) for each arg of args, in order, computing them in a
+    pool of processes worker processes. func must be a module-level
+    function and args and the results must be picklable.
+    initializer(*initargs) is called once in each worker (or in this
+    process if no workers are used), e.g. to hand every worker the data
+    shared by all the calls only once; args are sent to the workers in
+    chunks of chunksize.
+    """
+    if processes is None or processes <= 1 or multiprocessing is None:
+        if initializer is not None:
+            initializer(*initargs)
+        for arg in args:
+            yield func(arg)
+        return
+
+    pool = multiprocessing.Pool(processes, initializer, initargs)
+    try:
+        for result in pool.imap(func, args, chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+import input_utils
+import parallel_utils
+
+def square(x):
+    return x * x
+
+class Parallel_utils_test(unittest.TestCase):
+    """
+    Test the splitting of a file, plain or BGZF compressed, into
+    line-aligned ranges and the ordered worker pool.
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, 'lines')
+        self.lines = [ 'header\n' ] + [ 'line %d %s\n' % (i, 'x' * (i % 7))
+                                       for i in range(0, 50) ]
+        ofile = open(self.path, 'wb')
+        ofile.write(''.join(self.lines))
+        ofile.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def read_shards(self, shards):
+        lines = []
+        ifile = open(self.path, 'rb')
+        for start, stop in shards:
+            lines.extend(parallel_utils.iter_lines(ifile, start, stop))
+        ifile.close()
+        return lines
+
+    def test_split_lines(self):
+        header_size = len(self.lines[0])
+        for nShards in (1, 2, 7, 50, 200):
+            shards = parallel_utils.split_lines(self.path, nShards,
+                                                header_size)
+            self.assertTrue(len(shards) <= nShards)
+            self.assertEqual(shards[0][0], header_size)
+            self.assertEqual(shards[-1][1], os.path.getsize(self.path))
+            for i in range(1, len(shards)):
+                self.assertEqual(shards[i-1][1], shards[i][0])
+            self.assertEqual(self.read_shards(shards), self.lines[1:])
+
+        self.assertEqual(parallel_utils.split_lines(self.path, 4,
+                         os.path.getsize(self.path)), [])
+
+    def test_split_bgzf_lines(self):
+        path = os.path.join(self.tempDir, 'lines.bgz')
+        input_utils.write_bgzf(path, ''.join(self.lines), 20)
+        ifile = open(path, 'rb')
+        try:
+            offsets = list(parallel_utils.iter_bgzf_lines(ifile,
+                                                          offsets=True))
+            self.assertEqual([ line for (offset, line) in offsets ],
+                             self.lines)
+            header_size = offsets[1][0]
+            for nShards in (1, 2, 7, 50, 200):
+                shards = parallel_utils.split_bgzf_lines(path, nShards,
+                                                         header_size)
+                self.assertTrue(len(shards) <= nShards)
+                self.assertEqual(shards[0][0], header_size)
+                self.assertEqual(shards[-1][1], None)
+                lines = []
+                for i, (start, stop) in enumerate(shards):
+                    if i:
+                        self.assertEqual(shards[i-1][1], start)
+                    lines.extend(parallel_utils.iter_bgzf_lines(ifile, start,
+                                                                stop))
+                self.assertEqual(lines, self.lines[1:])
+        finally:
+            ifile.close()
+
+    def test_imap(self):
+        expected = [ x * x for x in range(0, 20) ]
+        for processes in (None, 1, 3):
+            self.assertEqual(list(parallel_utils.imap(square, range(0, 20),
+                                                      processes)),
+                             expected)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Parallel_utils_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,88 @@
+# ! /usr/bin/env python2.5
+
+"""
+RECORD_FILTER MODULE
+====================
+A module shared by the blastz and blat loaders that filters alignment
+records while they are parsed, so records that fail are rejected before
+any alignment or block objects are created for them. The module defines
+the following class:
+
+- `RecordFilter`, the cutoffs a record must pass: minimum score, minimum
+  ungapped block length, minimum number of matches, minimum identity and
+  maximum number of gaps
+
+Each format module computes the values it checks from its own record
+fields, cheapest first, so a record rejected on its score costs little
+more than reading its score.
+
+
+How To Use This Module
+======================
+
+1. Make the ``common`` directory importable and import it:
+   ``import record_filter``.
+
+2. Create a filter with the cutoffs you want (the others are not
+   checked) and pass it to the parse functions or the create_NLMSA_*
+   functions of blastz and blat:
+   ``recordFilter = record_filter.RecordFilter(minScore=3000,``
+   ``                                          minIdentity=90)``
+   ``nlmsa_aln = create_NLMSA_blastz(buf, seqDb, al,``
+   ``                                recordFilter=recordFilter)``
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+class RecordFilter(object):
+    """
+    The cutoffs an alignment record must pass to be kept. A cutoff of
+    None is not checked.
+    minScore - the minimum alignment score
+    minBlockLength - the minimum length of the longest ungapped block
+    minMatches - the minimum number of matching residues
+    minIdentity - the minimum percent identity, matches * 100 /
+    (matches + mismatches)
+    maxGaps - the maximum number of gaps (insertions in either sequence)
+    """
+
+    def __init__(self, minScore=None, minBlockLength=None, minMatches=None,
+                 minIdentity=None, maxGaps=None):
+        self.minScore = minScore
+        self.minBlockLength = minBlockLength
+        self.minMatches = minMatches
+        self.minIdentity = minIdentity
+        self.maxGaps = maxGaps
+
+    def __repr__(self):
+        return 'RecordFilter(minScore=%r, minBlockLength=%r, ' \
+               'minMatches=%r, minIdentity=%r, maxGaps=%r)' % \
+               (self.minScore, self.minBlockLength, self.minMatches,
+                self.minIdentity, self.maxGaps)
+
+    def checks_matches(self):
+        """
+        Returns True if the matches or identity are checked
+        """
+        return self.minMatches is not None or self.minIdentity is not None
+
+    def accept_score(self, score):
+        return self.minScore is None or score >= self.minScore
+
+    def accept_gaps(self, gaps):
+        return self.maxGaps is None or gaps <= self.maxGaps
+
+    def accept_block_lengths(self, blockLengths):
+        if self.minBlockLength is None:
+            return True
+        return bool(blockLengths) and max(blockLengths) >= self.minBlockLength
+
+    def accept_matches(self, matches, misMatches):
+        if self.minMatches is not None and matches < self.minMatches:
+            return False
+        if self.minIdentity is not None:
+            aligned = matches + misMatches
+            if not aligned or 100. * matches / aligned < self.minIdentity:
+                return False
+        return True
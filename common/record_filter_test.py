@@ -0,0 +1,51 @@
+import unittest
+import record_filter
+
+class Record_filter_test(unittest.TestCase):
+    """
+    Test the cutoffs of a RecordFilter.
+    """
+
+    def test_no_cutoffs(self):
+        recordFilter = record_filter.RecordFilter()
+        self.assertFalse(recordFilter.checks_matches())
+        self.assertTrue(recordFilter.accept_score(-10))
+        self.assertTrue(recordFilter.accept_gaps(1000))
+        self.assertTrue(recordFilter.accept_block_lengths([]))
+        self.assertTrue(recordFilter.accept_matches(0, 0))
+
+    def test_cutoffs(self):
+        recordFilter = record_filter.RecordFilter(minScore=10,
+                                                  minBlockLength=5,
+                                                  minMatches=8,
+                                                  minIdentity=80,
+                                                  maxGaps=2)
+        self.assertTrue(recordFilter.checks_matches())
+        self.assertTrue(recordFilter.accept_score(10))
+        self.assertFalse(recordFilter.accept_score(9))
+        self.assertTrue(recordFilter.accept_gaps(2))
+        self.assertFalse(recordFilter.accept_gaps(3))
+        self.assertTrue(recordFilter.accept_block_lengths([1, 5]))
+        self.assertFalse(recordFilter.accept_block_lengths([4, 4]))
+        self.assertFalse(recordFilter.accept_block_lengths([]))
+        self.assertTrue(recordFilter.accept_matches(8, 2))
+        self.assertFalse(recordFilter.accept_matches(8, 3))   # 72.7%
+        self.assertFalse(recordFilter.accept_matches(7, 0))
+        self.assertFalse(recordFilter.accept_matches(0, 0))
+
+    def test_repr(self):
+        self.assertEqual(repr(record_filter.RecordFilter(minScore=10)),
+                         repr(record_filter.RecordFilter(minScore=10)))
+        self.assertNotEqual(repr(record_filter.RecordFilter(minScore=10)),
+                            repr(record_filter.RecordFilter(maxGaps=10)))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Record_filter_test))
+    return suite
+
+
+if __name__=="__main__":
+    # unittest.main()
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -13,11 +13,13 @@ builds pygr NLMSAs with it. The module does not define any class.
 Functions:
 
 - `read_lagan()`: read aligned sequences from a lagan alignment file
-  buffer
+  object or buffer
 - `build_interval_list()`: extract all ungapped aligned subintervals from
-  a pair of aligned sequences
+  a pair of aligned sequences (imported from common/interval_utils.py)
 - `build_lagan_ivals()`: takes a lagan alignment file buffer as input and
   builds the ivals
+- `iter_ival_batches()`: takes a lagan alignment file buffer as input and
+  yields the ivals as structured NumPy arrays
 - `create_NLMSA_lagan()`: takes buffer of a lagan alignment file,
   sequence db and NLMSA  as input and returns NLMSA
   
@@ -35,78 +37,50 @@ How To Use This Module
    function returns the modified/built NLMSA.
    ``nlmsa_aln = create_NLMSA_lagan(buf, seqDb, al)``
 
+   buf may also be an open file object, read line by line, or the path
+   of the file, which is then memory-mapped and read the same way:
+   ``nlmsa_aln = create_NLMSA_lagan('output', seqDb, al)``
+   A gzip or BGZF compressed file, path or buffer is decompressed as it
+   is read.
+
 """
 
 __docformat__ = 'restructuredtext'
 
+import os
+import sys
 from pygr import cnestedlist, nlmsa_utils, seqdb
 
-def read_lagan(buf):
-    """
-    Read aligned sequences from a lagan alignment file buffer
-    """
-    
-    assert buf[0].startswith('>'), "This doesn't look like fasta file"
-
-    # Extracting the sequence and names from lagan output
-    index1 = buf.find('>')
-    index2 = buf.find('\n')
-    index3 = buf.find('>', index1+1)
-    index4 = buf.find('\n', index3)
-    seqInfo1 = buf[index1+1:index2]
-    seqInfo2 = buf[index3+1:index4]
-    buf = buf[1:]
-    buf = buf.replace(seqInfo1,'')
-    buf = buf.replace(seqInfo2,'')
-    buf = buf.replace('\n','')
-    seq_List = buf.split('>')
-    seqName1 = seqInfo1.split()[0]
-    seqName2 = seqInfo2.split()[0]
-    
-    return seq_List, (seqName1, seqName2)
+# the code shared by the loaders lives in common/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, 'common'))
+from aligned_fasta import read_aligned_fasta
+from interval_utils import build_interval_arrays, build_interval_list
+import cache_utils
+import input_utils
+import ival_arrays
+import load_stats
+import loader_utils
 
-def build_interval_list(a, b):
+def read_lagan(buf):
     """
-    Hacky code to extract all ungapped aligned subintervals from a
-    pair of aligned sequences.
+    Read aligned sequences from a lagan alignment file object or buffer
+    in a single pass (see aligned_fasta.read_aligned_fasta())
     """
-    interval_list = []
-
-    a_start = None
-    b_start = None
+    seq_List, seqNames = read_aligned_fasta(buf)
+    assert len(seqNames) >= 2, "a lagan alignment has two sequences"
 
-    a_count = b_count = 0
-    for i in range(0, len(a)):
-        if a[i] == '-' or b[i] == '-':
-            if a_start is not None:           # want to end at i-1
-                interval_list.append((a_start, a_count, b_start, b_count))
+    return seq_List, (seqNames[0], seqNames[1])
 
-                a_start = b_start = None
-        else:
-            if a_start is None:
-                a_start = a_count
-                b_start = b_count
-
-        if a[i] != '-':
-            a_count += 1
-        if b[i] != '-':
-            b_count += 1
-
-    if a_start is not None:
-        interval_list.append((a_start, a_count, b_start, b_count))
-
-    assert a_count == len(a.replace('-', ''))
-    assert b_count == len(b.replace('-', ''))
-        
-    return interval_list
-
-def build_lagan_ivals(buf, seqDb):
+def build_lagan_ivals(buf, seqDb, instrument=None):
     """
     Takes a lagan alignment file buffer and sequence db as input and
-    builds the ivals
+    builds the ivals; the reading of the aligned sequences is reported
+    to instrument, if given, as the parse stage
     """
     
-    seqList, seqNames = read_lagan(buf)
+    seqList, seqNames = load_stats.call_stage(instrument, 'parse',
+                                              read_lagan, buf)
 
     # Extract ungapped intervals
     interval_list = build_interval_list(seqList[0], seqList[1])
@@ -118,18 +92,53 @@ def build_lagan_ivals(buf, seqDb):
     
     yield ivals
 
-def create_NLMSA_lagan(buf, seqDb,al):
+def iter_ival_batches(buf, batchSize=ival_arrays.BATCH_SIZE):
+    """
+    Takes a lagan alignment file buffer as input and yields its ivals
+    as (batch, names) pairs: batch is a structured array of
+    ival_arrays.IVAL_DTYPE with up to batchSize rows, holding the same
+    intervals as build_lagan_ivals(), and names the NameTable of its
+    sequence IDs.
+    """
+    seqList, seqNames = read_lagan(buf)
+    builder = ival_arrays.IvalBatchBuilder(batchSize)
+    id1 = builder.get_id(seqNames[0])
+    id2 = builder.get_id(seqNames[1])
+
+    interval_arrays = build_interval_arrays(seqList[0], seqList[1])
+    for k in range(0, len(interval_arrays[0]), batchSize):
+        builder.add_interval_arrays(id1, 0, id2, 0,
+                                    [ column[k:k+batchSize]
+                                      for column in interval_arrays ])
+        yield builder.pop(), builder.names
+
+def create_NLMSA_lagan(buf, seqDb, al, cache=None, instrument=None,
+                       **kwargs):
     """
     Takes a lagan alignment file buffer as input and creates and
     returns NLMSA
+    cache - a cache_utils.IvalsCache holding the ivals of earlier loads
+    instrument - a load_stats.LoadStats, or another instrumentation
+    object, the stages of the load are reported to
+    Other keyword arguments (batchSize, batchBytes, verbose, cacheSize,
+    seqNames) are passed on to loader_utils.BulkLoader
     """
-    for ivals in build_lagan_ivals(buf, seqDb):
-        alignedIvalsAttrs = dict(id=0, start=1, stop=2, idDest=0, 
-                                 startDest=1, stopDest=2)
-        cti = nlmsa_utils.CoordsToIntervals(seqDb, seqDb,
-                                            alignedIvalsAttrs)
-        al.add_aligned_intervals(cti(ivals))
-
-    # build alignment
-    al.build()
-    return al
+    ifile = input_utils.open_input(buf)
+    try:
+        loader = loader_utils.BulkLoader(al, seqDb, seqDb,
+                                         loader_utils.IVALS_ATTRS,
+                                         instrument=instrument, **kwargs)
+        build_ivals = lambda: build_lagan_ivals(ifile, seqDb, instrument)
+        ivals_iter = cache_utils.cached_ivals(cache, ifile, ('lagan',),
+                                              build_ivals)
+        ivals_iter = load_stats.iter_stage(ivals_iter, instrument, 'ivals',
+                                           len)
+        for ivals in ivals_iter:
+            loader.add(ivals)
+        loader.close()
+
+        # build alignment
+        load_stats.call_stage(instrument, 'build', al.build)
+        return al
+    finally:
+        input_utils.close_input(ifile, buf)
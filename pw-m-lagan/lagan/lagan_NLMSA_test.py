@@ -4,6 +4,7 @@ import unittest
 from pygr import cnestedlist
 from pygr import seqdb
 import lagan_NLMSA
+import ival_arrays
 
 
 class Lagan_NLMSA_test(unittest.TestCase):
@@ -57,6 +58,52 @@ class Lagan_NLMSA_test(unittest.TestCase):
         self.assertEqual(temp_lst, [])
 
         # can add additional manual tests
+
+    def test_align_path(self):
+        """
+        Building from the path of the file gives the same alignments as
+        building from the file buffer
+        """
+        alignment = cnestedlist.NLMSA('test2', mode='memory', seqDict=self.db,
+                                      use_virtual_lpo=True)
+        nlmsa = lagan_NLMSA.create_NLMSA_lagan('output', self.db, alignment)
+
+        s1 = self.db['testgenome1']
+        for s in (s1[71:86], s1[65:70], s1):
+            self.assertEqual([repr(s2) for s2 in nlmsa[s]],
+                             [repr(s2) for s2 in self.temp_nlmsa[s]])
+
+    def test_read_lagan(self):
+        """
+        The rows are read from the header lines' following lines only,
+        from a buffer or a file object alike
+        """
+        seqList, seqNames = lagan_NLMSA.read_lagan(self.buf)
+        self.assertEqual(seqNames, ('testgenome1', 'testgenome2'))
+        self.assertEqual(len(seqList[0]), len(seqList[1]))
+        self.assertEqual(seqList[0].replace('-', ''),
+                         str(self.db['testgenome1']))
+        self.assertEqual(lagan_NLMSA.read_lagan(open('output')),
+                         (seqList, seqNames))
+
+    def test_ival_batches(self):
+        """
+        The ival batches hold the same intervals as the ivals lists
+        """
+        if ival_arrays.numpy is None:
+            return
+
+        expected = []
+        for ivals in lagan_NLMSA.build_lagan_ivals(self.buf, self.db):
+            expected.extend(ivals)
+
+        for batchSize in (1, 1000):
+            result = []
+            for batch, names in lagan_NLMSA.iter_ival_batches(self.buf,
+                                                              batchSize):
+                self.assertTrue(len(batch) <= batchSize)
+                result.extend(ival_arrays.iter_ivals(batch, names))
+            self.assertEqual(result, expected)
         
             
 def suite():
@@ -12,13 +12,14 @@ builds pygr NLMSAs with it. The module does not define any class.
 Functions:
 
 - `read_mlagan()`: read aligned sequences from a mlagan alignment file
-  buffer
-- `find_markers()`: find the > markers in the mlagan alignment buffer and
-  return a list of their location
+  object or buffer
 - `build_interval_list()`: extract all ungapped aligned subintervals from
-  a pair of aligned sequences
+  a pair of aligned sequences (imported from common/interval_utils.py)
+- `get_anchors()`: return the row indices of the reference sequence(s)
 - `build_mlagan_ivals()`: takes a mlagan alignment file buffer as input and
   builds the ivals
+- `iter_ival_batches()`: takes a mlagan alignment file buffer as input and
+  yields the ivals as structured NumPy arrays
 - `create_NLMSA_mlagan()`: takes buffer of a mlagan alignment file,
   sequence db and NLMSA  as input and returns NLMSA
   
@@ -36,123 +37,168 @@ How To Use This Module
    function returns the modified/built NLMSA.
    ``nlmsa_aln = create_NLMSA_mlagan(buf, seqDb, al)``
 
+   buf may also be an open file object, read line by line, or the path
+   of the file, which is then memory-mapped and read the same way:
+   ``nlmsa_aln = create_NLMSA_mlagan('output', seqDb, al)``
+   A gzip or BGZF compressed file, path or buffer is decompressed as it
+   is read.
+
+   To query relative to one genome only, pass its name (or a list of
+   names) as reference; only the reference-other pairs are then
+   aligned, i.e. N-1 pairs instead of N(N-1)/2 for N genomes.
+   ``nlmsa_aln = create_NLMSA_mlagan(buf, seqDb, al, reference='hg18')``
+
 """
 
 __docformat__ = 'restructuredtext'
 
+import os
+import sys
 from pygr import cnestedlist, nlmsa_utils, seqdb
 
+# the code shared by the loaders lives in common/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, 'common'))
+from aligned_fasta import read_aligned_fasta
+from interval_utils import build_interval_list, iter_pair_intervals
+import cache_utils
+import input_utils
+import ival_arrays
+import load_stats
+import loader_utils
+
 def read_mlagan(buf):
     """
-    Read aligned sequences from a mlagan alignment file buffer
+    Read aligned sequences from a mlagan alignment file object or buffer
+    in a single pass (see aligned_fasta.read_aligned_fasta())
     """
-    
-    assert buf[0].startswith('>'), "This doesn't look like fasta file"
+    return read_aligned_fasta(buf)
 
-    # Extracting the sequence and names from mlagan output
-    
-    seqMarker_list, seqInfo_list = find_markers(buf)
-    buf = buf[1:]
-    seqName = []
-    for seqinf in seqInfo_list:
-        buf = buf.replace(seqinf,'')
-        seqName.append(seqinf.split()[0])
-        
-    buf = buf.replace('\n','')
-    seq_List = buf.split('>')
-   
-    return seq_List, seqName
-
-def find_markers(buf):
+def get_anchors(seqNames, reference):
     """
-    Find the > markers and return a list of their locations and
-    the seq info on those lines in a list
+    Return the row indices of the reference sequence(s); reference is a
+    sequence name or a list of sequence names.
     """
-    
-    seqMarker_list = []
-    seqInfo_list = []
-
-    index1 = buf.find('>')
-    while index1 != -1:
-        seqMarker_list.append(index1)
-        index2 = buf.find('\n',index1)
-        seqInfo_list.append(buf[index1+1:index2])
-        index1 = buf.find('>',index1+1)
-
-    return seqMarker_list, seqInfo_list
-
-def build_interval_list(a, b):
-    """
-    Hacky code to extract all ungapped aligned subintervals from a
-    pair of aligned sequences.
-    """
-    interval_list = []
-
-    a_start = None
-    b_start = None
-
-    a_count = b_count = 0
-    for i in range(0, len(a)):
-        if a[i] == '-' or b[i] == '-':
-            if a_start is not None:           # want to end at i-1
-                interval_list.append((a_start, a_count, b_start, b_count))
-
-                a_start = b_start = None
-        else:
-            if a_start is None:
-                a_start = a_count
-                b_start = b_count
-
-        if a[i] != '-':
-            a_count += 1
-        if b[i] != '-':
-            b_count += 1
+    if isinstance(reference, basestring):
+        reference = [reference]
 
-    if a_start is not None:
-        interval_list.append((a_start, a_count, b_start, b_count))
+    anchors = []
+    for name in reference:
+        assert name in seqNames, "%s is not in the alignment" % name
+        anchors.append(seqNames.index(name))
 
-    assert a_count == len(a.replace('-', ''))
-    assert b_count == len(b.replace('-', ''))
-        
-    return interval_list
+    return anchors
 
-def build_mlagan_ivals(buf, seqDb):
+def build_mlagan_ivals(buf, seqDb, reference=None, processes=None,
+                       instrument=None):
     """
     Takes a lagan alignment file buffer as input and builds the
-    ivals
+    ivals. If reference (a sequence name or a list of names) is given,
+    only the ivals between the reference(s) and the other sequences
+    are built. With processes > 1 the pairs of rows are aligned in a
+    pool of worker processes, each receiving the rows once; the ivals
+    are the same and come in the same order. The reading of the
+    aligned sequences is reported to instrument, if given, as the parse
+    stage.
     """
-    seqList, seqNames = read_mlagan(buf)
-    
-    # a multiple alignment considered as a collection of
-    # pairwise alignments so double iteration
-    for i in range(0, len(seqList)):
+    seqList, seqNames = load_stats.call_stage(instrument, 'parse',
+                                              read_mlagan, buf)
+
+    for pairs in _iter_anchor_intervals(seqList, seqNames, reference,
+                                        processes):
         ivals = []
-        seqs1_ival = seqDb[seqNames[i]]
-        seqs1_ival_str = seqList[i]
-        for j in range(i+1, len(seqList)):
-            seqs2_ival = seqDb[seqNames[j]]
-            seqs2_ival_str = seqList[j]
-            interval_list = build_interval_list(seqs1_ival_str,
-                                                    seqs2_ival_str)
+        for (i, j, interval_list) in pairs:
             for (a, b, x, y) in interval_list:
                 ival1 = (seqNames[i], a, b)
                 ival2 = (seqNames[j], x, y)
                 ivals.append((ival1, ival2))
         yield ivals
+
+def iter_ival_batches(buf, reference=None, processes=None,
+                      batchSize=ival_arrays.BATCH_SIZE):
+    """
+    Takes a mlagan alignment file buffer as input and yields its ivals
+    as (batch, names) pairs: batch is a structured array of
+    ival_arrays.IVAL_DTYPE holding the same intervals as
+    build_mlagan_ivals(), ending with the anchor sequence that fills it
+    to batchSize rows, and names the NameTable of its sequence IDs.
+    """
+    seqList, seqNames = read_mlagan(buf)
+    builder = ival_arrays.IvalBatchBuilder(batchSize)
+    ids = [ builder.get_id(name) for name in seqNames ]
+
+    for pairs in _iter_anchor_intervals(seqList, seqNames, reference,
+                                        processes, arrays=True):
+        for (i, j, interval_arrays) in pairs:
+            builder.add_interval_arrays(ids[i], 0, ids[j], 0,
+                                        interval_arrays)
+        if builder.is_full():
+            yield builder.pop(), builder.names
+
+    if len(builder):
+        yield builder.pop(), builder.names
+
+def _iter_anchor_intervals(seqList, seqNames, reference=None,
+                           processes=None, arrays=False):
+    """
+    Yield, for each anchor row i, a list of (i, j, interval_list) tuples:
+    the interval list of the anchor with each row j it is aligned to,
+    or its four coordinate arrays if arrays is True (see
+    interval_utils.build_interval_arrays()).
+    """
+    if reference is None:
+        anchors = range(0, len(seqList))
+    else:
+        anchors = get_anchors(seqNames, reference)
+    
+    # a multiple alignment considered as a collection of
+    # pairwise alignments so double iteration; each pair is
+    # aligned only once
+    done = set()
+    anchor_pairs = []
+    for i in anchors:
+        done.add(i)
+        anchor_pairs.append([ (i, j) for j in range(0, len(seqList))
+                              if j not in done ])
+
+    # one task per pair, so the workers stay busy even with few anchors
+    tasks = [ [pair] for pairs in anchor_pairs for pair in pairs ]
+    results = iter_pair_intervals(seqList, tasks, processes, arrays=arrays)
+    for pairs in anchor_pairs:
+        yield [ (i, j, results.next()[0]) for (i, j) in pairs ]
             
-def create_NLMSA_mlagan(buf, seqDb,al):
+def create_NLMSA_mlagan(buf, seqDb, al, reference=None, cache=None,
+                        processes=None, instrument=None, **kwargs):
     """
     Takes mlagan alignment file buffer as input and creates and
     returns NLMSA
+    reference - a sequence name, or a list of names, to align all the
+    other sequences against; by default every pair of sequences is aligned
+    cache - a cache_utils.IvalsCache holding the ivals of earlier loads
+    processes - the number of worker processes aligning the pairs of rows
+    instrument - a load_stats.LoadStats, or another instrumentation
+    object, the stages of the load are reported to
+    Other keyword arguments (batchSize, batchBytes, verbose, cacheSize,
+    seqNames) are passed on to loader_utils.BulkLoader
     """
-    for ivals in build_mlagan_ivals(buf, seqDb):
-        alignedIvalsAttrs = dict(id=0, start=1, stop=2, idDest=0, 
-                                 startDest=1, stopDest=2)
-        cti = nlmsa_utils.CoordsToIntervals(seqDb, seqDb,
-                                            alignedIvalsAttrs)
-        al.add_aligned_intervals(cti(ivals))
-
-
-    # build alignment
-    al.build()
-    return al
+    ifile = input_utils.open_input(buf)
+    try:
+        loader = loader_utils.BulkLoader(al, seqDb, seqDb,
+                                         loader_utils.IVALS_ATTRS,
+                                         instrument=instrument, **kwargs)
+        build_ivals = lambda: build_mlagan_ivals(ifile, seqDb, reference,
+                                                 processes, instrument)
+        ivals_iter = cache_utils.cached_ivals(cache, ifile,
+                                              ('mlagan', reference),
+                                              build_ivals)
+        ivals_iter = load_stats.iter_stage(ivals_iter, instrument, 'ivals',
+                                           len)
+        for ivals in ivals_iter:
+            loader.add(ivals)
+        loader.close()
+
+        # build alignment
+        load_stats.call_stage(instrument, 'build', al.build)
+        return al
+    finally:
+        input_utils.close_input(ifile, buf)
@@ -4,6 +4,7 @@ import unittest
 from pygr import cnestedlist
 from pygr import seqdb
 import mlagan_NLMSA
+import ival_arrays
 
 class mlagan_NLMSA_test(unittest.TestCase):
 
@@ -58,6 +59,85 @@ class mlagan_NLMSA_test(unittest.TestCase):
         self.assertEqual(temp_lst, [])
 
         # can add additional manual tests
+
+    def test_parallel_ivals(self):
+        """
+        Aligning the pairs of rows in worker processes gives the same
+        ivals in the same order
+        """
+        for reference in (None, 'testgenome2'):
+            serial = list(mlagan_NLMSA.build_mlagan_ivals(self.buf, self.db,
+                                                          reference))
+            parallel = list(mlagan_NLMSA.build_mlagan_ivals(self.buf, self.db,
+                                                            reference, 2))
+            self.assertEqual(parallel, serial)
+
+    def test_ival_batches(self):
+        """
+        The ival batches hold the same intervals as the ivals lists
+        """
+        if ival_arrays.numpy is None:
+            return
+
+        for reference in (None, 'testgenome2'):
+            expected = []
+            for ivals in mlagan_NLMSA.build_mlagan_ivals(self.buf, self.db,
+                                                         reference):
+                expected.extend(ivals)
+
+            result = []
+            for batch, names in mlagan_NLMSA.iter_ival_batches(self.buf,
+                                                               reference,
+                                                               batchSize=2):
+                result.extend(ival_arrays.iter_ivals(batch, names))
+            self.assertEqual(result, expected)
+
+    def test_reference_ivals(self):
+        """
+        With a reference only the reference-other pairs are built
+        """
+
+        all_ivals = []
+        for ivals in mlagan_NLMSA.build_mlagan_ivals(self.buf, self.db):
+            all_ivals.extend(ivals)
+
+        ref_ivals = []
+        for ivals in mlagan_NLMSA.build_mlagan_ivals(self.buf, self.db,
+                                                     'testgenome1'):
+            ref_ivals.extend(ivals)
+
+        self.assertEqual(set([(i[0][0], i[1][0]) for i in ref_ivals]),
+                         set([('testgenome1', 'testgenome3'),
+                              ('testgenome1', 'testgenome2')]))
+        self.assertEqual(ref_ivals, [i for i in all_ivals
+                                     if i[0][0] == 'testgenome1'])
+
+        ref_ivals = []
+        for ivals in mlagan_NLMSA.build_mlagan_ivals(self.buf, self.db,
+                                                     ['testgenome2']):
+            ref_ivals.extend(ivals)
+        self.assertEqual(set([(i[0][0], i[1][0]) for i in ref_ivals]),
+                         set([('testgenome2', 'testgenome1'),
+                              ('testgenome2', 'testgenome3')]))
+
+    def test_reference_align(self):
+        alignment = cnestedlist.NLMSA('test_ref', mode='memory',
+                                      seqDict=self.db, use_virtual_lpo=True)
+        nlmsa = mlagan_NLMSA.create_NLMSA_mlagan(self.buf, self.db,
+                                                 alignment,
+                                                 reference='testgenome1')
+
+        s1 = self.db['testgenome1']
+        temp_lst = []
+        for s2 in nlmsa[s1[71:86]]:
+            temp_lst.append(str(s2))
+        self.assertEqual(temp_lst,['GCTTTTCATTCTGAC', 'GCTTTTCATTCTGAC'])
+
+        # testgenome3 is aligned to the reference but not to testgenome2
+        s3 = self.db['testgenome3']
+        self.assertEqual([repr(s2) for s2 in nlmsa[s3[1:16]]],
+                         ['testgenome1[71:86]'])
+        self.assertEqual(len(self.temp_nlmsa[s3[1:16]]), 2)
         
             
 def suite():